@@ -0,0 +1,338 @@
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from types import SimpleNamespace
+
+# ==================================================
+# Benchmark：python benchmark.py [--save] [--check]
+# ==================================================
+# micro：單一函式（ML 機率、每個 rule_*、calculate_disease_probabilities、LLM JSON 解析）
+# e2e  ：整個 /predict（JWT 驗證 → CPU pool 計算 → Gemini → 寫入佇列），
+#        Gemini 用 gemini_stub.py（ASGITransport，不走網路）、Supabase 用記憶體 stub、JWT 用本機簽發的 token。
+#
+# 每項回報 p50 / p95 / p99 延遲、throughput 與單次呼叫的記憶體配置峰值（tracemalloc）。
+# 結果與 benchmark_baseline.json 比較；--check 時任何一項 p50 退步超過 --threshold 就以 exit code 1 結束。
+#
+# baseline 是絕對時間，只對錄製它的機器有意義，所以不放進 repo（.gitignore）：
+# 在 CI / 目標機器上先跑一次 --save，之後的 --check 都在同一台機器上比較。
+# - baseline 記錄 host（OS、CPU 架構、核心數、Python 版本）；host 不同時 --check 直接以 exit code 2 拒絕比較
+# - 每次都先跑一個固定的純 Python calibration 迴圈，比較時依 calibration 的比例調整 baseline，
+#   抵消同一台機器上 CPU 頻率 / 負載造成的整體快慢
+
+BASELINE_PATH = "benchmark_baseline.json"
+JWT_SECRET = "benchmark-only-jwt-secret-0123456789abcdef"  # HS256 建議至少 32 bytes
+
+# main.py 在 import 時就檢查這些設定；benchmark 不需要真的 Supabase / Gemini
+os.environ.setdefault("SUPABASE_URL", "http://supabase.stub")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "stub-service-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", JWT_SECRET)
+os.environ.setdefault("GEMINI_API_KEY", "stub-key")
+
+SAMPLE_INPUT = {
+    "age": 58, "gender": "Male", "systolic_bp": 142, "diastolic_bp": 91,
+    "cholesterol": 2, "glucose": 1, "smoke": 1, "alcohol": 0, "active": 0,
+    "height": 172.0, "weight": 84.0, "stress_level": 2, "high_fat_diet": 2,
+    "symptoms": ["chest_tightness"], "hypertension": 1, "family_heart_disease": 1,
+    "avg_glucose_level": 118.5, "bmi": 28.4, "smoking_status": "smokes",
+    "medical_history": "Occasional chest tightness when climbing stairs."
+}
+
+SAMPLE_LLM_TEXT = "```json\n" + json.dumps({
+    "possible_diseases": [{"name": "Hypertension (high blood pressure)", "probability": 70.0}],
+    "summary": "Your blood pressure is high.\x07 Additionally, you may also keep an eye on: Stroke.",
+    "recommendations": ["Walk daily, because it helps the heart."] * 6
+}) + "\n```"
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def _summary(samples_ns, elapsed_s, unit=1e3):
+    """samples_ns → 以 µs（unit=1e3）或 ms（unit=1e6）表示的統計"""
+    samples = sorted(samples_ns)
+    return {
+        "p50": round(percentile(samples, 50) / unit, 2),
+        "p95": round(percentile(samples, 95) / unit, 2),
+        "p99": round(percentile(samples, 99) / unit, 2),
+        "mean": round(sum(samples) / len(samples) / unit, 2),
+        "throughput_per_s": round(len(samples) / elapsed_s, 1) if elapsed_s else 0.0,
+        "n": len(samples)
+    }
+
+
+def _peak_alloc_bytes(fn, calls=50):
+    """呼叫 fn 時 tracemalloc 觀察到的最大暫時配置量（每次呼叫，取最大值）"""
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        return peak
+    finally:
+        tracemalloc.stop()
+
+
+def bench_micro(fn, iterations, warmup=200):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter_ns()
+        fn()
+        samples.append(time.perf_counter_ns() - t0)
+    elapsed = time.perf_counter() - start
+    result = _summary(samples, elapsed)
+    result["peak_alloc_kib"] = round(_peak_alloc_bytes(fn) / 1024, 2)
+    return result
+
+
+def _calibration_work():
+    # 固定的純 Python 工作：浮點運算、dict / list 操作與 json 編碼，性質接近被量測的程式碼
+    values = {f"k{i}": i * 0.5 for i in range(64)}
+    total = 0.0
+    for key, value in values.items():
+        total += value * value if key[-1] in "02468" else value / 3
+    return json.dumps([total, sorted(values)[:8]])
+
+
+def calibrate(iterations=2000):
+    """calibration 迴圈的 p50（µs）"""
+    return bench_micro(_calibration_work, iterations)["p50"]
+
+
+def host_info():
+    return {
+        "system": platform.system(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def micro_cases():
+    import main
+    import models
+    import scoring
+
+    models.registry.load_all()
+    data = SimpleNamespace(**SAMPLE_INPUT)
+    return {
+        "predict_cardio_probability": lambda: models.predict_cardio_probability(data),
+        "predict_stroke_probability": lambda: models.predict_stroke_probability(data),
+        "rule_hypertension": lambda: scoring.rule_hypertension(data),
+        "rule_hyperlipidemia": lambda: scoring.rule_hyperlipidemia(data),
+        "rule_cad": lambda: scoring.rule_cad(data),
+        "rule_arrhythmia_by_symptoms": lambda: scoring.rule_arrhythmia_by_symptoms(data),
+        "calculate_disease_probabilities": lambda: scoring.calculate_disease_probabilities(data),
+        "parse_llm_json": lambda: main.parse_llm_json(SAMPLE_LLM_TEXT),
+    }
+
+
+# ---------- e2e stubs ----------
+
+class _StubQuery:
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        self.rows = []
+
+    def insert(self, rows):
+        self.rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def execute(self):
+        data = []
+        for row in self.rows:
+            row = {"id": next(self.store.ids), **row}
+            self.store.tables.setdefault(self.table, []).append(row)
+            data.append(row)
+        return SimpleNamespace(data=data)
+
+
+class StubSupabase:
+    """只實作 main.py 用到的 supabase.table(...).insert(...).execute()"""
+
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.tables = {}
+
+    def table(self, name):
+        return _StubQuery(self, name)
+
+
+def mint_token(user_id=None, ttl=3600):
+    import jwt
+
+    now = int(time.time())
+    return jwt.encode({
+        "sub": user_id or str(uuid.uuid4()),
+        "aud": "authenticated",
+        "role": "authenticated",
+        "iat": now,
+        "exp": now + ttl
+    }, os.environ["SUPABASE_JWT_SECRET"], algorithm="HS256")
+
+
+def _request_body(rng):
+    # 每個 request 的輸入略有不同，避免全部命中 LLM 快取
+    body = dict(SAMPLE_INPUT)
+    body["age"] = rng.randint(30, 85)
+    body["systolic_bp"] = rng.randint(100, 180)
+    body["weight"] = float(rng.randint(50, 110))
+    return body
+
+
+async def _e2e(requests, concurrency, gemini_latency):
+    import httpx
+
+    import gemini_stub
+    import main
+    from llm_client import GeminiClient
+
+    gemini_stub.LATENCY = gemini_latency
+    gemini_stub.JITTER = 0.0
+    main.supabase = StubSupabase()
+    main.gemini_client = GeminiClient(
+        "http://gemini.stub", "stub-key", main.GEMINI_MODEL,
+        transport=httpx.ASGITransport(app=gemini_stub.app)
+    )
+    # ASGITransport 不會觸發 startup / shutdown，這裡手動呼叫
+    main.load_models()
+    await main.start_report_writer()
+
+    rng = random.Random(42)
+    headers = {"Authorization": f"Bearer {mint_token()}"}
+    bodies = [_request_body(rng) for _ in range(requests)]
+    warmup_bodies = [_request_body(rng) for _ in range(min(20, requests))]
+    alloc_bodies = [_request_body(rng) for _ in range(min(50, requests))]
+    samples, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://app") as client:
+        async def one(body):
+            nonlocal errors
+            async with semaphore:
+                t0 = time.perf_counter_ns()
+                response = await client.post("/predict", json=body, headers=headers)
+                samples.append(time.perf_counter_ns() - t0)
+                if response.status_code != 200:
+                    errors += 1
+
+        for body in warmup_bodies:  # 暖機（不計入結果）
+            await one(body)
+        samples.clear()
+        errors = 0
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(body) for body in bodies))
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        await asyncio.gather(*(one(body) for body in alloc_bodies))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    await main.stop_background_work()
+    result = _summary(samples[:requests], elapsed, unit=1e6)
+    result.update({
+        "errors": errors,
+        "concurrency": concurrency,
+        "gemini_latency_s": gemini_latency,
+        "peak_alloc_kib": round(peak / 1024, 2)
+    })
+    return result
+
+
+def run(args):
+    results = {"host": host_info(), "micro_us": {}, "e2e_ms": {}}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  # main.py 的 DEBUG print 不印在畫面上
+        results["calibration_us"] = calibrate()
+        for name, fn in micro_cases().items():
+            results["micro_us"][name] = bench_micro(fn, args.iterations)
+        if not args.micro_only:
+            results["e2e_ms"]["predict"] = asyncio.run(_e2e(args.requests, args.concurrency, args.gemini_latency))
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    # baseline 依 calibration 的比例換算成「這台機器現在的速度」下應有的數字
+    scale = 1.0
+    if baseline.get("calibration_us") and results.get("calibration_us"):
+        scale = results["calibration_us"] / baseline["calibration_us"]
+        print(f"calibration: {results['calibration_us']} µs (baseline {baseline['calibration_us']} µs, "
+              f"baseline scaled ×{scale:.2f})")
+    print(f"{'benchmark':45} {'p50':>10} {'p95':>10} {'p99':>10} {'thru/s':>10} {'alloc KiB':>10} {'Δp50':>8}")
+    for group, unit in (("micro_us", "µs"), ("e2e_ms", "ms")):
+        for name, r in results[group].items():
+            base = baseline.get(group, {}).get(name)
+            delta = ""
+            if base and base["p50"]:
+                expected = base["p50"] * scale
+                change = (r["p50"] - expected) / expected
+                delta = f"{change:+.0%}"
+                if change > threshold:
+                    regressions.append(f"{group}.{name}")
+            print(f"{name + ' (' + unit + ')':45} {r['p50']:>10} {r['p95']:>10} {r['p99']:>10} "
+                  f"{r['throughput_per_s']:>10} {r['peak_alloc_kib']:>10} {delta:>8}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the prediction pipeline.")
+    parser.add_argument("--iterations", type=int, default=2000, help="calls per micro-benchmark")
+    parser.add_argument("--requests", type=int, default=300, help="end-to-end /predict requests")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--gemini-latency", type=float, default=0.0, help="stub Gemini latency in seconds")
+    parser.add_argument("--micro-only", action="store_true")
+    parser.add_argument("--save", action="store_true", help=f"write results to {BASELINE_PATH}")
+    parser.add_argument("--check", action="store_true",
+                        help="exit 1 when a p50 regresses beyond --threshold (baseline must come from --save on this host)")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baseline = json.load(f)
+    other_host = bool(baseline) and baseline.get("host") != results["host"]
+    if other_host:
+        print(f"WARNING: {BASELINE_PATH} was recorded on a different host ({baseline.get('host')}); "
+              f"regenerate it with --save on this machine")
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"✅ Baseline written to {BASELINE_PATH}")
+    elif args.check and (not baseline or other_host):
+        print("❌ --check needs a baseline recorded on this host: run `python benchmark.py --save` here first")
+        sys.exit(2)
+    if regressions:
+        print(f"❌ p50 regressed more than {args.threshold:.0%}: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,373 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from models import registry, to_display_probabilities
+from rules import RULE_FIELDS, RULE_INPUTS, evaluate_columns
+from settings import SCORING_MODE
+
+# ==================================================
+# 批次篩檢：python bulk_score.py input.csv output.csv
+# ==================================================
+# 以固定大小的 chunk 串流讀取 CSV，每個 chunk 用與 predict_cardio_probability /
+# predict_stroke_probability 相同的特徵轉換、模型（models.registry，與 serving 相同的
+# SCORING_MODE / MODEL_VARIANT）與 rules.py 的規則表整批計算，
+# 結果立即附加寫出（CSV 或 Parquet），記憶體用量與檔案大小無關。
+#
+# 欄位名稱與 /predict 的 PredictionInput 相同；cardio.csv 的欄位名稱也可以直接使用
+# （ap_hi / ap_lo / alco / gluc，gender 1=female 2=male）。cardio.csv 的 age 是天數，
+# 請加上 --age-unit days。症狀欄位（symptoms / arrhythmia_symptoms）以 ";" 分隔。
+#
+# 要算哪些模型由 --model 決定（預設 auto：輸入有哪個模型需要的全部欄位就算哪個），
+# 規則只計算輸入欄位齊全的（rules.RULE_INPUTS），所以 cardio.csv / stroke.csv 都可以直接輸入：
+#   python bulk_score.py cardio.csv out.csv --sep ';' --age-unit days
+#   python bulk_score.py stroke.csv out.csv
+#   python bulk_score.py --check     用兩個 CSV 的前幾百列跑一次 CLI 並檢查結果
+
+CARDIO_COLUMN_ALIASES = {
+    "ap_hi": "systolic_bp",
+    "ap_lo": "diastolic_bp",
+    "alco": "alcohol",
+    "gluc": "glucose",
+}
+LIST_COLUMNS = ["symptoms", "arrhythmia_symptoms"]
+# 每個模型需要的欄位（stroke 的 BMI 可以由 height / weight 計算，或直接給 bmi 欄位）
+MODEL_COLUMNS = {
+    "cardio": ["age", "gender", "systolic_bp", "diastolic_bp", "smoke", "alcohol", "active", "height", "weight"],
+    "stroke": ["age", "gender", "hypertension", "family_heart_disease", "avg_glucose_level", "smoking_status"],
+}
+
+# 輸出欄位 → 規則名稱
+RULE_OUTPUT_COLUMNS = {
+    "hypertension_risk": "Hypertension (high blood pressure)",
+    "hyperlipidemia_risk": "Hyperlipidemia (high cholesterol)",
+    "cad_risk": "Coronary Artery Disease (heart artery block)",
+    "arrhythmia_risk": "Arrhythmia / Palpitations",
+}
+
+def _scoring_context():
+    # 每個 process 只載入一次；與 serving 相同的 registry key（已依 SCORING_MODE / MODEL_VARIANT 註冊）
+    if not registry.snapshot():
+        registry.load_all()
+    return registry.snapshot()
+
+
+def _missing_columns(columns, model):
+    missing = [c for c in MODEL_COLUMNS[model] if c not in columns]
+    if model == "stroke" and "bmi" not in columns and not {"height", "weight"} <= set(columns):
+        missing.append("bmi (or height + weight)")
+    return missing
+
+
+def resolve_models(columns, requested="auto"):
+    """回傳要計算的模型；requested 指定的模型缺欄位時丟出 SystemExit"""
+    columns = {CARDIO_COLUMN_ALIASES.get(c, c) for c in columns}
+    if requested != "auto":
+        names = list(MODEL_COLUMNS) if requested == "all" else [requested]
+        for name in names:
+            missing = _missing_columns(columns, name)
+            if missing:
+                raise SystemExit(f"Input is missing columns required by the {name} model: {', '.join(missing)}")
+        return names
+    names = [name for name in MODEL_COLUMNS if not _missing_columns(columns, name)]
+    if not names:
+        details = "; ".join(f"{name}: {', '.join(_missing_columns(columns, name))}" for name in MODEL_COLUMNS)
+        raise SystemExit(f"Input has the columns of neither model ({details})")
+    return names
+
+
+def resolve_rules(columns):
+    """輸入欄位齊全的規則名稱"""
+    columns = {CARDIO_COLUMN_ALIASES.get(c, c) for c in columns}
+    return [name for name, inputs in RULE_INPUTS.items() if set(inputs) <= columns]
+
+
+def normalize_chunk(df, age_unit="years"):
+    """欄位別名、單位與症狀清單轉換成 PredictionInput 的格式"""
+    df = df.rename(columns={k: v for k, v in CARDIO_COLUMN_ALIASES.items() if k in df.columns and v not in df.columns})
+    if age_unit == "days":
+        df["age"] = df["age"] / 365.25
+    if pd.api.types.is_numeric_dtype(df["gender"]):
+        df["gender"] = df["gender"].map({1: "Female", 2: "Male"})
+    for col in LIST_COLUMNS:
+        if col in df.columns:
+            df[col] = [
+                [s.strip() for s in v.split(";") if s.strip()] if isinstance(v, str) else []
+                for v in df[col]
+            ]
+    return df
+
+
+def _numeric(df, col):
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+
+
+def cardio_feature_matrix(df, stats):
+    """cardio_feature_row 的向量化版本，欄位順序為 stats["features"]"""
+    medians = stats["medians"]
+    levels = stats["valid_levels"]
+
+    cholesterol = _numeric(df, "cholesterol") if "cholesterol" in df.columns else np.full(len(df), np.nan)
+    glucose = _numeric(df, "glucose") if "glucose" in df.columns else np.full(len(df), np.nan)
+    cholesterol = np.where(np.isin(cholesterol, levels["cholesterol"]), cholesterol, medians["cholesterol"])
+    glucose = np.where(np.isin(glucose, levels["gluc"]), glucose, medians["gluc"])
+
+    gender = df["gender"].map(stats["category_maps"]["gender"]).fillna(stats["defaults"]["gender"])
+
+    columns = {
+        "age_years": _numeric(df, "age"),
+        "gender": gender.to_numpy(dtype=float),
+        "ap_hi": _numeric(df, "systolic_bp"),
+        "ap_lo": _numeric(df, "diastolic_bp"),
+        "cholesterol": cholesterol,
+        "gluc": glucose,
+        "smoke": _numeric(df, "smoke"),
+        "alco": _numeric(df, "alcohol"),
+        "active": _numeric(df, "active"),
+        "height": _numeric(df, "height"),
+        "weight": _numeric(df, "weight"),
+    }
+    return np.column_stack([columns[f] for f in stats["features"]])
+
+
+def stroke_feature_matrix(df, stats):
+    """stroke_feature_row 的向量化版本（BMI 由身高體重計算，身高缺失時用訓練中位數）"""
+    maps = stats["category_maps"]
+    defaults = stats["defaults"]
+
+    if {"height", "weight"} <= set(df.columns):
+        height = _numeric(df, "height")
+        weight = _numeric(df, "weight")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bmi = np.where(height > 0, weight / ((height / 100) ** 2), stats["fill_values"]["bmi"])
+    else:
+        # stroke.csv 只有 bmi（缺失為 "N/A"）
+        bmi = np.nan_to_num(_numeric(df, "bmi"), nan=stats["fill_values"]["bmi"])
+
+    smoking_map = maps["smoking_status"]
+    fallback = smoking_map[defaults["smoking_status"]]
+    one_hot = np.array([smoking_map.get(v, fallback) for v in df["smoking_status"]], dtype=float).reshape(-1, 4)
+
+    columns = {
+        "age": _numeric(df, "age"),
+        "gender": df["gender"].map(maps["gender"]).fillna(defaults["gender"]).to_numpy(dtype=float),
+        "hypertension": _numeric(df, "hypertension"),
+        "family_heart_disease": _numeric(df, "family_heart_disease"),
+        "avg_glucose_level": _numeric(df, "avg_glucose_level"),
+        "bmi": bmi,
+        "smoking_status_never smoked": one_hot[:, 0],
+        "smoking_status_formerly smoked": one_hot[:, 1],
+        "smoking_status_smokes": one_hot[:, 2],
+        "smoking_status_N/A": one_hot[:, 3],
+    }
+    return np.column_stack([columns[f] for f in stats["features"]])
+
+
+def _predict_cardio(models, X, features):
+    # 與 models.predict_cardio_probabilities 相同的分支
+    if SCORING_MODE != "sklearn":
+        return models["cardio_compiled"].predict_matrix(X)
+    X = models["cardio_scaler"].transform(pd.DataFrame(X, columns=features))
+    return models["cardio_model"].predict_proba(X)[:, 1]
+
+
+def _predict_stroke(models, X, features):
+    if SCORING_MODE != "sklearn":
+        return models["stroke_compiled"].predict_matrix(X)
+    return models["stroke_model"].predict_proba(pd.DataFrame(X, columns=features))[:, 1]
+
+
+def score_chunk(df, age_unit="years", id_column="id", models=("cardio", "stroke"), rules=None):
+    """
+    單一 chunk：回傳 id + 各疾病機率（0~100，與 /predict 相同的顯示規則）的 DataFrame。
+    models / rules 為要計算的模型與規則名稱（見 resolve_models / resolve_rules；rules=None 表示全部）。
+    """
+    snapshot = _scoring_context()  # 整個 chunk 用同一份 snapshot
+    df = normalize_chunk(df, age_unit)
+
+    out = pd.DataFrame(index=df.index)
+    if id_column and id_column in df.columns:
+        out[id_column] = df[id_column]
+
+    if "cardio" in models:
+        stats = snapshot["cardio_stats"]
+        cardio = _predict_cardio(snapshot, cardio_feature_matrix(df, stats), stats["features"])
+        out["cardio_risk"] = to_display_probabilities(cardio.tolist())
+    if "stroke" in models:
+        stats = snapshot["stroke_stats"]
+        stroke = _predict_stroke(snapshot, stroke_feature_matrix(df, stats), stats["features"])
+        out["stroke_risk"] = to_display_probabilities(stroke.tolist())
+
+    columns = {}
+    for field in set(RULE_FIELDS) & set(df.columns):
+        values = df[field]
+        columns[field] = values.to_numpy() if pd.api.types.is_numeric_dtype(values) else values.to_numpy(dtype=object)
+    rule_probs = evaluate_columns(columns, len(df))
+    for col, name in RULE_OUTPUT_COLUMNS.items():
+        if rules is None or name in rules:
+            out[col] = rule_probs[name]
+    return out
+
+
+class _CsvWriter:
+    def __init__(self, path):
+        self.path = path
+        self._header = True
+
+    def write(self, df):
+        df.to_csv(self.path, mode="w" if self._header else "a", header=self._header, index=False)
+        self._header = False
+
+    def close(self):
+        if self._header:  # 沒有任何資料時仍建立空檔
+            open(self.path, "w").close()
+
+
+class _ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow (pip install pyarrow).")
+        self.path = path
+        self._writer = None
+
+    def write(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def open_writer(path, fmt=None):
+    fmt = fmt or ("parquet" if path.endswith(".parquet") else "csv")
+    return _ParquetWriter(path) if fmt == "parquet" else _CsvWriter(path)
+
+
+def iter_scored_chunks(chunks, workers=1, **kwargs):
+    """依輸入順序產生結果；workers > 1 時最多同時處理 2 * workers 個 chunk（記憶體有上限）"""
+    if workers <= 1:
+        for chunk in chunks:
+            yield score_chunk(chunk, **kwargs)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_scoring_context) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(score_chunk, chunk, **kwargs))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a population CSV in chunks.")
+    parser.add_argument("input", nargs="?", help="input CSV file")
+    parser.add_argument("output", nargs="?", help="output file (.csv or .parquet)")
+    parser.add_argument("--format", choices=["csv", "parquet"], help="output format (default: by extension)")
+    parser.add_argument("--sep", default=",", help="input CSV separator (cardio.csv uses ';')")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="rows per chunk")
+    parser.add_argument("--workers", type=int, default=1, help="process pool size for scoring chunks")
+    parser.add_argument("--age-unit", choices=["years", "days"], default="years")
+    parser.add_argument("--id-column", default="id", help="input column copied to the output")
+    parser.add_argument("--model", choices=["auto", "all", *MODEL_COLUMNS], default="auto",
+                        help="models to run (default: every model whose columns are present)")
+    parser.add_argument("--nrows", type=int, help="only score the first N rows")
+    parser.add_argument("--check", action="store_true", help="run the CLI on the first rows of cardio.csv and stroke.csv")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        return 0 if check() else 1
+    if not args.input or not args.output:
+        parser.error("input and output are required")
+
+    header = pd.read_csv(args.input, sep=args.sep, nrows=0).columns
+    models = resolve_models(header, args.model)
+    rules = resolve_rules(header)
+    skipped = [name for name in RULE_INPUTS if name not in rules]
+    if skipped:
+        print(f"INFO: Skipping rules without their input columns: {', '.join(skipped)}")
+
+    reader = pd.read_csv(args.input, sep=args.sep, chunksize=args.chunk_size, nrows=args.nrows)
+    writer = open_writer(args.output, args.format)
+    start = time.perf_counter()
+    rows = 0
+    try:
+        for scored in iter_scored_chunks(reader, args.workers, age_unit=args.age_unit, id_column=args.id_column,
+                                         models=models, rules=rules):
+            writer.write(scored)
+            rows += len(scored)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Scored {rows} rows ({', '.join(models)}) in {elapsed:.1f}s "
+          f"({rows / elapsed if elapsed else 0:.0f} rows/s) → {args.output}")
+    return 0
+
+
+# ==================================================
+# 檢查：python bulk_score.py --check
+# ==================================================
+# 用 cardio.csv / stroke.csv 的前 CHECK_ROWS 列實際跑一次 CLI，確認選到的模型、輸出欄位與機率範圍；
+# cardio 另外逐筆與 serving 的 predict_cardio_probabilities 比對。
+
+CHECK_ROWS = 300
+CHECK_CASES = [
+    ("cardio.csv", ["--sep", ";", "--age-unit", "days"], ["cardio_risk", "hypertension_risk"]),
+    ("stroke.csv", [], ["stroke_risk"]),
+]
+
+
+def _serving_cardio(path, rows):
+    from types import SimpleNamespace
+    from models import predict_cardio_probabilities
+
+    df = normalize_chunk(pd.read_csv(path, sep=";", nrows=rows), "days")
+    records = [SimpleNamespace(**r) for r in df.to_dict("records")]
+    return predict_cardio_probabilities(records)
+
+
+def check():
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for path, extra, expected in CHECK_CASES:
+            output = os.path.join(tmp, f"{os.path.splitext(os.path.basename(path))[0]}_scored.csv")
+            main([path, output, "--nrows", str(CHECK_ROWS), *extra])
+            out = pd.read_csv(output)
+            risk = [c for c in out.columns if c.endswith("_risk")]
+            problems = []
+            if len(out) != CHECK_ROWS:
+                problems.append(f"{len(out)} rows")
+            if sorted(risk) != sorted(expected):
+                problems.append(f"columns {risk}")
+            if out[risk].isna().any().any() or not out[risk].apply(lambda c: c.between(0, 100).all()).all():
+                problems.append("probabilities outside 0~100")
+            if "cardio_risk" in out.columns:
+                serving = _serving_cardio(path, CHECK_ROWS)
+                diff = float(np.abs(out["cardio_risk"].to_numpy() - np.array(serving)).max())
+                if diff > 0.1:  # 顯示值取到小數一位
+                    problems.append(f"cardio differs from predict_cardio_probabilities by {diff}")
+            ok = ok and not problems
+            print(f"{'✅' if not problems else '❌'} {path}: {len(out)} rows, columns {risk}"
+                  + (f" — {'; '.join(problems)}" if problems else ""))
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,140 @@
+import json
+import math
+import sys
+
+
+# ==================================================
+# Compiled scorer：把 StandardScaler + LogisticRegression 匯出成純係數
+# ==================================================
+# cardio：11 個特徵先標準化再做 dot product；stroke：10 個特徵直接 dot product。
+# serving 只需要這個檔案與 *_compiled.json，不需要 import pandas / sklearn。
+
+def _sigmoid(z):
+    # 數值穩定版本，避免 exp 溢位
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+
+class LinearScorer:
+    def __init__(self, features, coef, intercept, mean=None, scale=None):
+        self.features = list(features)
+        self.coef = [float(c) for c in coef]
+        self.intercept = float(intercept)
+        self.mean = [float(m) for m in mean] if mean is not None else None
+        self.scale = [float(s) for s in scale] if scale is not None else None
+
+        # 不把標準化併入係數，逐項計算 w * (x - mean) / scale，維持與 sklearn 相同的運算順序
+        self._terms = list(zip(
+            self.coef,
+            self.mean or [0.0] * len(self.coef),
+            self.scale or [1.0] * len(self.coef)
+        ))
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["features"], d["coef"], d["intercept"], d.get("mean"), d.get("scale"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self):
+        return {
+            "features": self.features,
+            "coef": self.coef,
+            "intercept": self.intercept,
+            "mean": self.mean,
+            "scale": self.scale
+        }
+
+    def decision(self, values):
+        """values：依 self.features 順序排好的數值"""
+        z = self.intercept
+        for x, (w, m, s) in zip(values, self._terms):
+            z += w * ((x - m) / s)
+        return z
+
+    def predict_rows(self, rows):
+        """rows：feature name → value 的 dict list，回傳陽性機率 list"""
+        features = self.features
+        return [_sigmoid(self.decision([float(row[f]) for f in features])) for row in rows]
+
+    def predict_matrix(self, X):
+        """批次計算（NumPy）：X 的欄位順序必須與 self.features 相同"""
+        import numpy as np
+
+        X = np.asarray(X, dtype=np.float64)
+        if self.mean is not None:
+            X = (X - np.asarray(self.mean)) / np.asarray(self.scale)
+        z = X @ np.asarray(self.coef) + self.intercept
+        return 0.5 * (1.0 + np.tanh(0.5 * z))  # = sigmoid(z)，不會溢位
+
+
+def export_linear_model(model, features, scaler=None):
+    """從已訓練的 sklearn 物件匯出係數（二元 LogisticRegression）"""
+    return LinearScorer(
+        features,
+        model.coef_[0],
+        model.intercept_[0],
+        scaler.mean_ if scaler is not None else None,
+        scaler.scale_ if scaler is not None else None
+    ).to_dict()
+
+
+# ==================================================
+# Parity check：python compiled_scorer.py --check
+# 用 cardio.csv / stroke.csv 全部資料比對 sklearn 與 compiled 結果
+# ==================================================
+PARITY_TOLERANCE = 1e-9
+
+
+def check_parity():
+    import joblib
+    import pandas as pd
+    import models
+
+    cardio = pd.read_csv("cardio.csv", sep=";")
+    cardio["age_years"] = cardio["age"] / 365.25
+    cardio["gender"] = cardio["gender"].map({1: 0, 2: 1})
+    X_cardio = cardio[models.CARDIO_FEATURES]
+
+    stroke = pd.read_csv("stroke.csv")
+    stroke_stats = models.stroke_feature_stats(stroke)
+    stroke["bmi"] = stroke["bmi"].fillna(stroke_stats["fill_values"]["bmi"])
+    stroke["gender"] = stroke["gender"].map(stroke_stats["category_maps"]["gender"])
+    stroke = pd.get_dummies(stroke, columns=["smoking_status"], drop_first=False)
+    for col in models.STROKE_SMOKING_COLS:
+        if col not in stroke.columns:
+            stroke[col] = 0
+    X_stroke = stroke[models.STROKE_FEATURES].astype(float)
+
+    cardio_model = joblib.load(models.CARDIO_MODEL_PATH)
+    scaler = joblib.load(models.CARDIO_SCALER_PATH)
+    stroke_model = joblib.load(models.STROKE_MODEL_PATH)
+
+    cases = [
+        ("cardio", X_cardio, cardio_model.predict_proba(scaler.transform(X_cardio))[:, 1],
+         LinearScorer.load(models.CARDIO_COMPILED_PATH)),
+        ("stroke", X_stroke, stroke_model.predict_proba(X_stroke)[:, 1],
+         LinearScorer.load(models.STROKE_COMPILED_PATH)),
+    ]
+
+    ok = True
+    for name, X, expected, scorer in cases:
+        rows = X.to_dict("records")
+        diff_rows = max(abs(a - b) for a, b in zip(scorer.predict_rows(rows), expected))
+        diff_matrix = float(abs(scorer.predict_matrix(X.to_numpy()) - expected).max())
+        passed = max(diff_rows, diff_matrix) <= PARITY_TOLERANCE
+        ok = ok and passed
+        print(f"{'✅' if passed else '❌'} {name}: {len(X)} rows, "
+              f"max |Δ| rows={diff_rows:.3e} matrix={diff_matrix:.3e}")
+    return ok
+
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        sys.exit(0 if check_parity() else 1)
+    print("Usage: python compiled_scorer.py --check")
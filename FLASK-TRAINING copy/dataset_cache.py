@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from models import CARDIO_GENDER_CODES, STROKE_GENDER_MAP, STROKE_SMOKING_COLS
+from settings import DATASET_CACHE_DIR
+
+# ==================================================
+# 訓練資料的欄位式快取（每欄一個 .npy，可 memory-map）
+# ==================================================
+# 第一次讀取時把 CSV 解析一次、套用特徵轉換（age_years、gender 編碼、smoking one-hot），
+# 每一欄無損 downcast 後存成 .npy，加上 manifest.json 記錄欄位型別與類別。
+# 快取目錄以來源檔的 sha256（+ CACHE_VERSION）命名，CSV 一改就自動重建。
+#
+#   <DATASET_CACHE_DIR>/cardio-v<CACHE_VERSION>-<sha256 前 16 碼>/manifest.json, 000.npy, 001.npy ...
+#
+# 之後訓練 / 分析直接 np.load(mmap_mode="r")，不再重新 parse 文字檔。
+
+CACHE_VERSION = 1  # 特徵轉換邏輯改變時 +1，讓舊快取失效
+
+
+def _derive_cardio(df):
+    df["age_years"] = df["age"] / 365.25  # cardio.csv 的 age 是「天數」
+    df["gender"] = df["gender"].map(CARDIO_GENDER_CODES)
+    return df
+
+
+def _derive_stroke(df):
+    df["gender"] = df["gender"].map(STROKE_GENDER_MAP)
+    # 與原本 pd.get_dummies(df, columns=["smoking_status"]) 相同：
+    # "N/A" 已被 read_csv 讀成 NaN，不會產生欄位 → smoking_status_N/A 全為 0
+    dummies = pd.get_dummies(df["smoking_status"], prefix="smoking_status")
+    for col in STROKE_SMOKING_COLS:
+        df[col] = dummies[col] if col in dummies.columns else 0
+    return df
+
+
+DATASETS = {
+    "cardio": {"source": "cardio.csv", "read_csv": {"sep": ";"}, "derive": _derive_cardio},
+    "stroke": {"source": "stroke.csv", "read_csv": {}, "derive": _derive_stroke},
+}
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _compact(series):
+    """無損 downcast：整數取最小的 int 型別、float 可以完整轉回才用 float32、字串改成類別代碼"""
+    if pd.api.types.is_bool_dtype(series):
+        return series.to_numpy(dtype=np.uint8), {"kind": "bool"}
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast="integer").to_numpy(), {"kind": "numeric"}
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype=np.float64)
+        narrow = values.astype(np.float32)
+        if np.array_equal(narrow.astype(np.float64), values, equal_nan=True):
+            return narrow, {"kind": "numeric"}
+        return values, {"kind": "numeric"}
+    categorical = pd.Categorical(series)
+    codes = pd.to_numeric(pd.Series(categorical.codes), downcast="integer").to_numpy()
+    return codes, {"kind": "category", "categories": [str(c) for c in categorical.categories]}
+
+
+def _cache_path(name, digest):
+    return os.path.join(DATASET_CACHE_DIR, f"{name}-v{CACHE_VERSION}-{digest[:16]}")
+
+
+def build_dataset(name, force=False):
+    """確保快取存在並回傳快取目錄；來源 hash 相同且未指定 force 時直接沿用"""
+    spec = DATASETS[name]
+    digest = file_sha256(spec["source"])
+    path = _cache_path(name, digest)
+    if os.path.exists(os.path.join(path, "manifest.json")) and not force:
+        return path
+
+    start = time.perf_counter()
+    df = spec["derive"](pd.read_csv(spec["source"], **spec["read_csv"]))
+
+    tmp = f"{path}.{os.getpid()}.tmp"  # 多個 process 同時建立時互不干擾
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = []
+    for i, col in enumerate(df.columns):
+        values, meta = _compact(df[col])
+        filename = f"{i:03d}.npy"  # 欄位名稱可能含 "/"（smoking_status_N/A），檔名用編號
+        np.save(os.path.join(tmp, filename), np.ascontiguousarray(values))
+        columns.append({"name": col, "file": filename, "dtype": str(values.dtype), **meta})
+
+    manifest = {
+        "dataset": name,
+        "source": spec["source"],
+        "source_sha256": digest,
+        "cache_version": CACHE_VERSION,
+        "rows": len(df),
+        "columns": columns
+    }
+    with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # 另一個 process 剛建好同一份快取 → 用它的
+        shutil.rmtree(tmp, ignore_errors=True)
+        return path
+    _remove_stale(name, path)
+    print(f"INFO: Cached {spec['source']} → {path} ({len(df)} rows, {time.perf_counter() - start:.2f}s)")
+    return path
+
+
+def _remove_stale(name, keep):
+    if not os.path.isdir(DATASET_CACHE_DIR):
+        return
+    for entry in os.listdir(DATASET_CACHE_DIR):
+        path = os.path.join(DATASET_CACHE_DIR, entry)
+        if entry.startswith(f"{name}-") and path != keep and not entry.endswith(".tmp"):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def open_columns(name, columns=None):
+    """{欄位: 唯讀 memmap 陣列}；類別欄位回傳代碼，類別清單在 manifest 裡"""
+    path = build_dataset(name)
+    with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    wanted = set(columns) if columns is not None else None
+    return {
+        col["name"]: np.load(os.path.join(path, col["file"]), mmap_mode="r")
+        for col in manifest["columns"]
+        if wanted is None or col["name"] in wanted
+    }, manifest
+
+
+def load_dataset(name, columns=None):
+    """載入（必要時先建立）快取，回傳 DataFrame；類別欄位還原成 pandas Categorical"""
+    arrays, manifest = open_columns(name, columns)
+    data = {}
+    for col in manifest["columns"]:
+        values = arrays.get(col["name"])
+        if values is None:
+            continue
+        if col["kind"] == "category":
+            data[col["name"]] = pd.Categorical.from_codes(values, col["categories"])
+        elif col["kind"] == "bool":
+            data[col["name"]] = values.astype(bool)
+        else:
+            data[col["name"]] = values
+    return pd.DataFrame(data)
+
+
+if __name__ == "__main__":
+    force = "--rebuild" in sys.argv
+    for dataset in DATASETS:
+        cache = build_dataset(dataset, force=force)
+        size = sum(os.path.getsize(os.path.join(cache, f)) for f in os.listdir(cache))
+        source_size = os.path.getsize(DATASETS[dataset]["source"])
+        print(f"✅ {dataset}: {cache} ({size / 1024:.0f} KiB, source {source_size / 1024:.0f} KiB)")
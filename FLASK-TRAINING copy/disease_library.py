@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows：沒有 flock，只適合單一 worker
+    fcntl = None
+
+from scoring import DISEASE_NAMES
+from settings import DISEASE_LIBRARY_PATH, DISEASE_LIBRARY_OVERLAY_PATH
+
+# ==================================================
+# /overall-insight 的疾病解說庫（cause / importance）
+# ==================================================
+# 報告裡的疾病只有 scoring.DISEASE_NAMES 這幾種，每種疾病的比喻式解說與使用者無關，
+# 不需要每次請求都請 Gemini 重寫一遍。解說存在 disease_explanations.json：
+#
+#   {"version": "2026-10-18.1", "diseases": {"<疾病名稱>": {"cause": ..., "importance": ..., "source": ...}}}
+#
+# - 名稱比對忽略大小寫與括號裡的說明："Stroke" 也會對到 "Stroke (brain blood loss)"
+# - disease_explanations.json 進版本控制，只由離線 CLI 修改：python disease_library.py --check | --generate [--force]
+# - 庫裡缺少的已知疾病第一次用到時請 Gemini 產生，寫到不進 git 的 overlay
+#   （DISEASE_LIBRARY_OVERLAY_PATH）：各 worker 在檔案鎖內重讀、合併後整檔替換；載入時庫裡的解說優先
+# - 不在 DISEASE_NAMES 裡的名稱（舊版前端自己送的清單）每次請求都由 Gemini 解說，不寫回
+#
+# /overall-insight 只剩 general_note 可能需要 LLM（OVERALL_NOTE_MODE），見 note_payload / template_note。
+
+HIGH_RISK_PROBABILITY = 60  # 與前端相同：>= 60 高風險，30 ~ 60 中風險
+
+EXPLANATION_PROMPT = """
+You are a creative and expert health educator.
+
+Task:
+- Explain health risks by combining deep medical mechanisms with vivid, simple metaphors.
+- Avoid dry, boring medical terms alone. Use analogies (like plumbing, engines, or city traffic).
+- Keep it interesting but scientifically accurate.
+- The explanation is shown to many different people, so do not assume anything about the reader.
+
+For each disease, provide:
+1. "cause": Use a metaphor to explain the biological mechanism. (e.g., Hypertension is like "water pipes under too much pressure").
+2. "importance": Explain what happens to organs using an interesting scenario. (e.g., "The kidneys are like delicate filters being blasted by a power washer").
+
+Output MUST be valid JSON ONLY.
+
+JSON format:
+{
+"diseases": [
+    {
+    "name": "Disease name, exactly as given",
+    "cause": "Vivid metaphor + biological reason",
+    "importance": "Vivid scenario of what happens if ignored"
+    }
+]
+}
+"""
+
+NOTE_PROMPT = """
+You are a warm and witty health educator.
+
+Task:
+- Write ONE supportive closing remark (at most two sentences) for a person whose recent health reports show the conditions below.
+- Mention the high risk conditions first. Encourage them to talk to a doctor, without being alarming.
+- Do not explain the diseases; that is already done elsewhere.
+
+Output MUST be valid JSON ONLY.
+
+JSON format:
+{
+"general_note": "A supportive and witty closing remark"
+}
+"""
+
+
+def normalize_name(name):
+    """小寫、去掉括號說明與多餘空白：'Stroke (brain blood loss)' → 'stroke'"""
+    return re.sub(r"\s+", " ", re.sub(r"\(.*?\)", "", str(name))).strip().lower()
+
+
+def risk_level(probability):
+    return "high" if probability >= HIGH_RISK_PROBABILITY else "medium"
+
+
+def _prompt_payload(system_prompt, items):
+    # 與舊版 prompt 相同的開頭：gemini_stub.py 依這一行找疾病清單
+    user_query = f"""
+    Diseases observed across selected reports:
+    {json.dumps(items, indent=2)}
+    """
+    return {
+        "contents": [{"parts": [{"text": user_query}]}],
+        "systemInstruction": {"parts": [{"text": system_prompt}]},
+        "generationConfig": {"temperature": 0.2}
+    }
+
+
+def explanation_payload(names):
+    return _prompt_payload(EXPLANATION_PROMPT, [{"name": name} for name in names])
+
+
+def note_payload(diseases):
+    """
+    只送名稱與風險等級（不送機率），prompt 只有 2^n 種組合左右，
+    大部分請求都會命中 LLM 快取。
+    """
+    items = [{"name": d["name"], "risk": risk_level(d["probability"])} for d in diseases]
+    items.sort(key=lambda d: (d["risk"] != "high", normalize_name(d["name"])))
+    return _prompt_payload(NOTE_PROMPT, items)
+
+
+def template_note(diseases):
+    """不呼叫 LLM 的 general_note（OVERALL_NOTE_MODE=template，或 LLM 失敗時）"""
+    high = [d["name"] for d in diseases if risk_level(d["probability"]) == "high"]
+    if high:
+        return (f"Your reports point to a higher risk of {', '.join(high)} - worth a conversation with your doctor soon. "
+                "Small daily habits add up, and your heart keeps the score.")
+    return ("None of these risks is high yet, which makes now the easiest time to act. "
+            "Small daily habits add up, and your heart keeps the score.")
+
+
+def _parse_explanations(report):
+    explanations = {}
+    for d in report.get("diseases") or []:
+        if not isinstance(d, dict):
+            continue
+        cause, importance = d.get("cause"), d.get("importance")
+        if isinstance(cause, str) and isinstance(importance, str):
+            explanations[normalize_name(d.get("name"))] = {"cause": cause, "importance": importance}
+    return explanations
+
+
+def _read_library(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_library(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    os.replace(tmp, path)  # 同時讀取的 process 只會看到完整的舊檔或新檔
+
+
+@contextmanager
+def _file_lock(path):
+    # 跨 process 的互斥鎖（同一台機器上的 uvicorn workers）；持有時間只有讀寫一個小檔案
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _next_version(version):
+    today = date.today().isoformat()
+    prefix, _, number = (version or "").rpartition(".")
+    if prefix == today and number.isdigit():
+        return f"{today}.{int(number) + 1}"
+    return f"{today}.1"
+
+
+class DiseaseLibrary:
+    def __init__(self, path=DISEASE_LIBRARY_PATH, overlay_path=DISEASE_LIBRARY_OVERLAY_PATH, known_names=DISEASE_NAMES):
+        self.path = path
+        self.overlay_path = overlay_path  # 執行中產生的解說；None = 產生的解說直接加進庫裡（--generate）
+        self.known = {normalize_name(name): name for name in known_names}
+        self.version = None  # 庫（path）的版本；overlay 不改變版本
+        self.entries = {}  # 疾病名稱 → {"cause", "importance", "source"}（庫 + overlay）
+        self.local = {}  # 只在 overlay 裡的解說
+        self._index = {}  # normalize_name → 疾病名稱
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        data = _read_library(self.path)
+        self.version = data.get("version")
+        self.entries = dict(data.get("diseases") or {})
+        self._index = {normalize_name(name): name for name in self.entries}
+        self.local = {}
+        if self.overlay_path is not None:
+            self._merge_local(_read_library(self.overlay_path).get("diseases") or {})
+        return self
+
+    def _merge_local(self, entries):
+        # 庫裡已有的疾病以庫為準，overlay 只補上庫裡沒有的
+        for name, entry in entries.items():
+            key = normalize_name(name)
+            if key not in self._index:
+                self.entries[name] = entry
+                self._index[key] = name
+                self.local[name] = entry
+
+    def save(self):
+        """寫回庫（只有離線 CLI 使用）；overlay 的解說不會寫進去"""
+        _write_library(self.path, {
+            "version": self.version,
+            "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "diseases": {name: entry for name, entry in self.entries.items() if name not in self.local}
+        })
+
+    def save_overlay(self):
+        """在檔案鎖內重讀 overlay，併入其他 worker 產生的解說後整檔替換"""
+        with _file_lock(f"{self.overlay_path}.lock"):
+            on_disk = _read_library(self.overlay_path).get("diseases") or {}
+            self._merge_local(on_disk)
+            _write_library(self.overlay_path, {
+                "library_version": self.version,
+                "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "diseases": {**on_disk, **self.local}
+            })
+
+    def lookup(self, name):
+        canonical = self._index.get(normalize_name(name))
+        return self.entries[canonical] if canonical else None
+
+    def missing(self):
+        """庫裡還沒有解說的已知疾病"""
+        return [name for key, name in self.known.items() if key not in self._index]
+
+    def _store(self, explanations, source, overwrite=False):
+        added = 0
+        for key, explanation in explanations.items():
+            if key in self.known and (overwrite or key not in self._index):
+                name = self.known[key]
+                self.entries[name] = {**explanation, "source": source}
+                self._index[key] = name
+                if self.overlay_path is not None:
+                    self.local[name] = self.entries[name]
+                added += 1
+        if added and self.overlay_path is None:
+            self.version = _next_version(self.version)
+        return added
+
+    async def generate(self, names, generate_json, source="generated", overwrite=False):
+        """
+        請 LLM 解說 names，回傳 {normalize_name: {"cause", "importance"}}；
+        其中已知的疾病會加進庫裡（有 overlay_path 時只加進 overlay；overwrite=True 時取代既有的解說），
+        由呼叫者決定何時 save / save_overlay。
+        """
+        report = await generate_json(explanation_payload(names))
+        explanations = _parse_explanations(report)
+        self._store(explanations, source, overwrite)
+        return explanations
+
+    async def explain(self, diseases, generate_json, run_io=None):
+        """
+        回傳 [{"name", "cause", "importance"}]，順序與 diseases 相同。
+        只有庫裡沒有的疾病才呼叫 generate_json（例如 main.generate_llm_json）；
+        有新增已知疾病時經由 run_io 寫到 overlay（沒有給 run_io 或沒有 overlay_path 就不寫）。
+        """
+        found, pending = {}, []
+        for d in diseases:
+            entry = self.lookup(d["name"])
+            if entry:
+                self.hits += 1
+                found[d["name"]] = entry
+            else:
+                self.misses += 1
+                pending.append(d["name"])
+
+        generated = {}
+        known = [name for name in pending if normalize_name(name) in self.known]
+        unknown = [name for name in pending if normalize_name(name) not in self.known]
+        if known:
+            async with self._lock:  # 同一個已知疾病同時缺少時只產生、寫回一次
+                still_pending = [name for name in known if not self.lookup(name)]
+                local = len(self.local)
+                if still_pending:
+                    generated.update(await self.generate(still_pending, generate_json))
+                if len(self.local) != local and run_io is not None:
+                    await run_io(self.save_overlay)
+        if unknown:
+            generated.update(await self.generate(unknown, generate_json))
+
+        for name in pending:
+            entry = self.lookup(name) or generated.get(normalize_name(name))
+            if entry is None:
+                raise ValueError(f"LLM returned no explanation for {name!r}")
+            found[name] = entry
+
+        return [
+            {"name": d["name"], "cause": found[d["name"]]["cause"], "importance": found[d["name"]]["importance"]}
+            for d in diseases
+        ]
+
+
+# ==================================================
+# 離線檢查 / 產生：python disease_library.py --check | --generate [--force]
+# ==================================================
+
+async def _generate_offline(library, names, model, overwrite):
+    # 不經過 main（import main 需要完整的 Supabase 設定）；直接用 llm_client 呼叫 Gemini
+    from llm_client import GeminiClient
+    from settings import GEMINI_API_BASE
+
+    client = GeminiClient(GEMINI_API_BASE, os.getenv("GEMINI_API_KEY"), model)
+
+    async def generate_json(payload):
+        result = await client.generate_content(payload)
+        candidate = (result.get("candidates") or [{}])[0]
+        text = (candidate.get("content", {}).get("parts") or [{}])[0].get("text", "")
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end == -1:
+            raise ValueError("LLM returned content does not contain JSON format")
+        return json.loads(text[start:end + 1])
+
+    try:
+        return await library.generate(names, generate_json, source=f"generated:{model}", overwrite=overwrite)
+    finally:
+        await client.aclose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check or generate the per-disease explanation library.")
+    parser.add_argument("--path", default=DISEASE_LIBRARY_PATH)
+    parser.add_argument("--check", action="store_true", help="exit 1 if a known disease has no explanation")
+    parser.add_argument("--generate", action="store_true", help="generate missing explanations with Gemini")
+    parser.add_argument("--force", action="store_true", help="with --generate: regenerate every disease")
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    library = DiseaseLibrary(args.path, overlay_path=None).load()
+    print(f"INFO: {args.path} version {library.version}, {len(library.entries)} disease(s)")
+    overlay = _read_library(DISEASE_LIBRARY_OVERLAY_PATH).get("diseases") or {}
+    if overlay:
+        print(f"INFO: {DISEASE_LIBRARY_OVERLAY_PATH} has {len(overlay)} explanation(s) generated at runtime "
+              "(--generate adds missing diseases to the library)")
+
+    if args.generate:
+        # --force 時失敗的疾病保留原本的解說
+        names = list(library.known.values()) if args.force else library.missing()
+        if names:
+            start = time.perf_counter()
+            version = library.version
+            asyncio.run(_generate_offline(library, names, args.model, args.force))
+            if library.version != version:
+                library.save()
+            print(f"✅ Asked Gemini for {len(names)} explanation(s) in "
+                  f"{time.perf_counter() - start:.1f}s → version {library.version}")
+
+    missing = library.missing()
+    unknown = [name for name in library.entries if normalize_name(name) not in library.known]
+    for name in unknown:
+        print(f"WARNING: {name!r} is not in scoring.DISEASE_NAMES")
+    if missing:
+        print(f"ERROR: No explanation for: {', '.join(missing)}")
+        return 1 if args.check else 0
+    print("INFO: Every disease in scoring.DISEASE_NAMES has an explanation")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,117 @@
+import asyncio
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from settings import IO_POOL_SIZE, CPU_POOL_SIZE, CPU_POOL_KIND
+
+# ==================================================
+# Executor 層：所有 blocking 工作都不在 event loop 上執行
+# ==================================================
+# - run_io ：同步 SDK 呼叫（例如 supabase.table(...).execute()）→ thread pool
+# - run_cpu：模型 / 規則計算 → process pool（CPU_POOL_KIND="thread" 時改用 thread pool）
+# process pool 的函式與參數必須可 pickle（module 層級函式 + dict 參數）。
+
+_io_pool = None
+_cpu_pool = None
+_cpu_pending = 0  # 已送進 CPU pool、尚未完成的工作數（含排隊中）
+_pool_lock = threading.Lock()  # 建立 / 重建 pool（start_executors 可能在別的 thread 執行）
+
+
+def _warm_worker():
+    # 每個 worker process 啟動時先把模型載入記憶體，並實際算一筆（scoring.warmup）；
+    # worker 有自己的 registry，也各自在背景檢查 manifest
+    from models import registry
+    from scoring import warmup
+    warmup()
+    registry.start_watcher()
+
+
+def _ping():
+    return True
+
+
+def _log():
+    # logs → tracing → executors：module 載入時不能 import logs，用到時才取得 logger
+    from logs import get_logger
+    return get_logger("executors")
+
+
+def _create_cpu_pool():
+    if CPU_POOL_KIND == "thread":
+        return ThreadPoolExecutor(max_workers=CPU_POOL_SIZE, thread_name_prefix="cpu")
+    # spawn：避免在已有多個 thread（asyncio / httpx）的 process 裡 fork
+    return ProcessPoolExecutor(
+        max_workers=CPU_POOL_SIZE,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_warm_worker
+    )
+
+
+def start_executors():
+    """同步、會等 worker 全部暖機完成；在 event loop 上請經由 run_in_executor 呼叫（見 run_cpu）"""
+    global _io_pool, _cpu_pool
+    with _pool_lock:
+        if _io_pool is None:
+            _io_pool = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="io")
+        if _cpu_pool is not None:
+            return
+        pool = _create_cpu_pool()
+        # 先把 worker 全部啟動（spawn + 載入模型 + 暖機），不要讓第一個 request 付這個成本；
+        # 暖機失敗時 pool 會 broken，這裡的 result() 會丟出例外，讓啟動直接失敗
+        for future in wait([pool.submit(_ping) for _ in range(CPU_POOL_SIZE)]).done:
+            future.result()
+        _cpu_pool = pool
+    _log().info("executors_ready", io_threads=IO_POOL_SIZE, cpu_kind=CPU_POOL_KIND, cpu_workers=CPU_POOL_SIZE)
+
+
+def _replace_broken_pool(broken):
+    """只有 _cpu_pool 還是壞掉的那個 pool 時才重建（同時發現的其他呼叫者直接用新的 pool）"""
+    global _cpu_pool
+    with _pool_lock:
+        if _cpu_pool is broken:
+            _log().warning("cpu_pool_broken", detail="recreating the pool")
+            _cpu_pool = _create_cpu_pool()
+            broken.shutdown(wait=False, cancel_futures=True)
+        return _cpu_pool
+
+
+def shutdown_executors():
+    global _io_pool, _cpu_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=True, cancel_futures=True)
+        _cpu_pool = None
+    if _io_pool is not None:
+        _io_pool.shutdown(wait=True)
+        _io_pool = None
+
+
+async def run_io(fn, *args, **kwargs):
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="io")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_pool, functools.partial(fn, *args, **kwargs))
+
+
+def cpu_pending():
+    return _cpu_pending
+
+
+async def run_cpu(fn, *args):
+    global _cpu_pending
+    loop = asyncio.get_running_loop()
+    if _cpu_pool is None:
+        # 正常情況 lifespan 已經啟動；否則在背景 thread 啟動，不擋住 event loop
+        await loop.run_in_executor(None, start_executors)
+    pool = _cpu_pool
+    _cpu_pending += 1
+    try:
+        return await loop.run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # worker 異常結束（例如 OOM）→ 重建 pool（只建一個）再試一次
+        return await loop.run_in_executor(_replace_broken_pool(pool), fn, *args)
+    finally:
+        _cpu_pending -= 1
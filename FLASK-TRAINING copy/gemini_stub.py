@@ -0,0 +1,179 @@
+import asyncio
+import json
+import math
+import os
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# ==================================================
+# 本機 Gemini stub（離線測試 / 壓測用）
+# ==================================================
+# 實作 generateContent 與 streamGenerateContent?alt=sse，回傳格式與 Gemini 相同，
+# 內容依 prompt 產生符合 /predict 或 /overall-insight JSON 結構的報告。
+#
+#   uvicorn gemini_stub:app --port 8001
+#   GEMINI_API_BASE=http://127.0.0.1:8001 uvicorn main:app
+#
+# 可用環境變數調整：
+#   GEMINI_STUB_LATENCY      每個請求的延遲（秒；uniform / exponential 為平均值，lognormal 為中位數）
+#   GEMINI_STUB_LATENCY_DIST 延遲分布：uniform（LATENCY ± JITTER）| lognormal | exponential | fixed
+#   GEMINI_STUB_JITTER       uniform 的隨機變動範圍（秒，±）
+#   GEMINI_STUB_SIGMA        lognormal 的 sigma（越大尾端越長）
+#   GEMINI_STUB_ERROR_RATE   回傳錯誤的機率（0~1）
+#   GEMINI_STUB_ERROR_STATUS 錯誤時的 HTTP 狀態碼（預設 503）
+#   GEMINI_STUB_RETRY_AFTER  錯誤時附上的 Retry-After（秒，留空則不附）
+#   GEMINI_STUB_CHUNK_SIZE   串流時每個 chunk 的字元數
+
+LATENCY = float(os.getenv("GEMINI_STUB_LATENCY", "0.5"))
+LATENCY_DIST = os.getenv("GEMINI_STUB_LATENCY_DIST", "uniform")
+JITTER = float(os.getenv("GEMINI_STUB_JITTER", "0.1"))
+SIGMA = float(os.getenv("GEMINI_STUB_SIGMA", "0.5"))
+ERROR_RATE = float(os.getenv("GEMINI_STUB_ERROR_RATE", "0"))
+ERROR_STATUS = int(os.getenv("GEMINI_STUB_ERROR_STATUS", "503"))
+RETRY_AFTER = os.getenv("GEMINI_STUB_RETRY_AFTER", "")
+CHUNK_SIZE = int(os.getenv("GEMINI_STUB_CHUNK_SIZE", "40"))
+
+app = FastAPI()
+stats = {"requests": 0, "errors": 0}
+
+
+def _prompt_text(body):
+    parts = [p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", [])]
+    return "\n".join(parts)
+
+
+def _json_after(text, marker):
+    start = text.find(marker)
+    if start < 0:
+        return []
+    start = text.find("[", start)
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text[start:])
+    except ValueError:
+        return []
+    return value if isinstance(value, list) else []
+
+
+def _prediction_report(text):
+    probabilities = _json_after(text, "Calculated cardiovascular risk probabilities:")
+    low_risk = _json_after(text, "Low risk conditions")
+    diseases = [
+        {"name": d.get("name"), "probability": d.get("probability") if d.get("probability", 0) >= 30 else "Low risk"}
+        for d in probabilities
+    ]
+    summary = "Your results show a mix of risk levels based on the information you provided."
+    if low_risk:
+        summary += f" Additionally, you may also keep an eye on: {', '.join(low_risk)}."
+    return {
+        "possible_diseases": diseases,
+        "summary": summary,
+        "recommendations": [
+            "Check your blood pressure regularly and keep a simple log.",
+            "Schedule a routine check-up to review these results with your doctor.",
+            "Walk briskly for 30 minutes most days, because it strengthens the heart.",
+            "Try swimming or cycling twice a week, because they are gentle on the joints.",
+            "Eat more vegetables and whole grains, because fiber helps control cholesterol.",
+            "Cut back on salty snacks, because less sodium lowers blood pressure."
+        ]
+    }
+
+
+def _overall_report(text):
+    diseases = _json_after(text, "Diseases observed across selected reports:")
+    return {
+        "diseases": [
+            {
+                "name": d.get("name"),
+                "cause": "Like a pipe under constant pressure, the vessel walls slowly wear down.",
+                "importance": "Left alone, the organs downstream get less of what they need."
+            }
+            for d in diseases
+        ],
+        "general_note": "Small daily habits add up - your heart keeps the score."
+    }
+
+
+def _report_text(body):
+    system = " ".join(p.get("text", "") for p in body.get("systemInstruction", {}).get("parts", []))
+    text = _prompt_text(body)
+    report = _prediction_report(text) if "possible_diseases" in system else _overall_report(text)
+    return json.dumps(report, ensure_ascii=False)
+
+
+def _response_chunk(text, finish=False):
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    return {"candidates": [candidate], "modelVersion": "stub"}
+
+
+def _latency():
+    if LATENCY <= 0:
+        return 0.0
+    if LATENCY_DIST == "lognormal":
+        return random.lognormvariate(math.log(LATENCY), SIGMA)
+    if LATENCY_DIST == "exponential":
+        return random.expovariate(1 / LATENCY)
+    if LATENCY_DIST == "fixed":
+        return LATENCY
+    return max(0.0, LATENCY + random.uniform(-JITTER, JITTER))
+
+
+async def _delay():
+    await asyncio.sleep(_latency())
+
+
+def _maybe_error():
+    if ERROR_RATE <= 0 or random.random() >= ERROR_RATE:
+        return None
+    stats["errors"] += 1
+    headers = {"Retry-After": RETRY_AFTER} if RETRY_AFTER else None
+    return JSONResponse(
+        {"error": {"code": ERROR_STATUS, "message": "stub injected error", "status": "UNAVAILABLE"}},
+        status_code=ERROR_STATUS,
+        headers=headers
+    )
+
+
+@app.post("/v1beta/models/{model_action}")
+async def models_action(model_action: str, request: Request):
+    stats["requests"] += 1
+    body = await request.json()
+    _, _, action = model_action.partition(":")
+
+    error = _maybe_error()
+    if error is not None:
+        await _delay()
+        return error
+
+    text = _report_text(body)
+    if action == "generateContent":
+        await _delay()
+        result = _response_chunk(text, finish=True)
+        result["usageMetadata"] = {
+            "promptTokenCount": len(_prompt_text(body)) // 4,
+            "candidatesTokenCount": len(text) // 4
+        }
+        return result
+
+    if action == "streamGenerateContent":
+        pieces = [text[i:i + CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)] or [""]
+
+        async def events():
+            # 延遲平均分配在各 chunk 之間，模擬逐步產生 token
+            step = _latency() / len(pieces)
+            for i, piece in enumerate(pieces):
+                await asyncio.sleep(step)
+                chunk = _response_chunk(piece, finish=i == len(pieces) - 1)
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return JSONResponse({"error": {"code": 404, "message": f"unknown action {action}"}}, status_code=404)
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
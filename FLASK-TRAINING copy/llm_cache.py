@@ -0,0 +1,118 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from executors import run_io
+from settings import LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL, LLM_CACHE_SQLITE_PATH
+
+# ==================================================
+# Gemini 回應快取（content-addressed）
+# ==================================================
+# key = sha256(模型名稱 + 完整 payload 的 canonical JSON)，
+# payload 已包含 user_query、system_prompt、tools 與 generationConfig。
+# 第一層：記憶體 LRU（有 TTL 與筆數上限）
+# 第二層（選用）：本機 SQLite，重啟後仍可命中；過期的列最多每 PRUNE_INTERVAL_SECONDS 刪一次（expires_at 有 index）
+
+PRUNE_INTERVAL_SECONDS = 60.0
+
+
+def prompt_key(model, payload):
+    canonical = json.dumps(
+        {"model": model, "payload": payload},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _SQLiteTier:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_expires_at ON llm_cache (expires_at)")
+        self._conn.commit()
+        self._pruned_at = 0.0  # 第一次 set 時先清一次舊檔案留下的過期資料
+
+    def get(self, key, now):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        return row
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            now = time.time()
+            if now - self._pruned_at >= PRUNE_INTERVAL_SECONDS:
+                self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+                self._pruned_at = now
+            self._conn.commit()
+
+
+class LLMCache:
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL, sqlite_path=LLM_CACHE_SQLITE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._disk = _SQLiteTier(sqlite_path) if sqlite_path else None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._memory[key]
+
+        if self._disk is not None:
+            row = await run_io(self._disk.get, key, now)
+            if row is not None:
+                value, expires_at = row
+                self._remember(key, value, expires_at)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self._disk is not None:
+            await run_io(self._disk.set, key, value, expires_at)
+
+    def _remember(self, key, value, expires_at):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": len(self._memory)
+        }
@@ -0,0 +1,314 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from logs import get_logger
+from settings import (
+    GEMINI_MAX_CONCURRENCY, GEMINI_MAX_CONNECTIONS, GEMINI_MAX_KEEPALIVE,
+    GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT, GEMINI_WRITE_TIMEOUT, GEMINI_POOL_TIMEOUT,
+    GEMINI_MAX_RETRIES, GEMINI_BACKOFF_BASE, GEMINI_BACKOFF_MAX, GEMINI_RETRY_AFTER_MAX,
+    GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_RESET
+)
+
+# ==================================================
+# Gemini HTTP client（給 call_LLM_* 共用）
+# ==================================================
+# - Semaphore 限制同時進行中的 Gemini 呼叫數
+# - 明確設定 connection pool 大小與 connect / read / write / pool timeout
+# - 429 / 5xx / 連線錯誤以 jittered exponential backoff 重試，並遵守 Retry-After
+# - Circuit breaker：連續失敗達門檻就直接失敗（fail fast），一段時間後放一個探測請求；
+#   一次呼叫（含所有重試）最後失敗才算一次失敗
+#
+#   python llm_client.py --check   檢查 circuit breaker 的狀態轉換（不連網）
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+log = get_logger("llm_client")
+
+
+class CircuitOpenError(Exception):
+    """上游被判定為不健康，暫時不送出請求"""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=GEMINI_BREAKER_FAILURES, reset_timeout=GEMINI_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"  # closed | open | half_open
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def before_call(self):
+        if self.state == "closed":
+            return
+        if self.state == "open":
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(f"Gemini circuit open, retry in {remaining:.1f}s")
+            self.state = "half_open"
+        # half_open：只放一個探測請求通過
+        if self._probe_in_flight:
+            raise CircuitOpenError("Gemini circuit half-open, probe in progress")
+        self._probe_in_flight = True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                log.warning("gemini_circuit_opened", failures=self.failures)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def record_release(self):
+        # 探測請求以非上游錯誤結束（例如 4xx）→ 視為上游可用
+        if self.state == "half_open":
+            self.record_success()
+
+    def record_retry(self):
+        # 還會重試的失敗不計入門檻（整個呼叫最後失敗才算一次）；但 half_open 的探測失敗就直接重新打開
+        if self.state == "half_open":
+            self.record_failure()
+
+    def record_abandon(self):
+        # 呼叫被取消（例如 SSE client 斷線）或丟出非上游的例外：不知道上游好壞，
+        # 維持目前狀態，只讓出探測名額，下一個呼叫可以再探測
+        self._probe_in_flight = False
+
+
+def _retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class GeminiClient:
+    def __init__(
+        self,
+        base_url,
+        api_key,
+        model,
+        max_concurrency=GEMINI_MAX_CONCURRENCY,
+        max_retries=GEMINI_MAX_RETRIES,
+        backoff_base=GEMINI_BACKOFF_BASE,
+        backoff_max=GEMINI_BACKOFF_MAX,
+        breaker=None,
+        transport=None
+    ):
+        self.api_key = api_key
+        self.model_path = f"/v1beta/models/{model}"
+        self.generate_path = f"/v1beta/models/{model}:generateContent"
+        self.stream_path = f"/v1beta/models/{model}:streamGenerateContent"
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(
+                max_connections=GEMINI_MAX_CONNECTIONS,
+                max_keepalive_connections=GEMINI_MAX_KEEPALIVE
+            ),
+            timeout=httpx.Timeout(
+                connect=GEMINI_CONNECT_TIMEOUT,
+                read=GEMINI_READ_TIMEOUT,
+                write=GEMINI_WRITE_TIMEOUT,
+                pool=GEMINI_POOL_TIMEOUT
+            ),
+            transport=transport
+        )
+        self.retries = 0
+        self.in_flight = 0  # 目前持有並行名額的呼叫數
+        self.waiting = 0    # 正在等並行名額的呼叫數
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    async def prewarm(self):
+        """
+        啟動時先建立一條連線（TCP + TLS）放進 pool，第一個請求不必等 handshake。
+        GET 模型資訊不消耗 token；失敗只記警告，不影響啟動。
+        """
+        try:
+            response = await self._http.get(self.model_path, params={"key": self.api_key})
+            await response.aclose()
+        except httpx.HTTPError as e:
+            log.warning("gemini_prewarm_failed", error_type=type(e).__name__, error=str(e))
+
+    @asynccontextmanager
+    async def _slot(self):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def _backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if response is not None:
+            retry_after = _retry_after_seconds(response)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, GEMINI_RETRY_AFTER_MAX))
+        return delay
+
+    async def _send(self, path, payload, params, stream=False):
+        """
+        送出請求（含重試）；回傳狀態碼非 retryable 的 response（或重試用盡後的最後一個）。
+        stream=True 時由呼叫端持有並行名額，這裡不再取得。
+        """
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                request = self._http.build_request("POST", path, params=params, json=payload)
+                try:
+                    if stream:
+                        response = await self._http.send(request, stream=True)
+                    else:
+                        async with self._slot():
+                            response = await self._http.send(request)
+                except httpx.TransportError as e:
+                    if attempt >= self.max_retries:
+                        self.breaker.record_failure()
+                        raise
+                    self.breaker.record_retry()
+                    delay = self._backoff(attempt)
+                    log.warning("gemini_retry", reason=type(e).__name__, retry=attempt + 1, delay=round(delay, 2))
+                else:
+                    if response.status_code not in RETRYABLE_STATUS:
+                        if response.is_success:
+                            self.breaker.record_success()
+                        else:
+                            self.breaker.record_release()
+                        return response
+                    await response.aread()
+                    await response.aclose()
+                    if attempt >= self.max_retries:
+                        self.breaker.record_failure()
+                        return response
+                    self.breaker.record_retry()
+                    delay = self._backoff(attempt, response)
+                    log.warning("gemini_retry", reason=f"HTTP {response.status_code}", retry=attempt + 1,
+                                delay=round(delay, 2))
+            except BaseException:
+                # 取消（CancelledError）或其他例外：不能讓探測名額一直被佔住，否則 half_open 會拒絕所有呼叫
+                self.breaker.record_abandon()
+                raise
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def generate_content(self, payload):
+        """呼叫 generateContent，回傳 JSON；最終失敗時丟出 httpx.HTTPStatusError"""
+        response = await self._send(self.generate_path, payload, {"key": self.api_key})
+        response.raise_for_status()
+        return response.json()
+
+    @asynccontextmanager
+    async def stream_generate_content(self, payload):
+        """
+        呼叫 streamGenerateContent（SSE）。只在收到第一個 byte 前重試；
+        串流期間持有一個並行名額。
+        """
+        async with self._slot():
+            response = await self._send(
+                self.stream_path, payload, {"alt": "sse", "key": self.api_key}, stream=True
+            )
+            try:
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                yield response
+            finally:
+                await response.aclose()
+
+
+# ==================================================
+# python llm_client.py --check
+# ==================================================
+
+def check_breaker():
+    """用 httpx.MockTransport 檢查 circuit breaker；全部通過回傳 True"""
+
+    async def run():
+        ok = True
+
+        def expect(name, condition):
+            nonlocal ok
+            print(f"{'OK' if condition else 'FAIL'}: {name}")
+            ok = ok and condition
+
+        # 1) 一次呼叫的所有重試只算一次失敗
+        status = {"code": 503}
+        transport = httpx.MockTransport(lambda request: httpx.Response(status["code"], json={}))
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        client = GeminiClient("http://gemini", "k", "m", max_retries=3, backoff_base=0, breaker=breaker, transport=transport)
+        await client._send(client.generate_path, {}, {})
+        expect("retries of one call count as one failure", breaker.failures == 1 and breaker.state == "closed")
+        await client._send(client.generate_path, {}, {})
+        expect("second failed call opens the breaker", breaker.state == "open")
+
+        # 2) 被取消的探測請求會讓出探測名額
+        started = asyncio.Event()
+
+        async def hang(request):
+            started.set()
+            await asyncio.sleep(3600)
+
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.state, breaker.opened_at = "open", time.monotonic()
+        client = GeminiClient("http://gemini", "k", "m", max_retries=0, breaker=breaker, transport=httpx.MockTransport(hang))
+        probe = asyncio.create_task(client._send(client.generate_path, {}, {}))
+        await started.wait()
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        expect("cancelled probe keeps the breaker half-open", breaker.state == "half_open")
+        client._http._transport = httpx.MockTransport(lambda request: httpx.Response(200, json={}))
+        try:
+            response = await client._send(client.generate_path, {}, {})
+            expect("next call after a cancelled probe goes through", response.status_code == 200 and breaker.state == "closed")
+        except CircuitOpenError:
+            expect("next call after a cancelled probe goes through", False)
+
+        # 3) 非 httpx 的例外（payload 無法編碼）也會讓出探測名額
+        breaker.state, breaker.opened_at = "open", time.monotonic()
+        try:
+            await client._send(client.generate_path, {"bad": object()}, {})
+        except TypeError:
+            pass
+        expect("unexpected exception releases the probe", not breaker._probe_in_flight)
+        return ok
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    import sys
+    if "--check" in sys.argv:
+        sys.exit(0 if check_breaker() else 1)
+    print("Usage: python llm_client.py --check")
@@ -0,0 +1,127 @@
+import json
+import re
+
+# ==================================================
+# Gemini 串流（streamGenerateContent?alt=sse）解析工具
+# ==================================================
+# Gemini 一段一段送出 JSON 文字；PartialReportParser 在 JSON 尚未完整時
+# 就把 "summary" 的新增文字與已完成的 "recommendations" 項目取出來，
+# 讓前端可以邊收邊顯示。
+
+_CONTROL_CHARS = re.compile(r'[\x00-\x1F\x7F]')
+_SUMMARY_KEY = re.compile(r'"summary"\s*:\s*"')
+_RECOMMENDATIONS_KEY = re.compile(r'"recommendations"\s*:\s*\[')
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def iter_gemini_stream_text(response):
+    """逐一取出 SSE 每個 chunk 的文字（candidates[0].content.parts[*].text）"""
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        try:
+            chunk = json.loads(line[5:].strip())
+        except json.JSONDecodeError:
+            continue
+        candidate = (chunk.get("candidates") or [{}])[0]
+        for part in candidate.get("content", {}).get("parts") or []:
+            text = part.get("text")
+            if text:
+                yield text
+
+
+def _scan_string(text, start):
+    """text[start] 為字串內容第一個字元；回傳 (原始內容, 結束引號之後的位置或 None)"""
+    i = start
+    while i < len(text):
+        c = text[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == '"':
+            return text[start:i], i + 1
+        i += 1
+    return text[start:], None
+
+
+def _decode_string(raw):
+    raw = _CONTROL_CHARS.sub("", raw)
+    # 尾端可能是不完整的跳脫序列（例如 "\" 或 "\u00"），逐步截掉直到可以解析
+    for trim in range(0, 7):
+        try:
+            return json.loads('"' + raw[:len(raw) - trim] + '"')
+        except json.JSONDecodeError:
+            continue
+    return ""
+
+
+class PartialReportParser:
+    def __init__(self):
+        self.text = ""
+        self._summary_sent = 0
+        self._summary_done = False
+        self._recommendation_pos = None
+        self._recommendation_count = 0
+        self._recommendations_done = False
+
+    def feed(self, chunk):
+        """加入新文字，回傳這次新產生的 (event, data) list"""
+        self.text += chunk
+        events = []
+        events.extend(self._summary_events())
+        events.extend(self._recommendation_events())
+        return events
+
+    def _summary_events(self):
+        if self._summary_done:
+            return []
+        match = _SUMMARY_KEY.search(self.text)
+        if match is None:
+            return []
+        raw, end = _scan_string(self.text, match.end())
+        summary = _decode_string(raw)
+        self._summary_done = end is not None
+        delta = summary[self._summary_sent:]
+        if not delta:
+            return []
+        self._summary_sent = len(summary)
+        return [("summary", {"delta": delta})]
+
+    def _recommendation_events(self):
+        if self._recommendations_done:
+            return []
+        if self._recommendation_pos is None:
+            match = _RECOMMENDATIONS_KEY.search(self.text)
+            if match is None:
+                return []
+            self._recommendation_pos = match.end()
+
+        events = []
+        text = self.text
+        pos = self._recommendation_pos
+        while pos < len(text):
+            c = text[pos]
+            if c in " \t\r\n,":
+                pos += 1
+            elif c == "]":
+                self._recommendations_done = True
+                break
+            elif c == '"':
+                raw, end = _scan_string(text, pos + 1)
+                if end is None:
+                    break  # 這一項還沒送完
+                events.append(("recommendation", {
+                    "index": self._recommendation_count,
+                    "text": _decode_string(raw)
+                }))
+                self._recommendation_count += 1
+                pos = end
+            else:
+                # 非字串項目（格式不符）→ 停止增量解析，交給最後的完整解析
+                self._recommendations_done = True
+                break
+        self._recommendation_pos = pos
+        return events
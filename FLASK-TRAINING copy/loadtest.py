@@ -0,0 +1,449 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()  # 先讀 .env：有 SUPABASE_JWT_SECRET 就用它簽 token，否則沿用 benchmark.py 的測試用 secret
+
+from benchmark import SAMPLE_INPUT, mint_token, percentile  # noqa: E402
+
+# ==================================================
+# 壓測：python loadtest.py --workers 1,2,4 --concurrency 32 --duration 30
+# ==================================================
+# 每個 worker 數各跑一輪：啟動 gemini_stub.py、supabase_stub.py 與
+# `uvicorn main:app --workers N`（三個獨立 process，走真的 HTTP），
+# 用 SUPABASE_JWT_SECRET 簽發的 HS256 token 打 /predict 與 /overall-insight。
+#
+#   --concurrency C  closed loop：C 個虛擬使用者，收到回應才送下一個
+#   --rate R         open loop：平均每秒 R 個請求（Poisson 到達），延遲從「預定送出時間」起算，
+#                    server 變慢時排隊的時間也算進去（避免 coordinated omission）
+#   --mix            端點比例，例如 predict=0.8,overall-insight=0.1,overall-range=0.1（overall-range 只送日期區間）
+#   --llm-budget S   /predict 帶 X-LLM-Budget: S，Gemini 超過 S 秒就回範本報告（比較 tail latency 用）
+#   --target URL     不啟動任何 process，直接壓已經在跑的服務（--workers 只當作標籤）
+#
+# 回報每個端點的 throughput、p50 / p95 / p99、錯誤分類（HTTP 狀態碼 / 例外類型），
+# 以及 event loop lag：壓測期間每 --probe-interval 秒打一次 /healthz，減掉閒置時的基準值。
+# client 與 server 在同一台機器時，數字也包含 client 端本身的排程延遲。
+
+DISEASE_NAMES = [
+    "Cardiovascular Disease",
+    "Stroke",
+    "Hypertension (high blood pressure)",
+    "Hyperlipidemia (high cholesterol)",
+    "Coronary Artery Disease (heart artery block)",
+    "Arrhythmia / Palpitations",
+]
+
+
+def predict_body(rng):
+    # 輸入略有不同，避免全部命中 LLM 快取
+    body = dict(SAMPLE_INPUT)
+    body["age"] = rng.randint(30, 85)
+    body["systolic_bp"] = rng.randint(100, 180)
+    body["diastolic_bp"] = rng.randint(60, 110)
+    body["weight"] = float(rng.randint(50, 110))
+    body["symptoms"] = rng.sample(["chest_tightness", "palpitations", "dizziness", "shortness_of_breath"], rng.randint(0, 2))
+    return body
+
+
+def overall_body(rng):
+    names = rng.sample(DISEASE_NAMES, rng.randint(2, 5))
+    return [{"name": name, "probability": round(rng.uniform(30, 95), 1)} for name in names]
+
+
+def overall_range_body(rng):
+    # 新版：只送日期區間，由伺服器查詢該使用者的報告並彙總
+    return {"start_date": f"2020-01-{rng.randint(1, 28):02d}", "end_date": None}
+
+
+ENDPOINTS = {
+    "predict": ("/predict", predict_body),
+    "overall-insight": ("/overall-insight", overall_body),
+    "overall-range": ("/overall-insight", overall_range_body),
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint in --mix: {name} (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return list(mix), list(mix.values())
+
+
+# ---------- 被測服務 ----------
+
+class Stack:
+    """gemini_stub + supabase_stub + uvicorn main:app --workers N"""
+
+    def __init__(self, workers, args, log_dir):
+        self.workers = workers
+        self.args = args
+        self.log_dir = log_dir
+        self.app_url = f"http://127.0.0.1:{args.port}"
+        self.gemini_url = f"http://127.0.0.1:{args.port + 1}"
+        self.supabase_url = f"http://127.0.0.1:{args.port + 2}"
+        self.procs = {}
+
+    def _spawn(self, name, module, port, env, *extra):
+        log = open(os.path.join(self.log_dir, f"{name}-w{self.workers}.log"), "w")
+        self.procs[name] = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning", *extra],
+            env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        log.close()
+
+    async def start(self):
+        await self.start_stubs()
+        await self.start_app()
+
+    async def start_stubs(self):
+        args = self.args
+        self._spawn("gemini_stub", "gemini_stub:app", args.port + 1, {
+            **os.environ,
+            "GEMINI_STUB_LATENCY": str(args.gemini_latency),
+            "GEMINI_STUB_LATENCY_DIST": args.gemini_dist,
+            "GEMINI_STUB_JITTER": str(args.gemini_jitter),
+            "GEMINI_STUB_SIGMA": str(args.gemini_sigma),
+            "GEMINI_STUB_ERROR_RATE": str(args.gemini_error_rate),
+        })
+        self._spawn("supabase_stub", "supabase_stub:app", args.port + 2, {
+            **os.environ,
+            "SUPABASE_STUB_LATENCY": str(args.supabase_latency),
+            "SUPABASE_STUB_ERROR_RATE": str(args.supabase_error_rate),
+        })
+        await wait_ready(f"{self.gemini_url}/stats", args.startup_timeout)
+        await wait_ready(f"{self.supabase_url}/stats", args.startup_timeout)
+
+    async def start_app(self, poll_interval=0.2):
+        args = self.args
+        self._spawn("app", "main:app", args.port, {
+            **os.environ,
+            "SUPABASE_URL": self.supabase_url,
+            "SUPABASE_SERVICE_KEY": "stub-service-key",
+            "GEMINI_API_BASE": self.gemini_url,
+            "GEMINI_API_KEY": "stub-key",
+            "REPORT_SPILL_PATH": os.path.join(self.log_dir, f"pending_reports-w{self.workers}.jsonl"),
+            "REPORT_DEAD_LETTER_PATH": os.path.join(self.log_dir, f"rejected_reports-w{self.workers}.jsonl"),
+            "WEB_CONCURRENCY": str(self.workers),  # CPU_POOL_SIZE 的預設值依 worker 數平分核心
+        }, "--workers", str(self.workers))
+        await wait_ready(f"{self.app_url}/healthz", args.startup_timeout, self.procs["app"], poll_interval)
+
+    async def stub_stats(self):
+        stats = {}
+        async with httpx.AsyncClient(timeout=5) as client:
+            for name, url in (("gemini", self.gemini_url), ("supabase", self.supabase_url)):
+                try:
+                    stats[name] = (await client.get(f"{url}/stats")).json()
+                except httpx.HTTPError:
+                    stats[name] = None
+        return stats
+
+    def stop(self, name):
+        proc = self.procs.pop(name, None)
+        if proc is None:
+            return
+        proc.send_signal(signal.SIGTERM)  # uvicorn 收到 SIGTERM 會跑 shutdown（寫完報告佇列）
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    def stop_all(self):
+        for name in ("app", "gemini_stub", "supabase_stub"):  # app 先關，佇列才寫得進 supabase stub
+            self.stop(name)
+
+
+async def wait_ready(url, timeout, proc=None, poll_interval=0.2):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.perf_counter() < deadline:
+            if proc is not None and proc.poll() is not None:
+                raise SystemExit(f"Server exited during startup (code {proc.returncode}); see the logs.")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(poll_interval)
+    raise SystemExit(f"{url} was not ready after {timeout}s")
+
+
+# ---------- 負載產生 ----------
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # endpoint -> 成功請求的延遲（秒）
+        self.errors = defaultdict(Counter)  # endpoint -> {"HTTP 503": n, "ReadTimeout": n}
+
+    def add(self, endpoint, latency, outcome):
+        if outcome == "ok":
+            self.latencies[endpoint].append(latency)
+        else:
+            self.errors[endpoint][outcome] += 1
+
+
+class LoadGenerator:
+    def __init__(self, base_url, args, tokens):
+        self.base_url = base_url
+        self.args = args
+        self.tokens = tokens
+        self.names, self.weights = parse_mix(args.mix)
+
+    def _client(self, connections):
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=self.args.timeout,
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        )
+
+    async def _send(self, client, rng, recorder, scheduled):
+        endpoint = rng.choices(self.names, self.weights)[0]
+        path, make_body = ENDPOINTS[endpoint]
+        headers = {"Authorization": f"Bearer {rng.choice(self.tokens)}"}
+        if self.args.llm_budget is not None and path == "/predict":
+            headers["X-LLM-Budget"] = str(self.args.llm_budget)
+        try:
+            response = await client.post(path, json=make_body(rng), headers=headers)
+            outcome = "ok" if response.status_code == 200 else f"HTTP {response.status_code}"
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        recorder.add(endpoint, time.perf_counter() - scheduled, outcome)
+
+    async def closed_loop(self, client, duration, recorder):
+        deadline = time.perf_counter() + duration
+
+        async def user(i):
+            rng = random.Random(i)
+            while time.perf_counter() < deadline:
+                await self._send(client, rng, recorder, time.perf_counter())
+
+        await asyncio.gather(*(user(i) for i in range(self.args.concurrency)))
+
+    async def open_loop(self, client, duration, recorder):
+        rng = random.Random(0)
+        start = time.perf_counter()
+        scheduled = start
+        tasks = set()
+        while True:
+            scheduled += rng.expovariate(self.args.rate)
+            if scheduled >= start + duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(tasks) >= self.args.max_inflight:
+                # client 端已經有太多請求在等 → 記為錯誤，不讓 client 本身無限制地堆積
+                recorder.add(rng.choices(self.names, self.weights)[0], 0.0, "client_overload")
+                continue
+            task = asyncio.create_task(self._send(client, rng, recorder, scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def run_phase(self, duration):
+        recorder = Recorder()
+        connections = self.args.concurrency if self.args.rate is None else self.args.max_inflight
+        async with self._client(connections) as client:
+            start = time.perf_counter()
+            if self.args.rate is None:
+                await self.closed_loop(client, duration, recorder)
+            else:
+                await self.open_loop(client, duration, recorder)
+            elapsed = time.perf_counter() - start
+        return recorder, elapsed
+
+
+async def probe_lag(base_url, interval, stop, samples):
+    # 獨立的連線，不跟負載搶 connection pool
+    async with httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                await client.get("/healthz")
+                samples.append(time.perf_counter() - t0)
+            except httpx.HTTPError:
+                pass
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def idle_baseline(base_url, probes=20):
+    # 每一輪分別量：閒置時的 /healthz 往返時間會隨 worker 數不同（例如多 worker 時 uvicorn 的 socket 設定）
+    samples = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+        for _ in range(probes):
+            t0 = time.perf_counter()
+            await client.get("/healthz")
+            samples.append(time.perf_counter() - t0)
+    return percentile(sorted(samples), 50)
+
+
+# ---------- 報告 ----------
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def summarize(recorder, elapsed, lag_samples, baseline):
+    endpoints = {}
+    total_ok = total_err = 0
+    all_latencies = []
+    for endpoint in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = sorted(recorder.latencies[endpoint])
+        errors = recorder.errors[endpoint]
+        total_ok += len(latencies)
+        total_err += sum(errors.values())
+        all_latencies.extend(latencies)
+        endpoints[endpoint] = {
+            "ok": len(latencies),
+            "errors": dict(errors),
+            "throughput_per_s": round(len(latencies) / elapsed, 1),
+            "p50_ms": _ms(percentile(latencies, 50)),
+            "p95_ms": _ms(percentile(latencies, 95)),
+            "p99_ms": _ms(percentile(latencies, 99)),
+            "max_ms": _ms(latencies[-1]) if latencies else 0.0,
+        }
+    all_latencies.sort()
+    lag = sorted(max(0.0, s - baseline) for s in lag_samples)
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "ok": total_ok,
+        "errors": total_err,
+        "error_rate": round(total_err / (total_ok + total_err), 4) if total_ok + total_err else 0.0,
+        "throughput_per_s": round(total_ok / elapsed, 1),
+        "p50_ms": _ms(percentile(all_latencies, 50)),
+        "p99_ms": _ms(percentile(all_latencies, 99)),
+        "endpoints": endpoints,
+        "loop_lag": {
+            "baseline_ms": _ms(baseline),
+            "probes": len(lag),
+            "p50_ms": _ms(percentile(lag, 50)),
+            "p99_ms": _ms(percentile(lag, 99)),
+            "max_ms": _ms(lag[-1]) if lag else 0.0,
+        },
+    }
+
+
+def print_run(label, result):
+    print(f"\n=== {label}: {result['throughput_per_s']} ok/s, {result['ok']} ok, "
+          f"{result['errors']} errors in {result['elapsed_s']}s ===")
+    print(f"{'endpoint':18} {'ok':>7} {'ok/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  errors")
+    for endpoint, r in result["endpoints"].items():
+        errors = ", ".join(f"{k} ×{v}" for k, v in sorted(r["errors"].items())) or "-"
+        print(f"{endpoint:18} {r['ok']:>7} {r['throughput_per_s']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} "
+              f"{r['p99_ms']:>9} {r['max_ms']:>9}  {errors}")
+    lag = result["loop_lag"]
+    print(f"loop lag (/healthz, {lag['probes']} probes, idle {lag['baseline_ms']} ms): "
+          f"p50 +{lag['p50_ms']} ms, p99 +{lag['p99_ms']} ms, max +{lag['max_ms']} ms")
+    stubs = result.get("stubs")
+    if stubs:
+        gemini, supabase = stubs.get("gemini") or {}, stubs.get("supabase") or {}
+        print(f"stubs: gemini requests={gemini.get('requests')} injected_errors={gemini.get('errors')}, "
+              f"supabase rows={supabase.get('tables')} injected_errors={supabase.get('errors')}")
+
+
+def print_comparison(results):
+    print(f"\n{'workers':>8} {'ok/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'lag p99':>9} {'errors':>8}")
+    for workers, r in results.items():
+        print(f"{workers:>8} {r['throughput_per_s']:>8} {r['p50_ms']:>9} {r['p99_ms']:>9} "
+              f"{r['loop_lag']['p99_ms']:>9} {r['error_rate']:>8.2%}")
+
+
+async def run_once(base_url, args, tokens):
+    generator = LoadGenerator(base_url, args, tokens)
+    if args.warmup > 0:
+        await generator.run_phase(args.warmup)  # 暖機（不計入結果）
+
+    baseline = await idle_baseline(base_url)
+    lag_samples, stop = [], asyncio.Event()
+    prober = asyncio.create_task(probe_lag(base_url, args.probe_interval, stop, lag_samples))
+    recorder, elapsed = await generator.run_phase(args.duration)
+    stop.set()
+    await prober
+    return summarize(recorder, elapsed, lag_samples, baseline)
+
+
+async def main_async(args):
+    tokens = [mint_token() for _ in range(args.users)]
+    worker_counts = [int(w) for w in args.workers.split(",")]
+    results = {}
+
+    if args.target:
+        for workers in worker_counts:
+            results[workers] = await run_once(args.target.rstrip("/"), args, tokens)
+            print_run(f"{args.target} (workers={workers})", results[workers])
+    else:
+        log_dir = tempfile.mkdtemp(prefix="loadtest-")
+        print(f"INFO: Server logs in {log_dir}")
+        for workers in worker_counts:
+            stack = Stack(workers, args, log_dir)
+            try:
+                await stack.start()
+                result = await run_once(stack.app_url, args, tokens)
+                stack.stop("app")  # 先讓 app 把報告佇列寫進 supabase stub，再讀 stub 統計
+                result["stubs"] = await stack.stub_stats()
+            finally:
+                stack.stop_all()
+            results[workers] = result
+            print_run(f"workers={workers}", result)
+
+    if len(results) > 1:
+        print_comparison(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+        print(f"✅ Results written to {args.json}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test /predict and /overall-insight against local stubs.")
+    parser.add_argument("--workers", default="1", help="comma-separated uvicorn worker counts, one run each")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=int, default=16, help="closed loop: concurrent virtual users")
+    load.add_argument("--rate", type=float, help="open loop: target requests per second")
+    parser.add_argument("--max-inflight", type=int, default=1000, help="open loop: client-side cap on outstanding requests")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before each run")
+    parser.add_argument("--mix", default="predict=0.8,overall-insight=0.2")
+    parser.add_argument("--llm-budget", type=float, help="send X-LLM-Budget (seconds) with /predict: template report when Gemini is slower")
+    parser.add_argument("--users", type=int, default=50, help="distinct users (tokens) to spread requests over")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--probe-interval", type=float, default=0.1, help="seconds between /healthz lag probes")
+    parser.add_argument("--target", help="load an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8100, help="app port; stubs use port+1 (Gemini) and port+2 (Supabase)")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="stub Gemini latency in seconds")
+    parser.add_argument("--gemini-dist", choices=["uniform", "lognormal", "exponential", "fixed"], default="lognormal")
+    parser.add_argument("--gemini-jitter", type=float, default=0.1, help="uniform: ± seconds")
+    parser.add_argument("--gemini-sigma", type=float, default=0.5, help="lognormal: sigma")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--supabase-latency", type=float, default=0.01)
+    parser.add_argument("--supabase-error-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="write all results to this file")
+    args = parser.parse_args(argv)
+    if args.rate is not None:
+        args.concurrency = None
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,79 @@
+import json
+import logging
+import sys
+
+from settings import LOG_LEVEL, LOG_FORMAT
+from tracing import current_trace_id
+
+# ==================================================
+# 結構化 log（取代請求路徑上的 print）
+# ==================================================
+#   log = get_logger("main")
+#   log.info("models_loaded", versions={...})
+#   → {"ts": 1760000000.123, "level": "info", "logger": "main", "event": "models_loaded", "versions": {...}}
+#
+# 低於 LOG_LEVEL 的呼叫在格式化之前就 return，hot path 上的 debug log 幾乎沒有成本。
+# 請求有被追蹤（tracing.py）時會附上 trace_id。LOG_FORMAT="text" 時輸出
+# "LEVEL logger event key=value ..."，方便本機開發。
+
+_ROOT = "app"  # 只設定自己的 logger，不影響 uvicorn 的 log
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name[len(_ROOT) + 1:],
+            "event": record.getMessage()
+        }
+        trace_id = current_trace_id()
+        if trace_id:
+            data["trace_id"] = trace_id
+        data.update(getattr(record, "fields", {}))
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        return f"{record.levelname}: {record.name[len(_ROOT) + 1:]} {record.getMessage()} {fields}".rstrip()
+
+
+def _configure():
+    root = logging.getLogger(_ROOT)
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_TextFormatter() if LOG_FORMAT == "text" else _JsonFormatter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL.upper())
+    root.propagate = False
+
+
+class StructuredLogger:
+    __slots__ = ("_logger",)
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(f"{_ROOT}.{name}")
+
+    def _log(self, level, event, fields):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={"fields": fields})
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+
+def get_logger(name):
+    _configure()
+    return StructuredLogger(name)
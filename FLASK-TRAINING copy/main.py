@@ -1,20 +1,51 @@
 import os # 操作系統相關功能 讀取.env的檔案
+import re
+import time
 import json
+import hashlib
+import asyncio
+from contextlib import asynccontextmanager
 import httpx # 呼叫 Gemini API
 from dotenv import load_dotenv # 從.env檔案載入環境變數到os.environ
-from fastapi import FastAPI, Header, HTTPException, Depends, Body # FastAPI 核心元件
+from fastapi import FastAPI, Header, HTTPException, Depends, Body, Request, Query, Response # FastAPI 核心元件
 from pydantic import BaseModel # 用來定義資料驗證模型
-from supabase import create_client, Client # sdk -> kit 工具包 
 from typing import Dict, Any # python 型別註解
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware # 處理跨來源資源共享 (CORS) Cross origin Resource Sharing
 import jwt # 用於解碼和驗證的 JWT Token
 from jwt import PyJWTError # JWT 錯誤處理
 from typing import List
-from typing import Optional
-from models import predict_cardio_probability, predict_stroke_probability
+from typing import Optional, Union
+from models import registry
+from executors import run_cpu, run_io, start_executors, shutdown_executors, cpu_pending
+from report_queue import ReportWriter
+from llm_cache import LLMCache, prompt_key
+from singleflight import SingleFlight
+from llm_stream import PartialReportParser, iter_gemini_stream_text, sse_event
+from llm_client import GeminiClient, CircuitOpenError
+from settings import (
+    STREAM_REPORT_ID_TIMEOUT, GEMINI_API_BASE, GEMINI_PREWARM, TRACING, PROFILING, ADMIN_USER_IDS,
+    REPORTS_PAGE_DEFAULT, REPORTS_PAGE_MAX, OVERALL_NOTE_MODE,
+    PREDICT_LLM_BUDGET, PREDICT_LLM_BUDGET_MIN, PREDICT_LLM_BUDGET_MAX, PREDICT_LLM_BACKFILL
+)
+import metrics
+from metrics import (
+    MetricsMiddleware, stage, route_path, GEMINI_SECONDS, GEMINI_PROMPT_TOKENS, GEMINI_CANDIDATE_TOKENS,
+    GEMINI_RESPONSE_BYTES, LLM_PARSE, LLM_PARSE_SECONDS, PREDICT_REPORT_SOURCE, LLM_BACKFILL
+)
+from tracing import TracingMiddleware, span
+from profiler import SamplingProfiler, ProfilingMiddleware
+from token_cache import VerifiedTokenCache
+from report_history import (
+    parse_range, aggregate_diseases, REPORT_PROJECTIONS, decode_cursor, list_reports_page, get_report, validate_report_id
+)
+from disease_library import DiseaseLibrary, note_payload, template_note
+from report_templates import template_prediction_report
+from logs import get_logger
 
 #---1．配置與初始化 —--
 load_dotenv() # 執行載入.env檔案
+log = get_logger("main")
 
 #======================================================
 # Supabase配置 從.env檔案讀取key and address
@@ -27,20 +58,119 @@ SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 # Gemini API 終端點
+# GEMINI_API_BASE 可由環境變數覆寫（例如指向本機 gemini_stub.py）
 GEMINI_MODEL = "gemini-2.5-flash"
-GEMINI_API_BASE = "https://generativelanguage.googleapis.com"
-GEMINI_API_PATH = f"/v1beta/models/{GEMINI_MODEL}:generateContent"
 
 # 檢查必要變數是否存在 若沒有則報錯
 if not SUPABASE_URL or not SUPABASE_SERVICE_KEY or not SUPABASE_JWT_SECRET:
     raise RuntimeError("Supabase configuration missing. Please check the .env file for URL, Service Key, and JWT Secret.")
 if not GEMINI_API_KEY:
     # This WARNING is acceptable because the Canvas environment may provide the key at runtime
-    print("WARNING: GEMINI_API_KEY is not set. It will rely on the Canvas environment to provide it at runtime.")
+    log.warning("gemini_api_key_missing", detail="It will rely on the Canvas environment to provide it at runtime.")
 
-app = FastAPI() # 建立 FastAPI 應用實例
-supabase : Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY) # 初始化 Supabase 客戶端
-http_client = httpx.AsyncClient(timeout=120.0) # 初始化 HTTP 非同步客戶端，設定超時時間為120秒
+# ======================================================
+# 啟動 / 關閉（FastAPI lifespan）
+# ======================================================
+# import main 時不建立任何 client、不載入模型；全部在 lifespan 裡依序完成：
+#   1. Supabase client：SDK（含 auth / realtime / storage 子套件）import 很慢，而且只有背景寫入報告用到，
+#      所以在背景 thread 建立，與下一步同時進行
+#   2. 模型載入 + CPU pool 啟動（每個 worker 載入模型並實際算一筆，scoring.warmup）
+#   3. 暖機：經由 run_cpu 走一次完整的計算路徑並檢查結果
+#   4. Gemini client（GEMINI_PREWARM=1 時先建立連線）、報告寫入佇列
+# 全部完成後才 yield，uvicorn 這時才開始接受連線，/healthz 也才回 200。
+supabase = None # 初始化 Supabase 客戶端（lifespan）
+gemini_client = None # 限制並行數、重試與 circuit breaker 都在 llm_client.py（lifespan）
+ready = False
+
+def open_supabase():
+    from supabase import create_client # sdk -> kit 工具包
+    return create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+def load_models():
+    # 啟動時就把模型載入記憶體；之後由背景 thread 檢查 models_manifest.json，有新版本時整組熱替換
+    registry.load_all()
+    registry.start_watcher()
+    log.info("models_loaded", manifest=registry.version,
+             versions={k: v[:12] for k, v in registry.versions().items()})
+    start_executors()
+    # /overall-insight 的疾病解說；缺少的疾病會在第一次用到時由 Gemini 產生
+    disease_library.load()
+    missing = disease_library.missing()
+    if missing:
+        log.warning("disease_library_incomplete", path=disease_library.path, missing=missing,
+                    overlay=disease_library.overlay_path)
+
+async def warmup():
+    # 與請求相同的路徑：pydantic 驗證 → pickle 到 CPU pool → 計算 → 檢查機率
+    fields = PredictionInput(**WARMUP_FIELDS).model_dump()
+    check_scores(await run_cpu(score_record, fields))
+
+def insert_report_rows(table, rows):
+    # 一次 insert 多列（在 IO thread pool 執行）
+    return supabase.table(table).insert(rows).execute().data
+
+def update_report_row(table, row_id, user_id, values):
+    # 回填晚到的 LLM 報告（在 IO thread pool 執行）；同時比對 user_id，只會改到自己的報告
+    return supabase.table(table).update(values).eq("id", row_id).eq("user_id", user_id).execute().data
+
+report_writer = ReportWriter(insert_report_rows) # 報告寫入改為背景批次處理
+disease_library = DiseaseLibrary() # 疾病解說庫（disease_explanations.json），在 load_models 載入
+
+async def start_report_writer():
+    await report_writer.start()
+
+async def stop_background_work():
+    global ready
+    ready = False
+    if backfills:
+        # 回填只是盡力而為：還在等 Gemini 的就放棄，報告保留範本內容
+        log.info("llm_backfill_cancelled", pending=len(backfills))
+        for task in list(backfills):
+            task.cancel()
+        await asyncio.gather(*backfills, return_exceptions=True)
+    await report_writer.stop() # 先把佇列寫完，executor 才能關
+    shutdown_executors()
+    registry.stop_watcher()
+    await gemini_client.aclose()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global supabase, gemini_client, ready
+    started = time.perf_counter()
+    phases = {}
+
+    def mark(name, since):
+        phases[name] = round(time.perf_counter() - since, 3)
+
+    supabase_future = asyncio.get_running_loop().run_in_executor(None, open_supabase)
+
+    t = time.perf_counter()
+    load_models()
+    mark("models", t)
+
+    t = time.perf_counter()
+    await warmup()
+    mark("warmup", t)
+
+    t = time.perf_counter()
+    supabase = await supabase_future
+    mark("supabase_wait", t)
+
+    t = time.perf_counter()
+    gemini_client = GeminiClient(GEMINI_API_BASE, GEMINI_API_KEY, GEMINI_MODEL)
+    if GEMINI_PREWARM:
+        await gemini_client.prewarm()
+    mark("gemini", t)
+
+    await start_report_writer()
+    ready = True
+    log.info("worker_ready", pid=os.getpid(), startup_seconds=round(time.perf_counter() - started, 3), phases=phases)
+    try:
+        yield
+    finally:
+        await stop_background_work()
+
+app = FastAPI(lifespan=lifespan) # 建立 FastAPI 應用實例
 
 # ======================================================
 # CORS 配置
@@ -57,7 +187,17 @@ app.add_middleware(
     allow_credentials=True, # 允許攜帶cookie 或認證資訊
     allow_methods=["*"], # 允許所有HTTP方法 (GET, POST, etc.)
     allow_headers=["*"], # 允許所有header
+    expose_headers=["X-Report-Source"], # 讓前端讀得到 /predict 的報告來源（llm / template）
 )
+app.add_middleware(MetricsMiddleware) # 整個請求的時間與 in-flight 數量（/metrics）
+
+# 追蹤與取樣 profiler：關閉時不掛 middleware，請求完全不經過
+profiler = SamplingProfiler() if PROFILING else None
+if profiler is not None:
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+if TRACING != "off":
+    # 最外層：trace id 給 profiler 的檔名使用；header 模式只接受管理員 token 的 X-Trace
+    app.add_middleware(TracingMiddleware, allow=lambda scope: is_admin_request(scope))
 # ======================================================
 
 # 2. 數據模型
@@ -96,7 +236,17 @@ class RiskReport(BaseModel):
     llm_report: Dict[str, Any]
     rule_report: Dict[str, Any]
 
+# 批次篩檢：一次送入多位病患
+MAX_BATCH_SIZE = 1000
+MAX_BATCH_LLM_SIZE = 20  # include_llm 時每次最多幾筆（每筆一個 Gemini 呼叫）
+BATCH_LLM_CONCURRENCY = 4  # 同一個批次同時進行的 Gemini 呼叫數，其餘的請求仍拿得到 Gemini 的名額
+
+class BatchPredictionInput(BaseModel):
+    records: List[PredictionInput]
+    include_llm: bool = False  # 預設不產生 LLM 說明（批次篩檢只需要機率）
+
 class OverallInsightInput(BaseModel):
+    # "YYYY-MM-DD"（整天）或 ISO 8601 時間；都不給 = 全部歷史
     start_date: Optional[str] = None
     end_date: Optional[str] = None
 
@@ -104,7 +254,10 @@ class OverallInsightInput(BaseModel):
 #     return all(ord(c) < 128 for c in text if c.isalpha())
 
 # --- 3. 身份驗證依賴（PyJWT 離線驗證）---
-async def get_current_user(authorization: str = Header(None)): # FaceAPI的一種自動題取機制, None就像defalut is optional, 從 Header 取出 Authorization 欄位 儲存到 authorization 變數
+# 驗證成功的 token 以 sha256 digest 快取（不超過 token 的 exp），同一個 token 重複呼叫時不再重算簽章
+token_cache = VerifiedTokenCache()
+
+async def get_current_user(request: Request, authorization: str = Header(None)): # FaceAPI的一種自動題取機制, None就像defalut is optional, 從 Header 取出 Authorization 欄位 儲存到 authorization 變數
 # Ex.
 # POST /predict HTTP/1.1
 # Host: localhost:8000
@@ -117,16 +270,9 @@ async def get_current_user(authorization: str = Header(None)): # FaceAPI的一
     token = authorization.split(" ")[1] # token 就像通行證 是亂碼, Bearer 後面的有一個空格 split 把它切開取第二個元素 Ex. eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9...
 
     try:
-        # 使用 SUPABASE_JWT_SECRET 進行離線解碼
-        # JWT (supabase 提供的驗證服務)
-        # 使用密鑰進行 離線驗證
-        payload = jwt.decode( 
-            token, 
-            SUPABASE_JWT_SECRET, 
-            algorithms=["HS256"],
-            audience = "authenticated" # 確保這個 token 是給已驗證用戶的
-        )
-        print(f"INFO: JWT verification successful, User ID: {payload.get('sub')}") # sub 是 JWT 的標準欄位之一，通常用來存放用戶的唯一識別碼 User ID
+        with stage(route_path(request.scope), "auth"):
+            payload, cached = verify_token(token)
+        log.debug("jwt_verified", user_id=payload.get("sub"), cached=cached) # sub 是 JWT 的標準欄位之一，通常用來存放用戶的唯一識別碼 User ID
         return {"id" : payload.get("sub"), "user_metadata": payload}
 # Ex. Inside token payload
 # {
@@ -138,236 +284,175 @@ async def get_current_user(authorization: str = Header(None)): # FaceAPI的一
 # }
     
     except PyJWTError as e:
-        print(f"JWT verification failed: {e}")
+        log.warning("jwt_verification_failed", error=str(e))
         raise HTTPException(status_code=401, detail="")
     except Exception as e:
-        print(f"Unexpected error during authentication: {e}")
+        log.error("authentication_error", error=repr(e))
         raise HTTPException(status_code=401, detail="")
 
-# --- 4. 機率計算邏輯（使用 dataset / 規則 / ML）---
-from models import predict_cardio_probability
-
-def rule_hypertension(data):
-    sbp = data.systolic_bp
-    dbp = data.diastolic_bp
-    if sbp >= 140 or dbp >= 90:
-        return {"name": "Hypertension (high blood pressure)", "probability": 70.0}
-    elif 120 <= sbp <= 139 or 80 <= dbp <= 89:
-        return {"name": "Hypertension (high blood pressure)", "probability": 40.0}
-    else:
-        return {"name": "Hypertension (high blood pressure)", "probability": 10.0}
-
-# https://www.hpa.gov.tw/Pages/Detail.aspx?nodeid=127&pid=8159
-
-def rule_hyperlipidemia(data):
-    chol = data.cholesterol
-
-    high_fat_diet = getattr(data, "high_fat_diet", 0)       # 高脂飲食
-    active = getattr(data, "active", 1)                     # 身體活動
-    alcohol = getattr(data, "alcohol", 0)                   # 酒精攝取
-    stress_level = getattr(data, "stress_level", 0)         # 壓力程度
-    family_hd = getattr(data, "family_heart_disease", 0)    # 家族心臟病
+def verify_token(token: str):
+    """驗證 JWT，回傳 (payload, 是否來自快取)；驗證失敗丟出 PyJWTError"""
+    key = token_cache.key(token)
+    payload = token_cache.get(key)
+    if payload is not None:
+        return payload, True
+    # 使用 SUPABASE_JWT_SECRET 進行離線解碼
+    # JWT (supabase 提供的驗證服務)
+    # 使用密鑰進行 離線驗證
+    payload = jwt.decode(
+        token,
+        SUPABASE_JWT_SECRET,
+        algorithms=["HS256"],
+        audience = "authenticated" # 確保這個 token 是給已驗證用戶的
+    )
+    token_cache.put(key, payload)
+    return payload, False
+
+def is_admin_request(scope) -> bool:
+    """TracingMiddleware 用：Authorization 是 ADMIN_USER_IDS 裡的使用者才回傳 True（任何錯誤都是 False）"""
+    authorization = dict(scope.get("headers", [])).get(b"authorization", b"").decode("latin-1")
+    if not authorization.startswith("Bearer "):
+        return False
+    try:
+        payload, _ = verify_token(authorization.split(" ")[1])
+    except PyJWTError:
+        return False
+    return payload.get("sub") in ADMIN_USER_IDS
 
-    conditions = 0
+# --- 4. 機率計算邏輯（使用 dataset / 規則 / ML）---
+# 規則與 ML 計算在 scoring.py；經由 executors 丟到 CPU pool 執行，不佔用 event loop
+from scoring import score_record, score_records, WARMUP_FIELDS, check_scores
 
-    if chol is None:
-        probability = 10.0
-    elif chol > 240:
-        probability = 65.0
-    elif 200 <= chol <= 239:
-        probability = 35.0
-    else:
-        probability = 10.0
-
-    if high_fat_diet >= 2:  
-        conditions += 1
-    if active == 0:           
-        conditions += 1
-    if alcohol == 1:           
-        conditions += 1
-    if stress_level == 2:      
-        conditions += 1
-    if family_hd == 1:         
-        conditions += 1
-
-    if conditions >= 3:
-        probability += 15
-    elif conditions >= 1:
-        probability +=10
-
-    probability = min(probability, 70.0)
-
-    return {"name": "Hyperlipidemia (high cholesterol)", "probability": probability}
-
-# https://wwwv.tsgh.ndmutsgh.edu.tw/unit/10012/12867
-
-# def rule_atherosclerosis(data):
-#     age = data.age
-#     smoker = data.smoke
-#     sbp = data.systolic_bp
-#     dbp = data.diastolic_bp
-#     chol = data.cholesterol  
-#     family_hd = getattr(data, "family_heart_disease", False)  
-
-#     high_bp = (sbp >= 140 or dbp >= 90)
-#     high_chol = (chol is not None and chol > 240)
-
-#     conditions = 0
-#     conditions += 1 if age > 50 else 0
-#     conditions += 1 if smoker == 1 else 0
-#     conditions += 1 if high_bp else 0
-#     conditions += 1 if high_chol else 0
-#     conditions += 1 if family_hd else 0 
-
-#     if conditions >= 4:
-#         probability = 70.0
-#     elif conditions == 3:
-#         probability = 60.0
-#     elif conditions == 2:
-#         probability = 35.0
-#     else:
-#         probability = 15.0
-
-#     return {"name": "Atherosclerosis (artery hardening)", "probability": probability}
-
-# https://www.ntuh.gov.tw/telehealth/Fpage.action?fid=1547
-# https://www.liver.org.tw/journalView.php?cat=73&sid=1067&page=1
-
-def rule_arrhythmia_by_symptoms(data):
+# --- 5.  LLM 交互邏輯（使用 Gemini API）---
+llm_cache = LLMCache() # 相同 prompt 直接回傳快取結果，不再呼叫 Gemini
+llm_singleflight = SingleFlight() # 相同 prompt 同時進行中的呼叫合併成一次
+
+def parse_llm_json(text: str) -> Dict[str, Any]:
+    """提取第一個 { 到最後一個 } 之間的內容並解析；失敗時丟出 ValueError"""
+    start_index = text.find("{")
+    end_index = text.rfind("}")
+    if start_index == -1 or end_index == -1:
+        raise ValueError("LLM returned content does not contain JSON format")
+
+    json_string = text[start_index : end_index + 1]
+    # 關鍵：處理 LLM 可能回傳的非法轉義字元
+    json_string = re.sub(r'[\x00-\x1F\x7F]', '', json_string)
+    return json.loads(json_string)
+
+def parse_llm_report(text: str) -> Dict[str, Any]:
+    """parse_llm_json，並記錄解析時間與成功 / fallback 次數（/metrics）"""
+    start = time.perf_counter()
+    with span("llm.parse") as s:
+        try:
+            report = parse_llm_json(text)
+        except ValueError:
+            LLM_PARSE.inc(1, "fallback")
+            s.set("result", "fallback")
+            raise
+        finally:
+            LLM_PARSE_SECONDS.observe(time.perf_counter() - start)
+    LLM_PARSE.inc(1, "ok")
+    return report
+
+async def generate_llm_json(payload: Dict[str, Any]) -> Dict[str, Any]:
     """
-    根據勾選的心悸症狀 + 高風險因素計算機率
+    呼叫 Gemini generateContent 並解析 JSON。
+    相同 prompt 同時進來時只打一次 Gemini（single-flight）。回傳的 dict 之後會被修改，
+    所以只有發起呼叫的人直接用 _fetch_llm_report 解析好的結果，共用結果的其他呼叫者各自解析一份。
     """
-    symptoms = getattr(data, "arrhythmia_symptoms", [])
-    symptom_count = len(symptoms)
-
-    risk_factors = 0
-    if getattr(data, "hypertension", 0) == 1:
-        risk_factors += 1
-    if getattr(data, "family_heart_disease", 0) == 1:
-        risk_factors += 1
-    if getattr(data, "smoke", 0) == 1:
-        risk_factors += 1
-    if getattr(data, "active", 0) == 0:
-        risk_factors += 1
-    if getattr(data, "cholesterol", 0) > 240:
-        risk_factors += 1
-
-    total_score = symptom_count + risk_factors
-
-    if total_score == 0:
-        probability = 10.0
-    elif total_score <= 3:
-        probability = 35.0
-    elif total_score <= 6:
-        probability = 55.0
-    else:
-        probability = 70.0
-
-    return {"name": "Arrhythmia / Palpitations", "probability": probability}
-
-# https://helloyishi.com.tw/heart-health/arrhythmias/what-are-heart-palpitations/
-
-def rule_cad(data):
+    key = prompt_key(GEMINI_MODEL, payload)
+    with span("llm.cache_lookup") as s:
+        cached = await llm_cache.get(key)
+        s.set("hit", cached is not None)
+    if cached is not None:
+        return parse_llm_report(cached)
+    leader = not llm_singleflight.in_flight(key) # 與 do() 之間沒有 await，不會被其他請求插隊
+    text, report = await llm_singleflight.do(key, lambda: _fetch_llm_report(payload, key))
+    if report is None:
+        raise ValueError("LLM returned content that could not be parsed as JSON")
+    return report if leader else parse_llm_report(text)
+
+async def _fetch_llm_report(payload: Dict[str, Any], key: str):
     """
-    根據高風險因子計算 CAD 機率
+    實際呼叫 Gemini，回傳 (候選回應的文字, 解析後的 dict；無法解析時為 None)。
+    只有可以成功解析的回應才會寫入快取，避免把壞掉的輸出快取起來。
     """
-    score = 0
-
-    if getattr(data, "age", 0) >= 40:
-        score += 1
-
-    if getattr(data, "gender", "Female") == "Male":
-        score += 1
-
-    if getattr(data, "hypertension", 0) == 1:
-        score += 2
-
-    if getattr(data, "family_heart_disease", 0) == 1:
-        score += 2
-
-    if getattr(data, "bmi", 0) >= 30:
-        score += 1
-
-    if getattr(data, "cholesterol", 0) >= 240:
-        score += 2
-
-    if getattr(data, "smoke", 0) == 1:
-        score += 2
-
-    if getattr(data, "alcohol", 0) == 1:
-        score += 1
-
-    if getattr(data, "active", 1) == 0:
-        score += 1
-
-    stress = getattr(data, "stress_level", 0)
-    if stress == 2:
-        score += 1
-
-    diet = getattr(data, "high_fat_diet", 0)
-    if diet == 2:
-        score += 1
-
-    symptoms = getattr(data, "symptoms", [])
-    if any(sym in symptoms for sym in ["chest_discomfort", "shortness_of_breath", "chest_tightness"]):
-        score += 2
-
-    if score == 0:
-        probability = 5.0
-    elif score <= 4:
-        probability = 25.0
-    elif score <= 8:
-        probability = 45.0
-    elif score <= 12:
-        probability = 60.0
-    else:
-        probability = 70.0
-
-    return {"name": "Coronary Artery Disease (heart artery block)", "probability": probability}
-
-# https://www.tsmh.org.tw/sites/nursing_department/int_13.html
-# https://wd.vghtpe.gov.tw/cvs/Fpage.action?muid=11018&fid=10428
-
-
-    
-def calculate_disease_probabilities(data):
-    cardio_prob = predict_cardio_probability(data)
-    stroke_prob = predict_stroke_probability(data)
-
-    # Rule-based probabilities
-    htn = rule_hypertension(data)
-    hpl = rule_hyperlipidemia(data)
-    # ath = rule_atherosclerosis(data)
-    cad = rule_cad(data)
-    arr = rule_arrhythmia_by_symptoms(data)
-
-    # 1) 用給 LLM 的 probabilities（可以包含全部）
-    probabilities = [
-        {"name": "Cardiovascular Disease (heart/vessel issues)", "probability": cardio_prob},
-        {"name": "Stroke (brain blood loss)", "probability": stroke_prob},
-        htn,
-        hpl,
-        # ath,
-        cad,
-        arr
-    ]
-
-    # 2) rule_report 只放 rule 的部分（你也可以放全部）
-    rule_report = {
-        "possible_diseases": [htn, hpl, arr, cad]
-    }
-    frontend_probabilities = [d for d in probabilities if d["probability"] >= 30]
-
-    
+    log.debug("gemini_call", kind="generate")
+    start = time.perf_counter()
+    with span("gemini.generate") as s:
+        try:
+            result = await gemini_client.generate_content(payload) # 非 2xx（重試用盡後）會丟出 HTTPStatusError
+        finally:
+            GEMINI_SECONDS.observe(time.perf_counter() - start, "generate")
+        usage = result.get("usageMetadata") or {}
+        s.set("prompt_tokens", usage.get("promptTokenCount", 0))
+        s.set("candidates_tokens", usage.get("candidatesTokenCount", 0))
+    GEMINI_PROMPT_TOKENS.inc(usage.get("promptTokenCount", 0))
+    GEMINI_CANDIDATE_TOKENS.inc(usage.get("candidatesTokenCount", 0))
+
+    # 解析 Gemini 響應：取得第一個候選回應的 parts[0].text
+    # 1. 如果 AI 報錯，回傳的 JSON 可能沒有 content。
+    # 2. 如果連線不穩，parts 可能是一個空的清單。
+    candidate = (result.get('candidates') or [{}])[0]
+    text = (candidate.get('content', {}).get('parts') or [{}])[0].get('text', '').strip()
+    GEMINI_RESPONSE_BYTES.inc(len(text.encode("utf-8")), "generate")
 
-    return probabilities, frontend_probabilities, rule_report
+    try:
+        report = parse_llm_report(text)
+    except ValueError:
+        return text, None # 呼叫者（generate_llm_json）丟出 ValueError，由各端點決定怎麼處理
+    await llm_cache.set(key, text)
+    return text, report
 
-# --- 5.  LLM 交互邏輯（使用 Gemini API）---
-async def call_LLM_for_Prediction(
+async def stream_llm_json(payload: Dict[str, Any]):
+    """
+    串流版 generate_llm_json：一邊收 Gemini 的 token，一邊 yield
+    ("summary", {...}) / ("recommendation", {...})，最後 yield ("report", dict 或 None)。
+    None 代表完整輸出無法解析成 JSON。
+    """
+    parser = PartialReportParser()
+    key = prompt_key(GEMINI_MODEL, payload)
+    cached = await llm_cache.get(key)
+    if cached is None and llm_singleflight.in_flight(key):
+        # 相同 prompt 已經有一般 /predict 在等 Gemini → 直接共用它的結果
+        cached, _ = await llm_singleflight.do(key, None)
+    if cached is not None:
+        for event in parser.feed(cached):
+            yield event
+        try:
+            yield ("report", parse_llm_report(cached))
+        except ValueError as e:
+            log.warning("llm_json_parse_failed", error=str(e))
+            yield ("report", None)
+        return
+
+    log.debug("gemini_call", kind="stream")
+    start = time.perf_counter()
+    try:
+        async with gemini_client.stream_generate_content(payload) as response:
+            async for chunk in iter_gemini_stream_text(response):
+                for event in parser.feed(chunk):
+                    yield event
+    finally:
+        GEMINI_SECONDS.observe(time.perf_counter() - start, "stream")
+
+    text = parser.text.strip()
+    GEMINI_RESPONSE_BYTES.inc(len(text.encode("utf-8")), "stream")
+    try:
+        report_data = parse_llm_report(text)
+    except ValueError as e:
+        log.warning("llm_json_parse_failed", error=str(e))
+        yield ("report", None)
+        return
+    await llm_cache.set(key, text)
+    yield ("report", report_data)
+
+def build_prediction_payload(
     data: PredictionInput,
     probabilities: List[dict],
     low_risk_diseases: List[str]
-) -> Dict[str, Any]: # data 必須要符合 PredictionInput 的 3 個格式, 回傳一個 Dict[str, Any] key 是字串, value 可以是任何型別
+) -> Dict[str, Any]:
+    """組出 /predict 用的 Gemini payload（一般與串流模式共用，快取 key 也因此相同）"""
 
     # user_text = f"{data.gender} {data.medical_history}"
     # # 如果是英文，先翻中文
@@ -461,86 +546,53 @@ async def call_LLM_for_Prediction(
             "temperature": 0.1, # 降低溫度以增加輸出的穩定性
         }
     } 
+    return payload
 
-    try: 
-        # 確保 URL 協議和路徑完整
-        full_url = f"{GEMINI_API_BASE}{GEMINI_API_PATH}?key={GEMINI_API_KEY}"
+def prediction_fallback_report(probabilities: List[dict], low_risk_diseases: List[str]) -> Dict[str, Any]:
+    # LLM 沒有可用的結果時，用計算好的機率組出相同格式的報告（report_templates.py）
+    return template_prediction_report(probabilities, low_risk_diseases)
 
-        print("DEBUG: Calling Gemini API...")
-        response = await http_client.post(
-            full_url, 
-            json=payload # 將 payload（dict）轉換為 JSON 格式發送
-        )
-        response.raise_for_status() # 檢查HTTP 狀態碼
-
-        result = response.json() # 轉換成 python dict(API 回應為 JSON 格式)
-
-        # 解析 Gemini 響應並清理
-        candidate = result.get('candidates', [{}])[0] # 取得第一個候選回應
-        # 如果有 content 就抓 沒有就預設為 Json 字串'{}' 
-        # 以此類推
-        # 取出 parts 裡面的 text 如果沒有就預設為 Json 字串'{}' 並去除前後空白
-        json_string_raw = candidate.get('content', {}).get('parts', [{}])[0].get('text', '{}').strip() 
-        # 1. 如果 AI 報錯，回傳的 JSON 可能沒有 content。
-        # 2. 如果連線不穩，parts 可能是一個空的清單。
-
-        # 增強 JSON 字符串清理邏輯：提取第一個｛ 到最後一個 ｝之間的內容
-        # try:
-        #     start_index = json_string_raw.find("{") # find 從頭找到尾
-        #     end_index = json_string_raw.rfind("}") # reversefind 從尾巴找到頭 
-        #     # 找不到會回傳 -1
-        #     if start_index != -1 and end_index != -1 and end_index > start_index: # end 要大於 start 因為他位置在後面
-        #         json_string = json_string_raw[start_index : end_index + 1]
-        #     else: 
-        #         json_string = json_string_raw
-            
-        #     report_data = json.loads(json_string) # 將清理後的 JSON 字符串解析為 Python 字典
-
-        # except (ValueError, json.JSONDecodeError) as e:
-        #     print(f"ERROR:JSON 清理或解析失敗。原始錯: {e}")
-        #     raise json.JSONDecodeError("無法從 LLM 輸出中解析純淨的 JSON 物件。", json_string_raw, 0) # 0 是錯誤位置 主要看 174 行有沒有找到 沒找到代表一開始就出錯 位置 0
-
-        # 修改後的 JSON 處理邏輯
-        try:
-            start_index = json_string_raw.find("{")
-            end_index = json_string_raw.rfind("}")
-            if start_index != -1 and end_index != -1:
-                json_string = json_string_raw[start_index : end_index + 1]
-                
-                # 關鍵：處理 LLM 可能回傳的非法轉義字元
-                import re
-                json_string = re.sub(r'[\x00-\x1F\x7F]', '', json_string) 
+def finalize_prediction_report(report_data: Dict[str, Any], probabilities: List[dict]) -> Dict[str, Any]:
+    # 驗證 'risk_level'
+    # if report_data.get("risk_level") not in ["high", "medium", "low", "High", "Medium", "Low"]:
+    #     raise ValueError(f"LLM returned invalid or missing risk_level ('{report_data.get('risk_level')}').")
 
-                report_data = json.loads(json_string)
+    report_data["possible_diseases"] = probabilities
 
-            else:
-                raise ValueError("LLM returned content does not contain JSON format")
+    # 防呆：如果 LLM 沒回 summary / recommendations，就補預設
+    if not isinstance(report_data.get("summary"), str):
+        report_data["summary"] = "Analysis could not be generated, please try again."
 
-        except Exception as e:
-            print(f"JSON parsing failed: {e}")
-            # 給予預設值防止報錯
-            report_data = {
-            "possible_diseases": probabilities,
-            "summary": "Analysis could not be generated, please try again.",
-            "recommendations": ["Please consult a professional healthcare provider."]
-            }
-
-        # 驗證 'risk_level'
-        # if report_data.get("risk_level") not in ["high", "medium", "low", "High", "Medium", "Low"]:
-        #     raise ValueError(f"LLM returned invalid or missing risk_level ('{report_data.get('risk_level')}').")
-        
-        # possible = report_data.get("possible_diseases")
-        
-        report_data["possible_diseases"] = probabilities
+    if not isinstance(report_data.get("recommendations"), list):
+        report_data["recommendations"] = ["Please consult a professional healthcare provider."]
+
+    return report_data
+
+def low_risk_disease_names(probabilities: List[dict]) -> List[str]:
+    return [
+        d["name"]
+        for d in probabilities
+        if 20 <= d.get("probability", 0) < 30
+    ]
+
+async def call_LLM_for_Prediction(
+    data: PredictionInput,
+    probabilities: List[dict],
+    low_risk_diseases: List[str]
+) -> Dict[str, Any]: # data 必須要符合 PredictionInput 的 3 個格式, 回傳一個 Dict[str, Any] key 是字串, value 可以是任何型別
 
-        # 防呆：如果 LLM 沒回 summary / recommendations，就補預設
-        if not isinstance(report_data.get("summary"), str):
-            report_data["summary"] = "Analysis could not be generated, please try again."
+    payload = build_prediction_payload(data, probabilities, low_risk_diseases)
 
-        if not isinstance(report_data.get("recommendations"), list):
-            report_data["recommendations"] = ["Please consult a professional healthcare provider."]
+    try: 
+        # 修改後的 JSON 處理邏輯（清理與解析在 parse_llm_json）
+        try:
+            report_data = await generate_llm_json(payload)
+
+        except ValueError as e:
+            log.warning("llm_json_parse_failed", error=str(e))
+            report_data = prediction_fallback_report(probabilities, low_risk_diseases)
 
-        return report_data
+        return finalize_prediction_report(report_data, probabilities)
 
 
         # user_wants_english = is_english(f"{data.gender} {data.medical_history}")
@@ -550,94 +602,201 @@ async def call_LLM_for_Prediction(
 
     except httpx.HTTPStatusError as e:
         error_details = e.response.text  # Get error response as text
-        print(f"ERROR: Gemini API error, status code {e.response.status_code}: {error_details}")
+        log.error("gemini_http_error", status=e.response.status_code, detail=error_details)
         raise HTTPException(status_code=500, detail=f"LLM analysis service error (HTTP {e.response.status_code}). Please check your GEMINI_API_KEY or service availability.")
+    except CircuitOpenError as e:
+        log.warning("gemini_circuit_open", error=str(e))
+        raise HTTPException(status_code=503, detail="LLM analysis service is temporarily unavailable. Please retry later.")
     except json.JSONDecodeError as e:
-        print(f"ERROR: {e}")
+        log.error("llm_json_decode_error", error=str(e))
         raise HTTPException(status_code=500, detail=f"LLM report format error, cannot parse JSON. Please retry. Details: {str(e)[:50]}...")
     except Exception as e:
-        print(f"ERROR: Unexpected error occurred when calling Gemini API: {e}")
+        log.error("gemini_unexpected_error", error=repr(e))
         raise HTTPException(status_code=500, detail="Unexpected error occurred in LLM analysis service.")
 
-async def call_LLM_for_OverallInsight(diseases: List[dict]) -> Dict[str, Any]:
-
-    system_prompt = """
-    You are a creative and expert health educator. 
-
-    Task:
-    - Explain health risks by combining deep medical mechanisms with vivid, simple metaphors.
-    - Avoid dry, boring medical terms alone. Use analogies (like plumbing, engines, or city traffic).
-    - Keep it interesting but scientifically accurate.
-
-    For each disease, provide:
-    1. "cause": Use a metaphor to explain the biological mechanism. (e.g., Hypertension is like "water pipes under too much pressure").
-    2. "importance": Explain what happens to organs using an interesting scenario. (e.g., "The kidneys are like delicate filters being blasted by a power washer").
-
-    Output MUST be valid JSON ONLY.
-
-    JSON format:
-    {
-    "diseases": [
-        {
-        "name": "Disease name",
-        "cause": "Vivid metaphor + biological reason",
-        "importance": "Vivid scenario of what happens if ignored"
-        }
-    ],
-    "general_note": "A supportive and witty closing remark"
-    }
+# ======================================================
+# /predict 的 LLM latency budget 與回填
+# ======================================================
+# budget > 0 時最多等 Gemini budget 秒：逾時或 Gemini 失敗就回傳範本報告（report_templates.py），
+# 格式與 LLM 報告相同，前端不必區分（response header X-Report-Source 標示來源）。
+# 逾時的 Gemini 呼叫不會取消：結果會寫入 LLM 快取，PREDICT_LLM_BACKFILL=1 時也會在
+# 報告寫入資料庫後，用 write-behind 回傳的 id 把 llm_report 更新成 LLM 的版本。
+backfills = set() # 進行中的回填 task（保留參考，避免被 GC；關閉時取消）
+
+def resolve_llm_budget(requested: Optional[float]) -> float:
+    # 請求只能在 [MIN, MAX] 之間選 budget；0 = 一直等 Gemini 只能由 PREDICT_LLM_BUDGET 設定
+    if requested is None or requested <= 0:
+        return PREDICT_LLM_BUDGET
+    return min(max(requested, PREDICT_LLM_BUDGET_MIN), PREDICT_LLM_BUDGET_MAX)
+
+def _discard_llm_result(task: asyncio.Task):
+    # 沒有人再 await 的 LLM task：取出例外，避免 "exception was never retrieved" 警告
+    if not task.cancelled():
+        task.exception()
+
+async def call_LLM_within_budget(
+    data: PredictionInput,
+    probabilities: List[dict],
+    low_risk_diseases: List[str],
+    budget: float
+):
     """
-
-    user_query = f"""
-    Diseases observed across selected reports:
-    {json.dumps(diseases, indent=2)}
+    回傳 (report, source, pending)：source 為 "llm" / "deadline" / "error"，
+    pending 是逾時後仍在進行中的 LLM task（其他情況為 None）。budget <= 0 時與原本相同，一直等 Gemini。
     """
+    if budget <= 0:
+        return await call_LLM_for_Prediction(data, probabilities, low_risk_diseases), "llm", None
 
-    payload = {
-        "contents": [{ "parts": [{"text": user_query}]}],
-        "systemInstruction": { "parts": [{"text": system_prompt}] },
-        "generationConfig": { "temperature": 0.2 }
-    }
-
-    full_url = f"{GEMINI_API_BASE}{GEMINI_API_PATH}?key={GEMINI_API_KEY}"
-    response = await http_client.post(full_url, json=payload)
-    response.raise_for_status()
-
-    result = response.json()
-    text = result["candidates"][0]["content"]["parts"][0]["text"]
+    task = asyncio.ensure_future(call_LLM_for_Prediction(data, probabilities, low_risk_diseases))
+    task.add_done_callback(_discard_llm_result)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), budget), "llm", None
+    except asyncio.TimeoutError:
+        log.info("llm_deadline_exceeded", budget=budget)
+        source, pending = "deadline", task
+    except HTTPException as e:
+        log.warning("llm_report_fallback", status=e.status_code, detail=e.detail)
+        source, pending = "error", None
+    report = finalize_prediction_report(prediction_fallback_report(probabilities, low_risk_diseases), probabilities)
+    return report, source, pending
+
+def schedule_llm_backfill(pending: asyncio.Task, saved: asyncio.Future, user_id: str, frontend_probabilities: List[dict]):
+    if not PREDICT_LLM_BACKFILL:
+        return
+    task = asyncio.create_task(backfill_llm_report(pending, saved, user_id, frontend_probabilities))
+    backfills.add(task)
+    task.add_done_callback(backfills.discard)
+
+async def backfill_llm_report(pending: asyncio.Task, saved: asyncio.Future, user_id: str, frontend_probabilities: List[dict]):
+    try:
+        llm_report_data = await pending
+    except Exception as e:
+        LLM_BACKFILL.inc(1, "skipped")
+        log.info("llm_backfill_skipped", reason="llm_failed", error=repr(e))
+        return
+    report_id = await saved
+    if report_id is None:
+        # 沒有寫進資料庫（已 spill 到本機檔案），沒有 id 可以更新
+        LLM_BACKFILL.inc(1, "skipped")
+        log.warning("llm_backfill_skipped", reason="report_not_saved")
+        return
+    llm_report_data["possible_diseases"] = frontend_probabilities
+    try:
+        await run_io(update_report_row, "risk_reports", report_id, user_id, {"llm_report": llm_report_data})
+    except Exception as e:
+        LLM_BACKFILL.inc(1, "failed")
+        log.error("llm_backfill_failed", report_id=report_id, error=repr(e))
+        return
+    LLM_BACKFILL.inc(1, "ok")
+    log.info("llm_backfilled", report_id=report_id)
 
-    start = text.find("{")
-    end = text.rfind("}")
-    return json.loads(text[start:end+1])
+async def call_LLM_for_OverallNote(diseases: List[dict]) -> str:
+    """
+    /overall-insight 只有 general_note 需要 LLM：prompt 只有疾病名稱與風險等級（disease_library.note_payload），
+    通常會命中 LLM 快取。OVERALL_NOTE_MODE=template 或 Gemini 失敗時改用範本，不讓整個請求失敗。
+    """
+    if OVERALL_NOTE_MODE == "template":
+        return template_note(diseases)
+    try:
+        note = (await generate_llm_json(note_payload(diseases))).get("general_note")
+    except Exception as e:
+        log.warning("overall_note_fallback", error=repr(e))
+        note = None
+    return note if isinstance(note, str) and note.strip() else template_note(diseases)
 
 # --- 6. API Routing ---
+# 其他物件本身已經在計數的值，/metrics 被讀取時才取值
+metrics.Gauge("report_queue_depth", "Rows waiting in the write-behind queue.", fn=lambda: report_writer.depth)
+metrics.Counter("report_insert_calls_total", "Supabase insert attempts.", fn=lambda: report_writer.insert_calls)
+metrics.Counter("report_spilled_rows_total", "Rows spilled to the local file.", fn=lambda: report_writer.spilled_rows)
+metrics.Counter("report_dead_lettered_rows_total", "Rows the database rejected, moved to the dead-letter file.", fn=lambda: report_writer.dead_lettered_rows)
+metrics.Gauge("cpu_pool_pending", "Scoring jobs submitted to the CPU pool and not finished.", fn=cpu_pending)
+metrics.Gauge("gemini_in_flight", "Gemini calls holding a concurrency slot.", fn=lambda: gemini_client.in_flight)
+metrics.Gauge("gemini_waiting", "Gemini calls waiting for a concurrency slot.", fn=lambda: gemini_client.waiting)
+metrics.Counter("gemini_retries_total", "Gemini request retries.", fn=lambda: gemini_client.retries)
+metrics.Gauge(
+    "gemini_circuit_state", "Circuit breaker state (0=closed, 1=half_open, 2=open).",
+    fn=lambda: {"closed": 0, "half_open": 1, "open": 2}[gemini_client.breaker.state]
+)
+metrics.Counter("llm_cache_hits_total", "LLM cache hits (memory or SQLite).", fn=lambda: llm_cache.hits)
+metrics.Counter("llm_cache_disk_hits_total", "LLM cache hits served from SQLite.", fn=lambda: llm_cache.disk_hits)
+metrics.Counter("llm_cache_misses_total", "LLM cache misses.", fn=lambda: llm_cache.misses)
+metrics.Gauge("llm_cache_entries", "Entries in the in-memory LLM cache.", fn=lambda: llm_cache.stats()["entries"])
+metrics.Counter("llm_singleflight_leaders_total", "Gemini calls made by single-flight leaders.", fn=lambda: llm_singleflight.leaders)
+metrics.Counter("llm_singleflight_shared_total", "Callers that shared an in-flight Gemini call.", fn=lambda: llm_singleflight.shared)
+metrics.Counter("auth_token_cache_hits_total", "Requests authenticated from the verified-token cache.", fn=lambda: token_cache.hits)
+metrics.Counter("auth_token_cache_misses_total", "Requests that needed a full JWT verification.", fn=lambda: token_cache.misses)
+metrics.Gauge("auth_token_cache_entries", "Verified tokens currently cached.", fn=lambda: len(token_cache))
+metrics.Counter("disease_library_hits_total", "Overall-insight diseases explained from the local library.", fn=lambda: disease_library.hits)
+metrics.Counter("disease_library_misses_total", "Overall-insight diseases that needed a Gemini explanation.", fn=lambda: disease_library.misses)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+async def get_admin_user(current_user: Dict[str, Any] = Depends(get_current_user)):
+    # 管理員 = ADMIN_USER_IDS 裡列出的 Supabase user id（JWT sub）
+    if current_user["id"] not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Admin only")
+    return current_user
+
+class ProfilingConfig(BaseModel):
+    sample_every: int  # 每 N 個請求 profile 一個，0 = 暫停
+
+@app.get("/admin/profiling")
+async def get_profiling(admin: Dict[str, Any] = Depends(get_admin_user)):
+    if profiler is None:
+        return {"enabled": False}
+    return {"enabled": True, **profiler.status()}
+
+@app.put("/admin/profiling")
+async def set_profiling(config: ProfilingConfig, admin: Dict[str, Any] = Depends(get_admin_user)):
+    if profiler is None:
+        raise HTTPException(status_code=409, detail="Profiling is disabled. Start the server with PROFILING=1.")
+    if config.sample_every < 0:
+        raise HTTPException(status_code=422, detail="sample_every must be >= 0")
+    profiler.sample_every = config.sample_every
+    log.info("profiling_updated", sample_every=config.sample_every, admin_id=admin["id"])
+    return {"enabled": True, **profiler.status()}
+
+@app.get("/healthz")
+async def healthz():
+    # 不做任何 IO：回應時間 ≈ event loop 排程延遲，壓測時用來量 loop lag（loadtest.py）
+    if not ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ok", "report_queue": report_writer.depth}
+
 @app.post("/predict", response_model=RiskReport)
 async def predict_risk(
     data: PredictionInput,
+    response: Response,
+    x_llm_budget: Optional[float] = Header(None), # 這個請求願意等 Gemini 幾秒（預設 PREDICT_LLM_BUDGET）
     current_user: Dict[str, Any] = Depends(get_current_user)  # Dependency injection
 ):
     """
     Receive user input, get risk prediction from LLM, 
     and save the result to Supabase.
+    With a latency budget, a templated report is returned when the LLM is too slow or fails.
     """
 
     user_id = current_user.get("id")
 
     # ① 先用 dataset / rule / ML 算機率
-    probabilities, frontend_probabilities ,rule_report = calculate_disease_probabilities(data)
-
-    low_risk_diseases = [
-        d["name"]
-        for d in probabilities
-        if 20 <= d.get("probability", 0) < 30
-    ]
-
-    # ② 再交給 LLM 解釋
-    llm_report_data = await call_LLM_for_Prediction(
-        data=data,
-        probabilities=probabilities,
-        low_risk_diseases=low_risk_diseases
-    )
+    with stage("/predict", "scoring"):
+        probabilities, frontend_probabilities ,rule_report = await run_cpu(score_record, data.model_dump())
+
+    low_risk_diseases = low_risk_disease_names(probabilities)
+
+    # ② 再交給 LLM 解釋（有 budget 時逾時或失敗改用範本報告）
+    with stage("/predict", "llm"):
+        llm_report_data, report_source, pending_llm = await call_LLM_within_budget(
+            data=data,
+            probabilities=probabilities,
+            low_risk_diseases=low_risk_diseases,
+            budget=resolve_llm_budget(x_llm_budget)
+        )
+    PREDICT_REPORT_SOURCE.inc(1, report_source)
+    response.headers["X-Report-Source"] = "llm" if report_source == "llm" else "template"
 
     llm_report_data["possible_diseases"] = frontend_probabilities
     
@@ -655,27 +814,168 @@ async def predict_risk(
         "rule_report": rule_report
     }
         
-    try:
-        # Insert data using Supabase service account
-        # Collection path could be /artifacts/{appId}/users/{userId}/{your_collection_name}
-        # Here simplified as direct insertion into 'risk_reports' table, relying on RLS for permissions
-        supabase.table("risk_reports").insert(storage_data).execute()
-        print("INFO: Report data successfully saved to Supabase.")
+    # Insert data using Supabase service account
+    # Here simplified as direct insertion into 'risk_reports' table, relying on RLS for permissions
+    # 不等資料庫：交給 write-behind 佇列批次寫入（失敗會重試 / spill 到本機檔案）
+    # 實際 insert 的時間在 report_insert_duration_seconds
+    with stage("/predict", "enqueue"):
+        saved = report_writer.enqueue("risk_reports", storage_data)
 
-    except Exception as e:
-        print(f"WARNING: Failed to save data to Supabase: {e}. Please check if 'risk_reports' table exists and RLS rules.")
+    # Gemini 還在產生：之後用存檔的 id 把 LLM 版本回填進去
+    if pending_llm is not None:
+        schedule_llm_backfill(pending_llm, saved, user_id, frontend_probabilities)
 
     # Return the LLM report
     return merged_report
 
+@app.post("/predict/stream")
+async def predict_risk_stream(
+    data: PredictionInput,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Server-Sent Events version of /predict.
+    Events: "scores" (ML + rule results, sent right away), "summary" deltas,
+    "recommendation" items, "llm_report" (final report), "done" (saved report id).
+    """
+    user_id = current_user.get("id")
+
+    probabilities, frontend_probabilities, rule_report = await run_cpu(score_record, data.model_dump())
+    payload = build_prediction_payload(data, probabilities, low_risk_disease_names(probabilities))
+
+    async def event_stream():
+        # ① ML / rule 結果先送出，不必等 LLM
+        yield sse_event("scores", {
+            "possible_diseases": frontend_probabilities,
+            "rule_report": rule_report
+        })
+
+        # ② LLM 邊產生邊送
+        report_data = None
+        try:
+            async for event, value in stream_llm_json(payload):
+                if event == "report":
+                    report_data = value
+                else:
+                    yield sse_event(event, value)
+        except httpx.HTTPStatusError as e:
+            log.error("gemini_http_error", status=e.response.status_code, detail=e.response.text, stream=True)
+            yield sse_event("error", {"detail": f"LLM analysis service error (HTTP {e.response.status_code})."})
+            return
+        except CircuitOpenError as e:
+            log.warning("gemini_circuit_open", error=str(e), stream=True)
+            yield sse_event("error", {"detail": "LLM analysis service is temporarily unavailable. Please retry later."})
+            return
+        except Exception as e:
+            log.error("gemini_unexpected_error", error=repr(e), stream=True)
+            yield sse_event("error", {"detail": "Unexpected error occurred in LLM analysis service."})
+            return
+
+        if report_data is None:
+            report_data = prediction_fallback_report(probabilities, low_risk_disease_names(probabilities))
+        llm_report_data = finalize_prediction_report(report_data, probabilities)
+        llm_report_data["possible_diseases"] = frontend_probabilities
+        yield sse_event("llm_report", llm_report_data)
+
+        # ③ 存檔後回傳 report id（佇列太慢就先回 null，資料仍會在背景寫入）
+        saved = report_writer.enqueue("risk_reports", {
+            "user_id": user_id,
+            "input_data": data.model_dump(),
+            "llm_report": llm_report_data,
+            "rule_report": rule_report
+        })
+        try:
+            report_id = await asyncio.wait_for(asyncio.shield(saved), STREAM_REPORT_ID_TIMEOUT)
+        except asyncio.TimeoutError:
+            report_id = None
+        yield sse_event("done", {"report_id": report_id})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/predict/batch")
+async def predict_risk_batch(
+    payload: BatchPredictionInput,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Population screening: score many records in one vectorized pass.
+    LLM narratives are only generated when include_llm is set (at most
+    MAX_BATCH_LLM_SIZE records); batch results are returned to the caller
+    and not saved to Supabase.
+    """
+    records = payload.records
+    if len(records) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large, at most {MAX_BATCH_SIZE} records per request.")
+    if payload.include_llm and len(records) > MAX_BATCH_LLM_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large for include_llm, at most {MAX_BATCH_LLM_SIZE} records per request."
+        )
+
+    scored = await run_cpu(score_records, [data.model_dump() for data in records])
+
+    results = []
+    for index, (probabilities, frontend_probabilities, rule_report) in enumerate(scored):
+        results.append({
+            "index": index,
+            "probabilities": probabilities,
+            "possible_diseases": frontend_probabilities,
+            "rule_report": rule_report
+        })
+
+    if payload.include_llm:
+        llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+        async def batch_llm_report(data, probabilities):
+            async with llm_slots:
+                return await call_LLM_for_Prediction(
+                    data=data,
+                    probabilities=probabilities,
+                    low_risk_diseases=low_risk_disease_names(probabilities)
+                )
+
+        llm_reports = await asyncio.gather(*[
+            batch_llm_report(data, probabilities)
+            for data, (probabilities, _, _) in zip(records, scored)
+        ], return_exceptions=True)
+
+        for result, (_, frontend_probabilities, _), llm_report in zip(results, scored, llm_reports):
+            if isinstance(llm_report, Exception):
+                log.warning("batch_llm_report_failed", index=result["index"], error=str(llm_report))
+                result["llm_report"] = None
+                continue
+            llm_report["possible_diseases"] = frontend_probabilities
+            result["llm_report"] = llm_report
+
+    return {"count": len(results), "results": results}
+
 @app.post("/overall-insight")
 async def get_overall_insight(
-    # 直接接收 List[dict]，不要再用 payload: OverallInsightInput
-    diseases_input: List[dict] = Body(...), 
+    # {"start_date": ..., "end_date": ...}：伺服器依日期區間查詢並彙總（report_history.py）
+    # List[dict]：舊版前端自己彙總好的疾病清單，仍然接受
+    payload: Union[OverallInsightInput, List[dict]] = Body(...), 
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     user_id = current_user["id"]
-    print(f"DEBUG: Received diseases from frontend: {diseases_input}") # 偵錯用
+    if isinstance(payload, OverallInsightInput):
+        try:
+            start, end = parse_range(payload.start_date, payload.end_date)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Invalid date range: {e}")
+        try:
+            with stage("/overall-insight", "aggregate"):
+                diseases_input = await run_io(aggregate_diseases, supabase, user_id, start, end)
+        except Exception as e:
+            log.error("overall_insight_query_failed", error=repr(e))
+            raise HTTPException(status_code=503, detail="Report history is temporarily unavailable. Please retry later.")
+        log.debug("overall_insight_aggregated", start=start, end=end, diseases=diseases_input)
+    else:
+        diseases_input = payload
+        log.debug("overall_insight_received", diseases=diseases_input) # 偵錯用
 
     # 1. 確保有收到疾病資料
     if not diseases_input:
@@ -699,28 +999,95 @@ async def get_overall_insight(
         }
 
     try:
-        # 3. 呼叫 LLM 進行分析 (這會回傳包含 cause 和 importance 的 JSON)
-        overall_report = await call_LLM_for_OverallInsight(valid_diseases)
+        # 3. cause 和 importance 從疾病解說庫組出來（庫裡沒有的疾病才呼叫 Gemini），LLM 只寫 general_note
+        with stage("/overall-insight", "library"):
+            explained = await disease_library.explain(valid_diseases, generate_llm_json, run_io)
+        with stage("/overall-insight", "llm"):
+            general_note = await call_LLM_for_OverallNote(valid_diseases)
+        overall_report = {
+            "diseases": explained,
+            "general_note": general_note,
+            "library_version": disease_library.version
+        }
 
         # 4. 存入 Supabase (可選，但建議先註解掉這段測試，確認 LLM 沒問題再開)
    
-        try:
-            supabase.table("overall_reports").insert({
+        with stage("/overall-insight", "enqueue"):
+            report_writer.enqueue("overall_reports", {
                 "user_id": user_id,
                 "diseases": overall_report.get("diseases"),
                 "general_note": overall_report.get("general_note")
-            }).execute()
-            print("INFO: Overall insight report successfully saved to Supabase.")
-        except Exception as se:
-            print(f"WARNING: Failed to save overall report to Supabase: {se}")
+            })
       
 
         return overall_report
 
+    except CircuitOpenError as e:
+        log.warning("gemini_circuit_open", error=str(e))
+        raise HTTPException(status_code=503, detail="AI Analysis is temporarily unavailable. Please retry later.")
     except Exception as e:
-        print(f"ERROR: LLM Analysis failed: {str(e)}")
+        log.error("overall_insight_failed", error=str(e))
         # 回傳 500 錯誤給前端，並顯示具體原因
         raise HTTPException(status_code=500, detail=f"AI Analysis Error: {str(e)}")
+
+@app.get("/reports")
+async def list_reports(
+    request: Request,
+    fields: str = "summary", # summary：分數與基本資料；full：整份報告（含 LLM 摘要與建議）
+    limit: int = Query(REPORTS_PAGE_DEFAULT, ge=1, le=REPORTS_PAGE_MAX),
+    cursor: Optional[str] = None, # 上一頁回傳的 next_cursor
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    使用者的歷史報告，由新到舊，keyset 分頁（report_history.py）。
+    回應帶 ETag；If-None-Match 相同時回 304，不再傳一次內容。
+    """
+    if fields not in REPORT_PROJECTIONS:
+        raise HTTPException(status_code=422, detail=f"fields must be one of: {', '.join(REPORT_PROJECTIONS)}")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    try:
+        with stage("/reports", "query"):
+            page = await run_io(list_reports_page, supabase, current_user["id"], fields, limit, after)
+    except Exception as e:
+        log.error("reports_query_failed", error=repr(e))
+        raise HTTPException(status_code=503, detail="Report history is temporarily unavailable. Please retry later.")
+
+    body = json.dumps(page, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    # private：內容因使用者而異，不可被共用快取保存；no-cache：每次都要帶 If-None-Match 回來確認
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in if_none_match.split(","))):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/reports/{report_id}")
+async def read_report(
+    report_id: str,
+    fields: str = "full",
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """單一報告；歷史頁展開卡片時才取 LLM 的摘要與建議"""
+    if fields not in REPORT_PROJECTIONS:
+        raise HTTPException(status_code=422, detail=f"fields must be one of: {', '.join(REPORT_PROJECTIONS)}")
+    try:
+        validate_report_id(report_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid report id")
+
+    try:
+        with stage("/reports/{report_id}", "query"):
+            report = await run_io(get_report, supabase, current_user["id"], report_id, fields)
+    except Exception as e:
+        log.error("report_query_failed", error=repr(e))
+        raise HTTPException(status_code=503, detail="Report history is temporarily unavailable. Please retry later.")
+    if report is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return JSONResponse(report, headers={"Cache-Control": "private, no-cache", "Vary": "Authorization"})
     
 # async def translate_to_chinese(text: str) -> str:
 #     translate_prompt = f"""
@@ -0,0 +1,211 @@
+import time
+from bisect import bisect_left
+
+from tracing import span
+
+# ==================================================
+# Prometheus 指標（GET /metrics，text exposition format 0.0.4）
+# ==================================================
+# 只實作需要的 Counter / Gauge / Histogram，不另外加套件。
+# 所有更新都在 event loop thread 上進行（IO / CPU pool 裡不記錄），所以不需要鎖；
+# 一次 observe 只有一個 bisect 與幾個加法，滿載時也可以一直開著。
+# 已經在其他物件上計數的值（快取命中、重試次數、佇列深度…）用 fn= 在 scrape 時才讀取。
+#
+# 多個 uvicorn worker 時每個 process 各有一份，/metrics 回傳的是處理該請求的 worker。
+#
+# 常用查詢：
+#   LLM JSON 解析 fallback 比例：
+#     rate(llm_json_parse_total{result="fallback"}[5m]) / rate(llm_json_parse_total[5m])
+#   /predict 各階段 p95：
+#     histogram_quantile(0.95, sum by (stage, le) (rate(request_stage_duration_seconds_bucket{path="/predict"}[5m])))
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=(), fn=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn  # 無 label 的指標可以在 scrape 時才呼叫 fn() 取值
+        self._values = {}
+        _registry.append(self)
+
+    def _samples(self):
+        if self.fn is not None:
+            return [((), self.fn())]
+        return list(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self._samples():
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, *labels):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, amount=1, *labels):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            # [各 bucket 的計數（非累計）..., +Inf 的計數, sum]
+            state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, state in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = _label_text(self.labelnames, labels, f'le="{_number(float(bound))}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            label_text = _label_text(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- 指標定義 ----------
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "End-to-end request latency by route and status.", ("path", "status")
+)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled.")
+STAGE_SECONDS = Histogram(
+    "request_stage_duration_seconds", "Time spent in each stage of a request handler.", ("path", "stage")
+)
+GEMINI_SECONDS = Histogram(
+    "gemini_request_duration_seconds", "Gemini call latency including retries.", ("kind",)
+)
+GEMINI_PROMPT_TOKENS = Counter("gemini_prompt_tokens_total", "Prompt tokens reported by Gemini usageMetadata.")
+GEMINI_CANDIDATE_TOKENS = Counter(
+    "gemini_candidates_tokens_total", "Response tokens reported by Gemini usageMetadata."
+)
+GEMINI_RESPONSE_BYTES = Counter(
+    "gemini_response_bytes_total", "UTF-8 bytes of Gemini response text.", ("kind",)
+)
+LLM_PARSE = Counter(
+    "llm_json_parse_total", "LLM outputs parsed as JSON (ok) or falling back (fallback).", ("result",)
+)
+LLM_PARSE_SECONDS = Histogram("llm_json_parse_duration_seconds", "Time spent extracting and parsing LLM JSON.")
+REPORT_INSERT_SECONDS = Histogram(
+    "report_insert_duration_seconds", "Supabase multi-row insert latency (successful attempts).", ("table",)
+)
+PREDICT_REPORT_SOURCE = Counter(
+    "predict_report_source_total", "/predict reports written by the LLM or from templates, by reason.", ("source",)
+)
+LLM_BACKFILL = Counter(
+    "llm_backfill_total", "Late LLM reports written back over a stored template report.", ("result",)
+)
+
+
+class stage:
+    """
+    with stage("/predict", "scoring"): ...  → 記錄到 request_stage_duration_seconds；
+    請求有被追蹤（tracing.py）時同時是一個 span
+    """
+
+    __slots__ = ("path", "name", "start", "span")
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+
+    def __enter__(self):
+        self.span = span(self.name).__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, self.path, self.name)
+        return self.span.__exit__(*exc)
+
+
+def route_path(scope):
+    # 用路由樣板（例如 /predict）當 label，避免 path 參數讓 label 數量無限增加
+    route = scope.get("route")
+    return getattr(route, "path", "other")
+
+
+class MetricsMiddleware:
+    """純 ASGI middleware：記錄 in-flight 數量與整個請求（含串流回應）的時間"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_SECONDS.observe(time.perf_counter() - start, route_path(scope), str(status))
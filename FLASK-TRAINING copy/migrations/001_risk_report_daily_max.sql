@@ -0,0 +1,65 @@
+-- ==================================================
+-- 每位使用者、每天、每個疾病的最高機率（/overall-insight 的增量彙總，選用）
+-- ==================================================
+-- OVERALL_AGGREGATE_SOURCE=daily 時，/overall-insight 改讀這張表：
+-- 一個日期區間最多 (天數 × 疾病數) 列，與使用者累積了多少份報告無關。
+-- 每次寫入 risk_reports 由 trigger 以 greatest() 更新，合併規則與前端 mergeReports /
+-- report_history.merge_diseases 相同：LLM 與規則結果以疾病名稱合併，取最高機率。
+-- 「天」以 UTC 計算。
+--
+-- 在 Supabase SQL editor 執行一次即可（可重複執行）；最後一段會回填既有的報告。
+
+create table if not exists public.risk_report_daily_max (
+    user_id uuid not null,
+    day date not null,
+    name text not null,
+    probability double precision not null,
+    primary key (user_id, day, name)
+);
+
+alter table public.risk_report_daily_max enable row level security;
+
+drop policy if exists "Users read their own daily max" on public.risk_report_daily_max;
+create policy "Users read their own daily max"
+    on public.risk_report_daily_max for select
+    using (auth.uid() = user_id);
+
+-- 一份報告的所有疾病（llm_report 與 rule_report 的 possible_diseases）
+create or replace function public.risk_report_diseases(llm_report jsonb, rule_report jsonb)
+returns table (name text, probability double precision)
+language sql immutable as $$
+    select d->>'name', (d->>'probability')::double precision
+    from jsonb_array_elements(
+        coalesce(llm_report->'possible_diseases', '[]'::jsonb)
+        || coalesce(rule_report->'possible_diseases', '[]'::jsonb)
+    ) as d
+    where d ? 'name' and jsonb_typeof(d->'probability') = 'number'
+$$;
+
+create or replace function public.risk_report_daily_max_upsert()
+returns trigger
+language plpgsql security definer set search_path = public as $$
+begin
+    insert into public.risk_report_daily_max (user_id, day, name, probability)
+    select new.user_id, (new.created_at at time zone 'utc')::date, d.name, max(d.probability)
+    from public.risk_report_diseases(new.llm_report::jsonb, new.rule_report::jsonb) as d
+    group by d.name
+    on conflict (user_id, day, name)
+    do update set probability = greatest(risk_report_daily_max.probability, excluded.probability);
+    return new;
+end
+$$;
+
+drop trigger if exists risk_reports_daily_max on public.risk_reports;
+create trigger risk_reports_daily_max
+    after insert on public.risk_reports
+    for each row execute function public.risk_report_daily_max_upsert();
+
+-- 回填既有的報告
+insert into public.risk_report_daily_max (user_id, day, name, probability)
+select r.user_id, (r.created_at at time zone 'utc')::date, d.name, max(d.probability)
+from public.risk_reports as r
+cross join lateral public.risk_report_diseases(r.llm_report::jsonb, r.rule_report::jsonb) as d
+group by r.user_id, (r.created_at at time zone 'utc')::date, d.name
+on conflict (user_id, day, name)
+do update set probability = greatest(risk_report_daily_max.probability, excluded.probability);
@@ -0,0 +1,20 @@
+-- ==================================================
+-- GET /reports 的 keyset 分頁 index
+-- ==================================================
+-- 查詢：where user_id = $1 [and (created_at, id) < ($2, $3)] order by created_at desc, id desc limit n + 1
+-- 有這個 index 時，任何一頁都是一次 index range scan 讀 n + 1 列，
+-- 與使用者有多少份報告、翻到第幾頁無關；沒有的話每頁都要掃過並排序該使用者的全部報告。
+-- id 放在最後，同一個 created_at 有多筆時順序也是固定的（cursor 才不會漏掉或重複）。
+-- 同一個 index 也涵蓋 /overall-insight（OVERALL_AGGREGATE_SOURCE=reports）的日期區間查詢。
+--
+-- concurrently 不會鎖住寫入，但不能在 transaction 裡執行：請單獨執行這一段。
+
+create index concurrently if not exists risk_reports_user_created_id_idx
+    on public.risk_reports (user_id, created_at desc, id desc);
+
+-- 確認查詢有用到 index（應該看到 Index Scan using risk_reports_user_created_id_idx，沒有 Sort）：
+-- explain analyze
+-- select id, created_at from public.risk_reports
+-- where user_id = '<user uuid>'
+-- order by created_at desc, id desc
+-- limit 21;
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+from logs import get_logger
+
+log = get_logger("model_registry")
+
+
+# ==================================================
+# 常駐模型登錄（Model Registry）
+# ==================================================
+# 每個 artifact 只在啟動時從硬碟 unpickle 一次，之後常駐記憶體。
+#
+# 熱替換以「一組」artifact 為單位：訓練程式把所有 artifact 寫完後，最後才寫 manifest
+#   {"version": "...", "artifacts": {"<path>": "<sha256>", ...}}
+# registry 只看 manifest：manifest 換了版本，就依 manifest 載入有變的 artifact 並確認 sha256，
+# 全部符合才一次性替換整份 snapshot（atomic swap）。任何一個檔案還沒寫完（sha256 不符）或載入失敗
+# 就保留舊 snapshot，下次檢查再試，不會出現新 model 配舊 scaler 的組合。
+# 沒有 manifest 時只在啟動時載入一次，不做熱替換。
+#
+# 檢查在背景 thread 進行（start_watcher），snapshot() 只回傳目前的 dict，request 永遠不會等待載入；
+# 已經拿到舊 snapshot 的 request 會繼續用舊模型算完。
+
+CHECK_INTERVAL_SECONDS = 2.0  # 背景 thread 每 2 秒 stat 一次 manifest
+
+
+def _joblib_load(path):
+    # joblib（連帶 numpy）只有 sklearn artifact 需要；compiled 模式的 serving process 不必 import
+    import joblib
+    return joblib.load(path)
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+class _Artifact:
+    """單一 artifact 的載入狀態（路徑、loader、目前版本與物件）"""
+
+    def __init__(self, name, path, loader):
+        self.name = name
+        self.path = path
+        self.loader = loader
+        self.digest = None  # sha256
+        self.obj = None
+
+
+class ModelRegistry:
+    def __init__(self, manifest_path=None, check_interval=CHECK_INTERVAL_SECONDS):
+        self.manifest_path = manifest_path
+        self.check_interval = check_interval
+        self.version = None      # 目前載入的 manifest 版本（沒有 manifest 時為 None）
+        self._artifacts = {}
+        self._snapshot = {}      # name -> 已載入物件（只整份替換，不原地修改）
+        self._versions = {}      # name -> sha256
+        self._manifest_stamp = None
+        self._deferred = None    # 上次延後替換的 manifest 版本（同一版本只警告一次）
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+    def register(self, name, path, loader=_joblib_load):
+        self._artifacts[name] = _Artifact(name, path, loader)
+
+    def load_all(self):
+        """啟動時呼叫：載入全部 artifact（FastAPI startup、CPU worker 暖機）"""
+        with self._reload_lock:
+            manifest = self._read_manifest()
+            if manifest is None:
+                log.info("model_manifest_missing", path=self.manifest_path, detail="hot reload disabled")
+                self._swap({name: self._load(art, None) for name, art in self._artifacts.items()}, None)
+                return
+            # 啟動時 artifact 與 manifest 不符（訓練寫到一半）也照樣載入，背景檢查會在 manifest 更新後替換
+            loaded = {}
+            for name, art in self._artifacts.items():
+                expected = manifest["artifacts"].get(art.path)
+                loaded[name] = self._load(art, None)
+                if expected is not None and loaded[name][1] != expected:
+                    log.warning("model_artifact_mismatch", path=art.path, manifest=manifest["version"])
+            self._swap(loaded, manifest["version"])
+
+    def snapshot(self):
+        """
+        回傳目前所有模型的 dict。
+        同一個 request 內請只拿一次 snapshot，確保 model / scaler 來自同一版本。
+        """
+        return self._snapshot
+
+    def get(self, name):
+        return self._snapshot[name]
+
+    def versions(self):
+        return dict(self._versions)
+
+    # --------------------------------------------------
+    # 背景檢查
+    # --------------------------------------------------
+    def start_watcher(self):
+        """啟動背景檢查 thread（重複呼叫無效）；沒有設定 manifest_path 時不啟動"""
+        if self.manifest_path is None or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def _watch(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                log.error("model_reload_check_failed", error=repr(e))
+
+    def check(self):
+        """manifest 有新版本時重新載入整組 artifact；回傳是否替換了 snapshot"""
+        with self._reload_lock:
+            try:
+                stamp = _file_stamp(self.manifest_path)
+            except FileNotFoundError:
+                return False
+            if stamp == self._manifest_stamp:
+                return False
+
+            manifest = self._read_manifest()
+            if manifest is None or manifest["version"] == self.version:
+                self._manifest_stamp = stamp
+                return False
+
+            loaded = {}
+            for name, art in self._artifacts.items():
+                expected = manifest["artifacts"].get(art.path, art.digest)
+                if expected == art.digest:
+                    loaded[name] = (art.obj, art.digest)
+                    continue
+                try:
+                    loaded[name] = self._load(art, expected)
+                except Exception as e:
+                    # 訓練程式可能還在寫檔；保留舊 snapshot，manifest stamp 不記下來，下次檢查再試
+                    if self._deferred != manifest["version"]:
+                        self._deferred = manifest["version"]
+                        log.warning("model_reload_deferred", manifest=manifest["version"], path=art.path,
+                                    error=str(e))
+                    return False
+
+            self._manifest_stamp = stamp
+            if all(loaded[name][1] == art.digest for name, art in self._artifacts.items()):
+                self.version = manifest["version"]  # 重新發佈了同樣的內容，snapshot 不必換
+                return False
+            self._swap(loaded, manifest["version"])
+            log.info("models_reloaded", manifest=self.version,
+                     versions={name: digest[:12] for name, digest in self._versions.items()})
+            return True
+
+    # --------------------------------------------------
+    # 載入 / 替換
+    # --------------------------------------------------
+    def _read_manifest(self):
+        if self.manifest_path is None:
+            return None
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        manifest.setdefault("artifacts", {})
+        return manifest
+
+    def _load(self, art, expected):
+        # 讀檔前後的 (mtime_ns, size) 相同，才能確定 digest 與載入的物件是同一個檔案
+        stamp = _file_stamp(art.path)
+        digest = _file_digest(art.path)
+        if expected is not None and digest != expected:
+            raise ValueError(f"sha256 {digest[:12]} does not match manifest {expected[:12]}")
+        obj = art.loader(art.path)
+        if _file_stamp(art.path) != stamp:
+            raise ValueError("file changed while loading")
+        return obj, digest
+
+    def _swap(self, loaded, version):
+        for name, (obj, digest) in loaded.items():
+            art = self._artifacts[name]
+            art.obj, art.digest = obj, digest
+        # 一次替換整份 snapshot
+        self._snapshot = {name: art.obj for name, art in self._artifacts.items()}
+        self._versions = {name: art.digest for name, art in self._artifacts.items()}
+        self.version = version
+
+
+def save_artifact(obj, path):
+    """先寫暫存檔再 os.replace，讓 registry 永遠不會讀到寫一半的 pickle"""
+    import joblib
+
+    tmp_path = f"{path}.tmp"
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_json_artifact(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json_artifact(obj, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def publish_manifest(manifest_path, paths):
+    """
+    所有 artifact 都寫完之後呼叫：記下 paths 中存在的檔案的 sha256，寫出新版本的 manifest。
+    每次都從硬碟重新計算整份清單（不合併舊 manifest），多個訓練程式先後發佈時以最後一次為準。
+    """
+    artifacts = {path: _file_digest(path) for path in paths if os.path.exists(path)}
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+    save_json_artifact({"version": version, "artifacts": artifacts}, manifest_path)
+    return version
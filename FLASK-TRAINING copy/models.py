@@ -1,8 +1,13 @@
-import pandas as pd
-import joblib
-import numpy as np
-from sklearn.linear_model import LogisticRegression
-from sklearn.preprocessing import StandardScaler
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from compiled_scorer import LinearScorer, export_linear_model
+from model_registry import ModelRegistry, save_artifact, load_json_artifact, save_json_artifact, publish_manifest
+from settings import SCORING_MODE, MODEL_VARIANT, TRAIN_CV_FOLDS, TRAIN_N_JOBS, TRAIN_REFIT_METRIC
+
+# pandas / sklearn 只在訓練或 SCORING_MODE="sklearn" 時才 import，
+# compiled 模式的 serving process 完全不需要載入它們
 
 # ==================================================
 # 共用設定
@@ -15,55 +20,259 @@ CARDIO_FEATURES = [
     "height", "weight"
 ]
 
+CARDIO_MODEL_PATH = "cardio_model.pkl"
+CARDIO_SCALER_PATH = "scaler.pkl"
+STROKE_MODEL_PATH = "stroke_model.pkl"
+
+# 匯出的係數（compiled scorer 使用）
+CARDIO_COMPILED_PATH = "cardio_compiled.json"
+STROKE_COMPILED_PATH = "stroke_compiled.json"
+
+# 訓練時產生的特徵統計 sidecar（中位數、補值、類別對照、特徵順序）
+CARDIO_STATS_PATH = "cardio_stats.json"
+STROKE_STATS_PATH = "stroke_stats.json"
+
+# 增量學習（online_learning.py，SGD + partial_fit）發佈的 artifact；MODEL_VARIANT="online" 時改用這組
+CARDIO_ONLINE_MODEL_PATH = "cardio_online_model.pkl"
+CARDIO_ONLINE_SCALER_PATH = "cardio_online_scaler.pkl"
+STROKE_ONLINE_MODEL_PATH = "stroke_online_model.pkl"  # Pipeline(scaler, SGD)，輸入為原始特徵
+CARDIO_ONLINE_COMPILED_PATH = "cardio_online_compiled.json"
+STROKE_ONLINE_COMPILED_PATH = "stroke_online_compiled.json"
+
+# 訓練報告：最佳參數、交叉驗證 AUC / Brier、校準、訓練時間
+CARDIO_METRICS_PATH = "cardio_metrics.json"
+STROKE_METRICS_PATH = "stroke_metrics.json"
+
+# serving 用 artifact 的版本清單（sha256）；全部 artifact 寫完後才更新，registry 依它整組熱替換
+MODEL_MANIFEST_PATH = "models_manifest.json"
+SERVING_ARTIFACT_PATHS = [
+    CARDIO_MODEL_PATH, CARDIO_SCALER_PATH, STROKE_MODEL_PATH,
+    CARDIO_COMPILED_PATH, STROKE_COMPILED_PATH,
+    CARDIO_STATS_PATH, STROKE_STATS_PATH,
+    CARDIO_ONLINE_MODEL_PATH, CARDIO_ONLINE_SCALER_PATH, STROKE_ONLINE_MODEL_PATH,
+    CARDIO_ONLINE_COMPILED_PATH, STROKE_ONLINE_COMPILED_PATH
+]
+
+# 兩個模型共用的 LogisticRegression 搜尋範圍（stroke.csv 陽性很少，所以也比較 class_weight）
+LOGISTIC_PARAM_GRID = {
+    "solver": ["lbfgs", "liblinear"],
+    "C": [0.01, 0.1, 1.0, 10.0],
+    "class_weight": [None, "balanced"]
+}
+
+STROKE_SMOKING_COLS = [
+    "smoking_status_never smoked",
+    "smoking_status_formerly smoked",
+    "smoking_status_smokes",
+    "smoking_status_N/A"
+]
+
+# 資料集的 gender 編碼（cardio.csv: 1=female, 2=male；stroke.csv 為字串）
+CARDIO_GENDER_CODES = {1: 0, 2: 1}
+STROKE_GENDER_MAP = {"Male": 0, "Female": 1, "Other": 2}
+
+STROKE_FEATURES = [
+    "age", "gender", "hypertension", "family_heart_disease",
+    "avg_glucose_level", "bmi"
+] + STROKE_SMOKING_COLS
+
+# process 內共用的模型登錄，serving 時不再每個 request 重新 joblib.load
+registry = ModelRegistry(MODEL_MANIFEST_PATH)
+_online = MODEL_VARIANT == "online"
+if SCORING_MODE == "sklearn":
+    registry.register("cardio_model", CARDIO_ONLINE_MODEL_PATH if _online else CARDIO_MODEL_PATH)
+    registry.register("cardio_scaler", CARDIO_ONLINE_SCALER_PATH if _online else CARDIO_SCALER_PATH)
+    registry.register("stroke_model", STROKE_ONLINE_MODEL_PATH if _online else STROKE_MODEL_PATH)
+else:
+    registry.register(
+        "cardio_compiled", CARDIO_ONLINE_COMPILED_PATH if _online else CARDIO_COMPILED_PATH,
+        loader=LinearScorer.load
+    )
+    registry.register(
+        "stroke_compiled", STROKE_ONLINE_COMPILED_PATH if _online else STROKE_COMPILED_PATH,
+        loader=LinearScorer.load
+    )
+registry.register("cardio_stats", CARDIO_STATS_PATH, loader=load_json_artifact)
+registry.register("stroke_stats", STROKE_STATS_PATH, loader=load_json_artifact)
+
 
 # ==================================================
-# Cardio Model
+# 訓練：k-fold 交叉驗證的參數搜尋 + 指標報告
 # ==================================================
-def train_cardio_model():
-    df = pd.read_csv("cardio.csv", sep=";")
+def search_logistic_model(X, y, max_iter, scale=False, n_jobs=TRAIN_N_JOBS):
+    """
+    GridSearchCV（StratifiedKFold）搜尋 solver / C / class_weight，所有 fold × 參數組合平行執行。
+    scale=True 時把 StandardScaler 放進 pipeline，每個 fold 各自 fit scaler，避免資料洩漏。
+    回傳 (最佳 pipeline, 指標報告 dict)。
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import GridSearchCV, StratifiedKFold, cross_val_predict
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    steps = [("scaler", StandardScaler())] if scale else []
+    steps.append(("model", LogisticRegression(max_iter=max_iter)))
+    cv = StratifiedKFold(n_splits=TRAIN_CV_FOLDS, shuffle=True, random_state=42)
+
+    search = GridSearchCV(
+        Pipeline(steps),
+        {f"model__{k}": v for k, v in LOGISTIC_PARAM_GRID.items()},
+        scoring={"roc_auc": "roc_auc", "neg_brier_score": "neg_brier_score", "neg_log_loss": "neg_log_loss"},
+        refit=TRAIN_REFIT_METRIC,
+        cv=cv,
+        n_jobs=n_jobs
+    )
+    start = time.perf_counter()
+    search.fit(X, y)
+    search_seconds = time.perf_counter() - start
+
+    # 最佳參數的 out-of-fold 預測，用來算整體 AUC 與校準
+    oof = cross_val_predict(search.best_estimator_, X, y, cv=cv, method="predict_proba", n_jobs=n_jobs)[:, 1]
+    return search.best_estimator_, training_report(search, y, oof, search_seconds)
+
+
+def training_report(search, y, oof, search_seconds, n_bins=10):
+    import numpy as np
+    from sklearn.metrics import brier_score_loss, roc_auc_score
+
+    results = search.cv_results_
+    best = search.best_index_
+    y = np.asarray(y)
+
+    bins = []
+    ece = 0.0
+    edges = np.linspace(0.0, 1.0, n_bins + 1)
+    index = np.clip(np.digitize(oof, edges[1:-1]), 0, n_bins - 1)
+    for b in range(n_bins):
+        mask = index == b
+        count = int(mask.sum())
+        if not count:
+            continue
+        mean_predicted = float(oof[mask].mean())
+        fraction_positive = float(y[mask].mean())
+        ece += count / len(y) * abs(mean_predicted - fraction_positive)
+        bins.append({
+            "range": [round(float(edges[b]), 2), round(float(edges[b + 1]), 2)],
+            "count": count,
+            "mean_predicted": round(mean_predicted, 4),
+            "fraction_positive": round(fraction_positive, 4)
+        })
+
+    return {
+        "trained_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "n_samples": int(len(y)),
+        "positive_rate": round(float(y.mean()), 4),
+        "best_params": {k.removeprefix("model__"): v for k, v in search.best_params_.items()},
+        "refit_metric": TRAIN_REFIT_METRIC,
+        "cv": {
+            "folds": TRAIN_CV_FOLDS,
+            "roc_auc": round(float(results["mean_test_roc_auc"][best]), 4),
+            "roc_auc_std": round(float(results["std_test_roc_auc"][best]), 4),
+            "brier": round(float(-results["mean_test_neg_brier_score"][best]), 4),
+            "log_loss": round(float(-results["mean_test_neg_log_loss"][best]), 4)
+        },
+        "out_of_fold": {
+            "roc_auc": round(float(roc_auc_score(y, oof)), 4),
+            "brier": round(float(brier_score_loss(y, oof)), 4),
+            "expected_calibration_error": round(float(ece), 4),
+            "calibration": bins
+        },
+        "timing": {
+            "candidates": len(results["params"]),
+            "fits": len(results["params"]) * TRAIN_CV_FOLDS,
+            "search_wall_seconds": round(search_seconds, 2),
+            "mean_fit_seconds": round(float(results["mean_fit_time"][best]), 4),
+            "refit_seconds": round(float(search.refit_time_), 4)
+        }
+    }
 
-    # cardio.csv 的 age 是「天數」
-    df["age_years"] = df["age"] / 365.25
 
-    # gender: 1=female, 2=male → 0/1
-    df["gender"] = df["gender"].map({1: 0, 2: 1})
+def train_all_models(parallel=True):
+    """兩個模型同時在各自的 process 訓練；每個搜尋內部再用 n_jobs 平行跑 fold × 參數"""
+    if not parallel:
+        train_cardio_model()
+        train_stroke_model()
+    else:
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(train_cardio_model), pool.submit(train_stroke_model)]
+            for future in futures:
+                future.result()
+    publish_models_manifest()
 
-    X = df[CARDIO_FEATURES]
-    y = df["cardio"]
 
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+def publish_models_manifest():
+    """兩個模型都寫完後才發佈 manifest，serving 端的 registry 這時才整組替換"""
+    version = publish_manifest(MODEL_MANIFEST_PATH, SERVING_ARTIFACT_PATHS)
+    print(f"✅ Published {MODEL_MANIFEST_PATH} version {version}")
 
-    model = LogisticRegression(max_iter=10000)
-    model.fit(X_scaled, y)
 
-    joblib.dump(model, "cardio_model.pkl")
-    joblib.dump(scaler, "scaler.pkl")
+# ==================================================
+# Cardio Model
+# ==================================================
+def train_cardio_model():
+    from dataset_cache import load_dataset
 
-    print("✅ Cardio model trained and saved")
+    # 欄位式快取：age_years（天數 → 歲）、gender（1=female, 2=male → 0/1）已在建立快取時轉好
+    df = load_dataset("cardio")
+    stats = cardio_feature_stats(df)
 
+    X = df[CARDIO_FEATURES]
+    y = df["cardio"]
 
-def predict_cardio_probability(data):
-    model = joblib.load("cardio_model.pkl")
-    scaler = joblib.load("scaler.pkl")
+    pipeline, metrics = search_logistic_model(X, y, max_iter=10000, scale=True)
+    scaler = pipeline.named_steps["scaler"]
+    model = pipeline.named_steps["model"]
+
+    save_json_artifact(stats, CARDIO_STATS_PATH)
+    save_artifact(scaler, CARDIO_SCALER_PATH)
+    save_artifact(model, CARDIO_MODEL_PATH)
+    save_json_artifact(export_linear_model(model, CARDIO_FEATURES, scaler), CARDIO_COMPILED_PATH)
+    save_json_artifact(metrics, CARDIO_METRICS_PATH)
+
+    print(f"✅ Cardio model trained and saved (AUC={metrics['cv']['roc_auc']}, "
+          f"params={metrics['best_params']}, {metrics['timing']['search_wall_seconds']}s)")
+
+
+def cardio_feature_stats(df):
+    """從原始 cardio.csv 計算 serving 需要的統計值（訓練時寫成 sidecar）"""
+    return {
+        "features": CARDIO_FEATURES,
+        "medians": {
+            "cholesterol": float(df["cholesterol"].median()),
+            "gluc": float(df["gluc"].median())
+        },
+        "valid_levels": {
+            "cholesterol": [1, 2, 3],
+            "gluc": [1, 2, 3]
+        },
+        # 前端傳 "Male" / "Female"；資料集 gender: 1=female, 2=male → 0/1
+        "category_maps": {
+            "gender": {"Female": 0, "Male": 1}
+        },
+        "defaults": {"gender": 0}
+    }
 
-    # 讀取訓練資料，用來補中位數（避免亂填）
-    df = pd.read_csv("cardio.csv", sep=";")
-    cholesterol_median = df["cholesterol"].median()
-    gluc_median = df["gluc"].median()
+
+def cardio_feature_row(data, stats):
+    """把一筆前端輸入轉成 cardio 模型的特徵 dict（未標準化）"""
+    # 用訓練時存下的中位數補值（避免亂填）
+    medians = stats["medians"]
+    levels = stats["valid_levels"]
 
     cholesterol = (
-        data.cholesterol if data.cholesterol in [1, 2, 3]
-        else cholesterol_median
+        data.cholesterol if data.cholesterol in levels["cholesterol"]
+        else medians["cholesterol"]
     )
     glucose = (
-        data.glucose if data.glucose in [1, 2, 3]
-        else gluc_median
+        data.glucose if data.glucose in levels["gluc"]
+        else medians["gluc"]
     )
 
-    row = {
+    gender_map = stats["category_maps"]["gender"]
+
+    return {
         "age_years": data.age,  # 前端已是「歲」
-        "gender": 1 if data.gender == "Male" else 0,
+        "gender": gender_map.get(data.gender, stats["defaults"]["gender"]),
         "ap_hi": data.systolic_bp,
         "ap_lo": data.diastolic_bp,
         "cholesterol": cholesterol,
@@ -75,79 +284,107 @@ def predict_cardio_probability(data):
         "weight": data.weight
     }
 
-    X = pd.DataFrame([row], columns=CARDIO_FEATURES)
-    X_scaled = scaler.transform(X)
-
-    prob = model.predict_proba(X_scaled)[0][1]
 
+def to_display_probabilities(probs):
     # 醫療 AI 顯示保護（避免 0% / 100%）
-    prob = max(min(prob, 0.95), 0.01)
+    return [round(max(min(prob, 0.95), 0.01) * 100, 1) for prob in probs]
 
-    return round(prob * 100, 1)
 
+def predict_cardio_probabilities(records):
+    """
+    一次計算多筆輸入的 cardio 機率：整批只建一個 DataFrame、
+    呼叫一次 scaler.transform + predict_proba（compiled 模式則直接用係數計算）。
+    """
+    models = registry.snapshot()  # model / scaler / stats 取自同一份 snapshot
+    stats = models["cardio_stats"]
+    rows = [cardio_feature_row(data, stats) for data in records]
 
-# ==================================================
-# Stroke Model
-# ==================================================
-def train_stroke_model():
-    df = pd.read_csv("stroke.csv")
+    if SCORING_MODE != "sklearn":
+        return to_display_probabilities(models["cardio_compiled"].predict_rows(rows))
 
-    df["bmi"] = df["bmi"].fillna(df["bmi"].median())
+    import pandas as pd
 
-    df["gender"] = df["gender"].map({
-        "Male": 0,
-        "Female": 1,
-        "Other": 2
-    })
+    model = models["cardio_model"]
+    scaler = models["cardio_scaler"]
 
-    df = pd.get_dummies(df, columns=["smoking_status"], drop_first=False)
+    X = pd.DataFrame(rows, columns=stats["features"])
+    X_scaled = scaler.transform(X)
 
-    smoking_cols = [
-        "smoking_status_never smoked",
-        "smoking_status_formerly smoked",
-        "smoking_status_smokes",
-        "smoking_status_N/A"
-    ]
+    probs = model.predict_proba(X_scaled)[:, 1]
+    return to_display_probabilities(probs)
 
-    for col in smoking_cols:
-        if col not in df.columns:
-            df[col] = 0
 
-    features = [
-        "age", "gender", "hypertension", "family_heart_disease",
-        "avg_glucose_level", "bmi"
-    ] + smoking_cols
+def predict_cardio_probability(data):
+    return predict_cardio_probabilities([data])[0]
 
-    X = df[features]
-    y = df["stroke"]
 
-    model = LogisticRegression(max_iter=1000)
-    model.fit(X, y)
+# ==================================================
+# Stroke Model
+# ==================================================
+def train_stroke_model():
+    from dataset_cache import load_dataset
+
+    # 欄位式快取：gender 編碼與 smoking_status one-hot 已在建立快取時轉好
+    df = load_dataset("stroke")
+    stats = stroke_feature_stats(df)
 
-    joblib.dump(model, "stroke_model.pkl")
+    df["bmi"] = df["bmi"].fillna(stats["fill_values"]["bmi"])
 
-    print("✅ Stroke model trained and saved")
+    X = df[STROKE_FEATURES]
+    y = df["stroke"]
 
+    pipeline, metrics = search_logistic_model(X, y, max_iter=1000)
+    model = pipeline.named_steps["model"]
+
+    save_json_artifact(stats, STROKE_STATS_PATH)
+    save_artifact(model, STROKE_MODEL_PATH)
+    save_json_artifact(export_linear_model(model, STROKE_FEATURES), STROKE_COMPILED_PATH)
+    save_json_artifact(metrics, STROKE_METRICS_PATH)
+
+    print(f"✅ Stroke model trained and saved (AUC={metrics['cv']['roc_auc']}, "
+          f"params={metrics['best_params']}, {metrics['timing']['search_wall_seconds']}s)")
+
+
+def stroke_feature_stats(df):
+    """從原始 stroke.csv 計算 serving 需要的統計值（訓練時寫成 sidecar）"""
+    return {
+        "features": STROKE_FEATURES,
+        "fill_values": {
+            "bmi": float(df["bmi"].median())  # "N/A" 由 read_csv 讀成 NaN
+        },
+        "category_maps": {
+            "gender": STROKE_GENDER_MAP,
+            # smoking_status → [never, former, smokes, N/A] one-hot
+            "smoking_status": {
+                "never smoked": [1, 0, 0, 0],
+                "formerly smoked": [0, 1, 0, 0],
+                "smokes": [0, 0, 1, 0],
+                "N/A": [0, 0, 0, 1]
+            }
+        },
+        "defaults": {"gender": 1, "smoking_status": "N/A"}
+    }
 
-def predict_stroke_probability(data):
-    model = joblib.load("stroke_model.pkl")
 
-    bmi = data.weight / ((data.height / 100) ** 2)
+def stroke_feature_row(data, stats):
+    """把一筆前端輸入轉成 stroke 模型的特徵 dict"""
+    # 身高缺失時無法算 BMI → 用訓練資料的 BMI 中位數
+    if data.height and data.height > 0:
+        bmi = data.weight / ((data.height / 100) ** 2)
+    else:
+        bmi = stats["fill_values"]["bmi"]
 
-    smoking_map = {
-        "never smoked": [1, 0, 0, 0],
-        "formerly smoked": [0, 1, 0, 0],
-        "smokes": [0, 0, 1, 0],
-        "N/A": [0, 0, 0, 1]
-    }
+    maps = stats["category_maps"]
+    defaults = stats["defaults"]
+    smoking_map = maps["smoking_status"]
 
     never, former, smokes, na = smoking_map.get(
-        data.smoking_status, [0, 0, 0, 1]
+        data.smoking_status, smoking_map[defaults["smoking_status"]]
     )
 
-    X = pd.DataFrame([{
+    return {
         "age": data.age,
-        "gender": 0 if data.gender == "Male" else 1,
+        "gender": maps["gender"].get(data.gender, defaults["gender"]),
         "hypertension": data.hypertension,
         "family_heart_disease": data.family_heart_disease,
         "avg_glucose_level": data.avg_glucose_level,
@@ -156,20 +393,36 @@ def predict_stroke_probability(data):
         "smoking_status_formerly smoked": former,
         "smoking_status_smokes": smokes,
         "smoking_status_N/A": na
-    }])
+    }
+
+
+def predict_stroke_probabilities(records):
+    models = registry.snapshot()
+    stats = models["stroke_stats"]
+    rows = [stroke_feature_row(data, stats) for data in records]
 
-    prob = model.predict_proba(X)[0][1]
-    prob = max(min(prob, 0.95), 0.01)
+    if SCORING_MODE != "sklearn":
+        return to_display_probabilities(models["stroke_compiled"].predict_rows(rows))
 
-    return round(prob * 100, 1)
+    import pandas as pd
+
+    model = models["stroke_model"]
+
+    X = pd.DataFrame(rows, columns=stats["features"])
+
+    probs = model.predict_proba(X)[:, 1]
+    return to_display_probabilities(probs)
+
+
+def predict_stroke_probability(data):
+    return predict_stroke_probabilities([data])[0]
 
 
 # ==================================================
 # 只有直接執行 models.py 才訓練
 # ==================================================
 if __name__ == "__main__":
-    train_cardio_model()
-    train_stroke_model()
+    train_all_models()
 
 
 
@@ -0,0 +1,234 @@
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from compiled_scorer import export_linear_model
+from model_registry import save_artifact, save_json_artifact, load_json_artifact
+from models import (
+    CARDIO_FEATURES, STROKE_FEATURES,
+    CARDIO_STATS_PATH, STROKE_STATS_PATH,
+    CARDIO_ONLINE_MODEL_PATH, CARDIO_ONLINE_SCALER_PATH, STROKE_ONLINE_MODEL_PATH,
+    CARDIO_ONLINE_COMPILED_PATH, STROKE_ONLINE_COMPILED_PATH,
+    cardio_feature_row, stroke_feature_row, stroke_feature_stats, publish_models_manifest
+)
+from settings import (
+    ONLINE_CHECKPOINT_DIR, ONLINE_BATCH_SIZE, ONLINE_ALPHA, ONLINE_LEARNING_RATE, ONLINE_BOOTSTRAP_EPOCHS
+)
+
+# ==================================================
+# 增量學習：SGD logistic regression + partial_fit
+# ==================================================
+# 與 models.py 的 LogisticRegression 並存（MODEL_VARIANT="online" 時 serving 改用這組）。
+#
+#   python online_learning.py bootstrap            用 cardio.csv / stroke.csv 建立初始模型
+#   python online_learning.py update labels.jsonl  只讀取上次之後新增的標註資料，分批 partial_fit
+#   python online_learning.py status               顯示 checkpoint 狀態
+#
+# 標註資料為 JSONL，每行：
+#   {"input_data": {... 與 risk_reports.input_data 相同的欄位 ...}, "cardio": 0 或 1, "stroke": 0 或 1}
+# cardio / stroke 可只給其中一個。特徵轉換與 serving 相同（cardio_feature_row / stroke_feature_row）。
+#
+# 標準化的 scaler 在 bootstrap 時用靜態資料 fit 後就固定，之後只更新 SGD 的係數，
+# 所以不需要重新處理歷史資料。checkpoint 記錄模型、scaler 與 JSONL 讀到的位置，
+# 每個 mini-batch 之後寫一次，中斷後從同一個位置繼續。
+
+LABELS = {
+    "cardio": {
+        "features": CARDIO_FEATURES,
+        "stats_path": CARDIO_STATS_PATH,
+        "feature_row": cardio_feature_row,
+    },
+    "stroke": {
+        "features": STROKE_FEATURES,
+        "stats_path": STROKE_STATS_PATH,
+        "feature_row": stroke_feature_row,
+    },
+}
+
+
+def _checkpoint_path(name):
+    return os.path.join(ONLINE_CHECKPOINT_DIR, f"{name}.pkl")
+
+
+def load_checkpoint(name):
+    import joblib
+
+    path = _checkpoint_path(name)
+    if not os.path.exists(path):
+        raise SystemExit(f"No checkpoint for {name}; run `python online_learning.py bootstrap` first.")
+    return joblib.load(path)
+
+
+def save_checkpoint(name, state):
+    os.makedirs(ONLINE_CHECKPOINT_DIR, exist_ok=True)
+    state["updated_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    save_artifact(state, _checkpoint_path(name))
+
+
+def _new_model():
+    from sklearn.linear_model import SGDClassifier
+
+    # 固定學習率：持續進來的新資料權重不會隨時間衰減到 0（"optimal" 排程在此資料上收斂較差）
+    return SGDClassifier(
+        loss="log_loss", alpha=ONLINE_ALPHA,
+        learning_rate="constant", eta0=ONLINE_LEARNING_RATE, random_state=42
+    )
+
+
+def _static_dataset(name):
+    from dataset_cache import load_dataset
+
+    df = load_dataset(name)
+    if name == "stroke":
+        stats = stroke_feature_stats(df)
+        df["bmi"] = df["bmi"].fillna(stats["fill_values"]["bmi"])
+    return df[LABELS[name]["features"]].astype(float), df[name].to_numpy()
+
+
+def _partial_fit(state, X, y):
+    """對一個 mini-batch 先算 progressive log loss（更新前的預測），再 partial_fit"""
+    from sklearn.metrics import log_loss
+
+    X_scaled = state["scaler"].transform(X)
+    model = state["model"]
+    if hasattr(model, "coef_"):
+        loss = log_loss(y, model.predict_proba(X_scaled)[:, 1], labels=[0, 1])
+        n = state["rows_seen"]
+        state["progressive_log_loss"] = (state.get("progressive_log_loss", loss) * n + loss * len(y)) / (n + len(y))
+    model.partial_fit(X_scaled, y, classes=np.array([0, 1]))
+    state["rows_seen"] += len(y)
+    state["batches"] += 1
+
+
+def bootstrap(name, epochs=ONLINE_BOOTSTRAP_EPOCHS, batch_size=ONLINE_BATCH_SIZE):
+    """用靜態 CSV（欄位式快取）建立初始 checkpoint：fit scaler 後以 mini-batch 跑幾個 epoch"""
+    from sklearn.preprocessing import StandardScaler
+
+    X, y = _static_dataset(name)
+    state = {
+        "name": name,
+        "features": LABELS[name]["features"],
+        "scaler": StandardScaler().fit(X),
+        "model": _new_model(),
+        "rows_seen": 0,
+        "batches": 0,
+        "sources": {}
+    }
+    rng = np.random.default_rng(42)
+    start = time.perf_counter()
+    for _ in range(epochs):
+        order = rng.permutation(len(y))
+        for i in range(0, len(order), batch_size):
+            idx = order[i:i + batch_size]
+            _partial_fit(state, X.iloc[idx], y[idx])
+    state["bootstrap"] = {"rows": int(len(y)), "epochs": epochs, "seconds": round(time.perf_counter() - start, 2)}
+    save_checkpoint(name, state)
+    publish(state)
+    print(f"✅ {name}: bootstrapped on {len(y)} rows × {epochs} epochs")
+
+
+def _source_key(path):
+    return os.path.abspath(path)
+
+
+def iter_labelled_batches(path, name, offset, batch_size=ONLINE_BATCH_SIZE):
+    """從 byte offset 開始讀 JSONL，產生 (X, y, 讀完這批之後的 offset)；沒有該標籤的列略過"""
+    spec = LABELS[name]
+    stats = load_json_artifact(spec["stats_path"])
+    rows, labels = [], []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                break  # 檔尾尚未寫完的一行留到下次
+            offset = f.tell()
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"WARNING: skipping malformed line at byte {offset - len(line)}")
+                continue
+            label = record.get(name)
+            if label not in (0, 1):
+                continue
+            rows.append(spec["feature_row"](SimpleNamespace(**record["input_data"]), stats))
+            labels.append(label)
+            if len(rows) >= batch_size:
+                yield pd.DataFrame(rows, columns=spec["features"]).astype(float), np.array(labels), offset
+                rows, labels = [], []
+    if rows:
+        yield pd.DataFrame(rows, columns=spec["features"]).astype(float), np.array(labels), offset
+    else:
+        yield None, None, offset
+
+
+def update(name, path, batch_size=ONLINE_BATCH_SIZE):
+    state = load_checkpoint(name)
+    key = _source_key(path)
+    cursor = state["sources"].get(key, {"offset": 0})
+    size = os.path.getsize(path)
+    if size < cursor["offset"]:
+        print(f"WARNING: {path} is smaller than the saved offset (rotated?), reading from the start")
+        cursor = {"offset": 0}
+
+    before = state["rows_seen"]
+    for X, y, offset in iter_labelled_batches(path, name, cursor["offset"], batch_size):
+        if X is not None:
+            _partial_fit(state, X, y)
+        state["sources"][key] = {"offset": offset}
+        save_checkpoint(name, state)  # 每批都存，中斷後從這裡繼續
+
+    added = state["rows_seen"] - before
+    if added:
+        publish(state)
+    print(f"✅ {name}: {added} new labelled rows (total {state['rows_seen']}, "
+          f"progressive log loss {state.get('progressive_log_loss', float('nan')):.4f})")
+
+
+def publish(state):
+    """把目前的 SGD 係數寫成 serving 用的 artifact，全部寫完後發佈 manifest（registry 依它整組熱替換）"""
+    from sklearn.pipeline import Pipeline
+
+    name = state["name"]
+    model, scaler = state["model"], state["scaler"]
+    if name == "cardio":
+        save_artifact(scaler, CARDIO_ONLINE_SCALER_PATH)
+        save_artifact(model, CARDIO_ONLINE_MODEL_PATH)
+        save_json_artifact(export_linear_model(model, state["features"], scaler), CARDIO_ONLINE_COMPILED_PATH)
+    else:
+        # sklearn 模式的 stroke 直接吃原始特徵 → 連同 scaler 包成 Pipeline
+        save_artifact(Pipeline([("scaler", scaler), ("model", model)]), STROKE_ONLINE_MODEL_PATH)
+        save_json_artifact(export_linear_model(model, state["features"], scaler), STROKE_ONLINE_COMPILED_PATH)
+    publish_models_manifest()
+
+
+def status():
+    for name in LABELS:
+        path = _checkpoint_path(name)
+        if not os.path.exists(path):
+            print(f"{name}: no checkpoint")
+            continue
+        state = load_checkpoint(name)
+        print(f"{name}: rows_seen={state['rows_seen']} batches={state['batches']} "
+              f"progressive_log_loss={state.get('progressive_log_loss', float('nan')):.4f} "
+              f"updated_at={state['updated_at']} sources={state['sources']}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "bootstrap":
+        for label in LABELS:
+            bootstrap(label)
+    elif command == "update" and len(sys.argv) > 2:
+        for label in LABELS:
+            update(label, sys.argv[2])
+    elif command == "status":
+        status()
+    else:
+        print("Usage: python online_learning.py bootstrap | update <labels.jsonl> | status")
@@ -0,0 +1,158 @@
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from executors import run_io
+from settings import PROFILE_SAMPLE_EVERY, PROFILE_INTERVAL, PROFILE_DIR
+from tracing import current_trace_id
+
+# ==================================================
+# 取樣 profiler：每 N 個請求 profile 一個，輸出 flamegraph 用的 folded stacks
+# ==================================================
+# PROFILING=1 時才掛上 middleware（否則完全不經過這裡），取樣頻率可由管理員用
+# PUT /admin/profiling 即時調整（0 = 暫停）。
+#
+# 被選中的請求在執行期間，背景 thread 每 PROFILE_INTERVAL 秒看一次 event loop thread 的 stack：
+# - 正在執行這個請求的程式碼 → 記錄從請求進入點到目前位置的 stack
+# - 請求正在 await（等 Gemini、CPU pool、資料庫…）→ 順著 coroutine 的 await 鏈記錄等在哪裡，
+#   最後一格為 [await <型別>]
+# 所以結果是 wall-clock profile：CPU 時間與等待時間都會出現在同一張圖上。
+#
+# 每個請求寫一個 PROFILE_DIR/<時間>-<method>-<route>-<trace id>.folded（"a;b;c 次數"），
+# 可直接給 flamegraph.pl、speedscope 或 inferno 使用。
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _running_stack(frame, root):
+    """frame 往上找到 root（請求的進入點）才算是這個請求在執行；回傳由外到內的名稱"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        if frame is root:
+            names.reverse()
+            return names
+        frame = frame.f_back
+    return None
+
+
+def _awaiting_stack(coro):
+    names = []
+    obj = coro
+    while obj is not None:
+        frame = getattr(obj, "cr_frame", None) or getattr(obj, "gi_frame", None) or getattr(obj, "ag_frame", None)
+        if frame is None:
+            names.append(f"[await {type(obj).__name__}]")
+            break
+        names.append(_frame_name(frame))
+        obj = getattr(obj, "cr_await", None) or getattr(obj, "gi_yieldfrom", None) or getattr(obj, "ag_await", None)
+    return names
+
+
+class _Profile:
+    __slots__ = ("coro", "thread_id", "samples", "started")
+
+    def __init__(self, coro, thread_id):
+        self.coro = coro
+        self.thread_id = thread_id
+        self.samples = Counter()
+        self.started = time.time()
+
+
+class SamplingProfiler:
+    def __init__(self, sample_every=PROFILE_SAMPLE_EVERY, interval=PROFILE_INTERVAL, out_dir=PROFILE_DIR):
+        self.sample_every = sample_every
+        self.interval = interval
+        self.out_dir = out_dir
+        self.written = []  # 最近寫出的檔案
+        self._counter = itertools.count()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def should_sample(self):
+        every = self.sample_every
+        return every > 0 and next(self._counter) % every == 0
+
+    def status(self):
+        return {
+            "sample_every": self.sample_every,
+            "interval": self.interval,
+            "active": len(self._active),
+            "recent": self.written[-20:]
+        }
+
+    def _start(self, profile):
+        with self._lock:
+            self._active[id(profile)] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def _stop(self, profile):
+        with self._lock:
+            self._active.pop(id(profile), None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None  # 沒有要 profile 的請求就結束 thread
+                    return
+                active = list(self._active.values())
+            frames = sys._current_frames()
+            for profile in active:
+                root = profile.coro.cr_frame
+                if root is None:
+                    continue
+                stack = _running_stack(frames.get(profile.thread_id), root)
+                if stack is None:
+                    stack = _awaiting_stack(profile.coro)
+                profile.samples[";".join(stack)] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def _write(self, profile, label, name):
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in profile.samples.most_common():
+                f.write(f"{label};{stack} {count}\n")
+        return path
+
+    async def profile(self, scope, call):
+        """call 為請求的 coroutine（尚未開始執行）；結束後寫出 folded stacks"""
+        profile = _Profile(call, threading.get_ident())
+        self._start(profile)
+        try:
+            await call
+        finally:
+            self._stop(profile)
+            route = scope.get("route")
+            route_name = route.path if route is not None else scope["path"]
+            label = f"{scope['method']} {route_name}"
+            stamp = datetime.fromtimestamp(profile.started, timezone.utc).strftime("%Y%m%dT%H%M%S.%f")
+            slug = route_name.strip("/").replace("/", "_") or "root"
+            name = f"{stamp}-{scope['method']}-{slug}-{current_trace_id() or os.urandom(4).hex()}.folded"
+            if profile.samples:
+                path = await run_io(self._write, profile, label, name)
+                self.written.append(path)
+                del self.written[:-100]
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.should_sample():
+            return await self.app(scope, receive, send)
+        await self.profiler.profile(scope, self.app(scope, receive, send))
@@ -0,0 +1,187 @@
+import base64
+import json
+import re
+from datetime import date, datetime, time, timezone
+
+from settings import OVERALL_AGGREGATE_SOURCE, OVERALL_MIN_PROBABILITY, REPORT_QUERY_PAGE_SIZE
+
+# ==================================================
+# 使用者歷史報告的查詢與彙總（/overall-insight、GET /reports）
+# ==================================================
+# 以前前端要用 select('*') 把整份歷史（含 input_data、llm_report 全文）下載下來，
+# 在瀏覽器 mergeReports + 取最大值後再把結果送給 /overall-insight。
+# 現在由伺服器依日期區間查詢，只取需要的欄位：
+#   OVERALL_AGGREGATE_SOURCE="reports"：risk_reports 只投影 possible_diseases 兩個 JSON 路徑，分頁讀取
+#   OVERALL_AGGREGATE_SOURCE="daily"  ：讀 risk_report_daily_max（migrations/001_risk_report_daily_max.sql），
+#                                       列數只與區間天數有關
+# 這裡都是同步的 supabase-py 呼叫，由 main.py 經 run_io 在 IO pool 執行。
+
+REPORT_DISEASE_COLUMNS = "llm:llm_report->possible_diseases,rule:rule_report->possible_diseases"
+
+
+def _parse_bound(value, end):
+    """'YYYY-MM-DD'（整天）或 ISO 8601 時間；沒有時區的視為 UTC"""
+    if not value:
+        return None
+    if len(value) == 10:
+        day = date.fromisoformat(value)
+        moment = datetime.combine(day, time.max if end else time.min, timezone.utc)
+    else:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def parse_range(start_date, end_date):
+    """回傳 (start, end)，皆為含端點的 UTC datetime 或 None；格式錯誤時丟出 ValueError"""
+    start = _parse_bound(start_date, end=False)
+    end = _parse_bound(end_date, end=True)
+    if start and end and start > end:
+        raise ValueError("start_date must not be after end_date")
+    return start, end
+
+
+def merge_diseases(disease_lists, min_probability=OVERALL_MIN_PROBABILITY):
+    """
+    與前端 history.vue 相同的彙總：每份報告的 LLM 與規則結果以疾病名稱合併，
+    所有報告再取每個疾病的最高機率，只保留 >= min_probability 的疾病。
+    順序為第一次出現的順序（報告由新到舊）。
+    """
+    merged = {}
+    for diseases in disease_lists:
+        for d in diseases or []:
+            name, probability = d.get("name"), d.get("probability")
+            if name is None or not isinstance(probability, (int, float)) or probability < min_probability:
+                continue
+            if name not in merged or probability > merged[name]["probability"]:
+                merged[name] = {"name": name, "probability": probability}
+    return list(merged.values())
+
+
+def _apply_range(query, column, start, end, as_date=False):
+    if start is not None:
+        query = query.gte(column, start.date().isoformat() if as_date else start.isoformat())
+    if end is not None:
+        query = query.lte(column, end.date().isoformat() if as_date else end.isoformat())
+    return query
+
+
+def _report_disease_lists(client, user_id, start, end, page_size):
+    offset = 0
+    while True:
+        query = client.table("risk_reports").select(REPORT_DISEASE_COLUMNS).eq("user_id", user_id)
+        query = _apply_range(query, "created_at", start, end)
+        rows = query.order("created_at", desc=True).order("id", desc=True).range(offset, offset + page_size - 1).execute().data
+        for row in rows:
+            yield row.get("llm")
+            yield row.get("rule")
+        if len(rows) < page_size:
+            return
+        offset += page_size
+
+
+def _daily_disease_lists(client, user_id, start, end, page_size):
+    # 以 UTC 日為單位：帶時間的區間端點會包含那一整天
+    offset = 0
+    while True:
+        query = client.table("risk_report_daily_max").select("day,name,probability").eq("user_id", user_id)
+        query = _apply_range(query, "day", start, end, as_date=True)
+        rows = query.order("day", desc=True).order("name").range(offset, offset + page_size - 1).execute().data
+        yield rows
+        if len(rows) < page_size:
+            return
+        offset += page_size
+
+
+def aggregate_diseases(client, user_id, start, end, source=OVERALL_AGGREGATE_SOURCE, page_size=REPORT_QUERY_PAGE_SIZE):
+    lists = _daily_disease_lists if source == "daily" else _report_disease_lists
+    return merge_diseases(lists(client, user_id, start, end, page_size))
+
+
+# ==================================================
+# GET /reports：以 (created_at, id) 做 keyset 分頁
+# ==================================================
+# 由新到舊排序，cursor 是上一頁最後一筆的 (created_at, id)，下一頁從它之後開始：
+#   created_at < c  OR  (created_at = c AND id < i)
+# 不用 offset，任何一頁都只讀 limit + 1 列（需要 migrations/002 的 (user_id, created_at, id) index）。
+# fields 決定回傳哪些欄位；JSON 內的欄位用 PostgREST 的 -> 路徑只取需要的部分，
+# 回傳時再組回原本的巢狀結構，前端不必改讀取方式。
+# summary 只有分數與基本資料；LLM 的摘要與建議（報告裡最大的部分）只在 fields=full，
+# 歷史頁在使用者展開某一張卡片時才用 GET /reports/{id} 取得。
+
+REPORT_PROJECTIONS = {
+    # 歷史頁的卡片：日期、年齡、性別、病史與疾病分數
+    "summary": (
+        "id", "created_at",
+        "input_data->age", "input_data->gender", "input_data->medical_history",
+        "llm_report->possible_diseases", "rule_report->possible_diseases"
+    ),
+    "full": ("id", "created_at", "input_data", "llm_report", "rule_report")
+}
+
+
+def _select_columns(paths):
+    # input_data->age → input_data__age:input_data->age（回傳時再依 __ 組回巢狀）
+    return ",".join(f"{path.replace('->', '__')}:{path}" if "->" in path else path for path in paths)
+
+
+def _nest(row):
+    item = {}
+    for key, value in row.items():
+        *parents, leaf = key.split("__")
+        target = item
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[leaf] = value
+    return item
+
+
+def encode_cursor(row):
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+_ID_PATTERN = re.compile(r"^[0-9A-Za-z-]{1,64}$")  # bigint 或 uuid
+
+
+def decode_cursor(cursor):
+    """回傳 (created_at, id)；格式錯誤時丟出 ValueError（cursor 由 client 送回，內容會放進查詢條件，要先驗證）"""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+    except Exception as e:
+        raise ValueError("malformed cursor") from e
+    if isinstance(row_id, bool) or not _ID_PATTERN.match(str(row_id)):
+        raise ValueError("malformed cursor")
+    return created_at, row_id
+
+
+def validate_report_id(report_id):
+    """report_id 會放進查詢條件，格式與 cursor 裡的 id 相同；不符時丟出 ValueError"""
+    if not _ID_PATTERN.match(report_id):
+        raise ValueError("malformed report id")
+    return report_id
+
+
+def get_report(client, user_id, report_id, fields="full"):
+    """單一報告（只會找到自己的）；不存在時回傳 None"""
+    rows = (
+        client.table("risk_reports").select(_select_columns(REPORT_PROJECTIONS[fields]))
+        .eq("user_id", user_id).eq("id", report_id).limit(1).execute().data
+    )
+    return _nest(rows[0]) if rows else None
+
+
+def list_reports_page(client, user_id, fields, limit, after=None):
+    """回傳 {"items": [...], "next_cursor": str 或 None}"""
+    query = client.table("risk_reports").select(_select_columns(REPORT_PROJECTIONS[fields])).eq("user_id", user_id)
+    if after is not None:
+        created_at, row_id = after
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{row_id}")')
+    rows = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute().data
+    items = [_nest(row) for row in rows[:limit]]
+    return {
+        "items": items,
+        "next_cursor": encode_cursor(items[-1]) if len(rows) > limit else None
+    }
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：沒有 flock，只適合單一 worker
+    fcntl = None
+
+from executors import run_io
+from logs import get_logger
+from metrics import REPORT_INSERT_SECONDS
+from settings import (
+    REPORT_BATCH_SIZE, REPORT_FLUSH_INTERVAL, REPORT_QUEUE_MAX,
+    REPORT_MAX_RETRIES, REPORT_RETRY_BASE_DELAY, REPORT_SPILL_PATH, REPORT_DEAD_LETTER_PATH
+)
+
+# ==================================================
+# Write-behind 佇列：報告先回給使用者，背景再批次寫入 Supabase
+# ==================================================
+# - enqueue() 立即回傳一個 Future（寫入成功後為該列的 id，失敗為 None）
+# - 背景 worker 依「筆數達 batch_size」或「等待超過 flush_interval」觸發 multi-row insert
+# - 失敗以 jittered exponential backoff 重試；仍失敗就寫到本機 append-only 檔（spill）
+# - 啟動時（背景 task）與關閉時都會嘗試把 spill 檔補寫回資料庫；每個 uvicorn worker 都有自己的 writer，
+#   spill 檔的寫入與取出都先拿 flock（<spill 檔>.lock），同一列不會被兩個 worker 重複補寫
+# - 補寫時 spill 檔先改名成 <spill 檔>.draining.<pid>.<ns> 並對它拿 flock，所有列都寫入、重新 spill
+#   或 dead-letter 之後才刪除。process 中途結束時 flock 自動釋放，下一次補寫會接手這個檔案
+#   （已經寫入的列可能再寫一次：寧可重複，也不遺失）
+# - 檔案 IO（含 flock 等待）一律經由 run_io 在 IO thread 執行，不佔用 event loop
+# - 資料本身被資料庫拒絕（約束違反、欄位不存在 ...）重試也不會成功：整批改成一列一列寫，
+#   仍被拒絕的列寫到 dead-letter 檔（REPORT_DEAD_LETTER_PATH），不再 spill，也不會在每次啟動時重播
+
+# PostgREST / Postgres 錯誤碼中「資料或請求本身有問題」的類別（SQLSTATE 22 資料、23 約束、42 語法 / 欄位，
+# PGRST1xx / PGRST2xx 請求與 schema）；其他（連線、逾時、5xx、鎖衝突）視為暫時性錯誤
+_PERMANENT_ERROR_PREFIXES = ("22", "23", "42", "PGRST1", "PGRST2")
+
+_STOP = object()
+
+log = get_logger("report_queue")
+
+
+class RowsRejected(Exception):
+    """資料庫拒絕了這批資料（非暫時性錯誤）"""
+
+
+def _is_permanent(error):
+    code = str(getattr(error, "code", "") or "")
+    return code.startswith(_PERMANENT_ERROR_PREFIXES)
+
+
+class ReportWriter:
+    def __init__(
+        self,
+        insert_rows,
+        batch_size=REPORT_BATCH_SIZE,
+        flush_interval=REPORT_FLUSH_INTERVAL,
+        max_queue=REPORT_QUEUE_MAX,
+        max_retries=REPORT_MAX_RETRIES,
+        retry_base_delay=REPORT_RETRY_BASE_DELAY,
+        spill_path=REPORT_SPILL_PATH,
+        dead_letter_path=REPORT_DEAD_LETTER_PATH
+    ):
+        # insert_rows(table, rows) -> 寫入後的 rows（同步函式，會在 IO thread pool 執行）
+        self.insert_rows = insert_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.spill_path = spill_path
+        self.dead_letter_path = dead_letter_path
+
+        self._queue = None
+        self._worker = None
+        self._drainer = None
+        self._spills = set()  # 進行中的 spill（佇列已滿時由 enqueue 建立）
+        self.insert_calls = 0
+        self.spilled_rows = 0
+        self.dead_lettered_rows = 0
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+        # 上次沒寫進去的資料在背景補寫，不延後啟動
+        self._drainer = asyncio.create_task(self._drain(await run_io(self._claim_spilled)))
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        # 用 sentinel 通知 worker：寫完手上的 batch 再結束（不直接 cancel，避免遺失資料）
+        self._queue.put_nowait(_STOP)
+        await self._worker
+        self._worker = None
+        await self._drainer
+        self._drainer = None
+        if self._spills:
+            await asyncio.gather(*self._spills)
+
+        # 先取出 spill 檔（避免剛才寫失敗而 spill 的列馬上又重試一次），把佇列剩下的資料寫完，再補寫 spill 檔
+        claims = await run_io(self._claim_spilled)
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for start in range(0, len(pending), self.batch_size):
+            await self._flush(pending[start:start + self.batch_size])
+        await self._drain(claims)
+
+    def enqueue(self, table, row):
+        future = asyncio.get_running_loop().create_future()
+        if self._queue is None or self.depth >= self.max_queue:
+            # 尚未啟動或佇列已滿 → 直接 spill，不讓 request 等資料庫（也不等 flock）
+            task = asyncio.ensure_future(self._spill_later(table, row, future))
+            self._spills.add(task)
+            task.add_done_callback(self._spills.discard)
+            return future
+        self._queue.put_nowait((table, row, future))
+        return future
+
+    async def _spill_later(self, table, row, future):
+        try:
+            await run_io(self._spill, table, [row])
+        finally:
+            if not future.done():
+                future.set_result(None)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch):
+        by_table = {}
+        for table, row, future in batch:
+            by_table.setdefault(table, []).append((row, future))
+
+        for table, items in by_table.items():
+            rows = [row for row, _ in items]
+            try:
+                inserted = await self._insert_with_retry(table, rows)
+            except RowsRejected as e:
+                log.warning("report_batch_rejected", table=table, rows=len(rows), error=str(e),
+                            detail="inserting one at a time")
+                inserted = await self._insert_each(table, rows)
+            if inserted is None:
+                await run_io(self._spill, table, rows)
+            for i, (_, future) in enumerate(items):
+                if future is None or future.done():
+                    continue
+                row_id = None
+                if inserted is not None and i < len(inserted):
+                    row_id = inserted[i].get("id")
+                future.set_result(row_id)
+
+    async def _insert_each(self, table, rows):
+        """逐列寫入；回傳與 rows 對齊的結果（沒寫進去的列為 {}）"""
+        results = []
+        for row in rows:
+            try:
+                inserted = await self._insert_with_retry(table, [row])
+            except RowsRejected as e:
+                await run_io(self._dead_letter, table, row, e)
+                inserted = None
+            else:
+                if inserted is None:
+                    await run_io(self._spill, table, [row])
+            results.append(inserted[0] if inserted else {})
+        return results
+
+    async def _insert_with_retry(self, table, rows):
+        """回傳寫入後的 rows；暫時性錯誤重試用盡回傳 None；資料被拒絕時丟出 RowsRejected"""
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                self.insert_calls += 1
+                inserted = await run_io(self.insert_rows, table, rows)
+                REPORT_INSERT_SECONDS.observe(time.perf_counter() - start, table)
+                log.debug("reports_saved", table=table, rows=len(rows))
+                return inserted or []
+            except Exception as e:
+                if _is_permanent(e):
+                    raise RowsRejected(str(e)) from e
+                if attempt == self.max_retries:
+                    log.warning("report_insert_failed", table=table, rows=len(rows), attempts=attempt + 1, error=str(e))
+                    return None
+                # full jitter：0 ~ base * 2^attempt 秒
+                delay = random.uniform(0, self.retry_base_delay * (2 ** attempt))
+                log.warning("report_insert_retry", table=table, rows=len(rows), delay=round(delay, 2), error=str(e))
+                await asyncio.sleep(delay)
+
+    @contextmanager
+    def _spill_lock(self):
+        # 跨 process 的互斥鎖（同一台機器上的 uvicorn workers）；持有時間只有讀寫一個小檔案
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.spill_path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _spill(self, table, rows):
+        with self._spill_lock(), open(self.spill_path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps({"table": table, "row": row}, ensure_ascii=False, default=str) + "\n")
+        self.spilled_rows += len(rows)
+        log.warning("reports_spilled", table=table, rows=len(rows), path=self.spill_path)
+
+    def _dead_letter(self, table, row, error):
+        record = {"table": table, "row": row, "error": str(error), "rejected_at": time.time()}
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.dead_lettered_rows += 1
+        log.warning("report_dead_lettered", table=table, error=str(error), path=self.dead_letter_path)
+
+    def _claim_spilled(self):
+        """
+        （IO thread）取得要補寫的 draining 檔：目前的 spill 檔改名後認領，加上沒有人持有的舊 draining 檔。
+        回傳 [(path, 持有 flock 的檔案, [(table, row)])]，補寫完後由 _release 刪除。
+        """
+        directory = os.path.dirname(self.spill_path) or "."
+        prefix = f"{os.path.basename(self.spill_path)}.draining"
+        claims = []
+        with self._spill_lock():
+            try:
+                paths = sorted(os.path.join(directory, n) for n in os.listdir(directory) if n.startswith(prefix))
+            except FileNotFoundError:
+                paths = []
+            if os.path.exists(self.spill_path):
+                # 先改名，之後新的 spill 寫到新檔案，不會與補寫互相干擾
+                draining_path = f"{self.spill_path}.draining.{os.getpid()}.{time.time_ns()}"
+                os.replace(self.spill_path, draining_path)
+                paths.append(draining_path)
+            for path in paths:
+                claim = self._lock_draining(path)
+                if claim is not None:
+                    claims.append(claim)
+
+        rows = sum(len(items) for _, _, items in claims)
+        if rows:
+            log.info("reports_spill_claimed", rows=rows, files=len(claims), path=self.spill_path)
+        return claims
+
+    def _lock_draining(self, path):
+        try:
+            handle = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()  # 另一個還活著的 worker 正在補寫
+                return None
+        items = []
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                log.warning("report_spill_corrupt_line", path=path, line=line[:80])
+                continue
+            items.append((record["table"], record["row"]))
+        return path, handle, items
+
+    def _release(self, path, handle):
+        # 在 spill lock 內刪除再關閉：別的 process 不會在刪除與釋放 flock 之間認領到這個檔案
+        with self._spill_lock():
+            os.remove(path)
+            handle.close()
+
+    async def _drain(self, claims):
+        """補寫認領的 draining 檔；整個檔案的列都有了去處（寫入 / 重新 spill / dead-letter）才刪除"""
+        for path, handle, items in claims:
+            pending = [(table, row, None) for table, row in items]
+            try:
+                for start in range(0, len(pending), self.batch_size):
+                    await self._flush(pending[start:start + self.batch_size])
+            except BaseException:
+                # 沒有補寫完：保留檔案、釋放 flock，下次補寫再處理
+                handle.close()
+                raise
+            await run_io(self._release, path, handle)
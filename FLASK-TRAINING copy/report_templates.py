@@ -0,0 +1,160 @@
+from rules import HYPERTENSION, HYPERLIPIDEMIA, CAD, ARRHYTHMIA
+from scoring import CARDIO_DISEASE, STROKE_DISEASE
+
+# ==================================================
+# /predict 的範本報告（不呼叫 LLM）
+# ==================================================
+# Gemini 在 latency budget 內沒有回應、失敗，或回傳無法解析的內容時，
+# 用計算好的機率與 low_risk_diseases 組出一份報告。格式與 build_prediction_payload 的 prompt 要求完全相同：
+#   {"possible_diseases": [{"name", "probability": 數字或 "Low risk"}], "summary": str, "recommendations": [str]}
+# 規則也相同：>= 30% 原樣顯示數字，其餘為 "Low risk"；summary 最後一句列出低風險疾病（不含機率）；
+# recommendations 包含可執行的步驟、至少兩個運動建議與至少兩個飲食建議（都附理由）。
+# 內容全部是固定的句子，同樣的輸入永遠得到同樣的報告。
+
+LOW_RISK_THRESHOLD = 30  # 與 prompt 相同
+HIGH_RISK_THRESHOLD = 60  # 與前端相同：>= 60 高風險，30 ~ 60 中風險
+
+# 每個疾病：一個可執行步驟、兩個運動建議、兩個飲食建議（依風險高低挑選）
+RECOMMENDATIONS = {
+    CARDIO_DISEASE: {
+        "action": "Book a heart check-up with your doctor and ask for a blood pressure, cholesterol and blood sugar test.",
+        "sport": [
+            "Walk briskly for 30 minutes on most days, because steady aerobic exercise trains the heart to pump more efficiently.",
+            "Try cycling or swimming twice a week, because they raise your heart rate without straining the joints."
+        ],
+        "food": [
+            "Fill half your plate with vegetables and whole grains, because their fiber helps lower LDL cholesterol.",
+            "Swap fried and processed meat for fish or beans, because less saturated fat keeps the arteries clearer."
+        ]
+    },
+    STROKE_DISEASE: {
+        "action": "Learn the stroke warning signs (face drooping, arm weakness, slurred speech) and call emergency services at once if they appear.",
+        "sport": [
+            "Take a 20 to 30 minute walk every day, because regular movement lowers blood pressure, the biggest stroke risk factor.",
+            "Add gentle balance exercises such as tai chi or yoga, because they improve circulation and reduce stress."
+        ],
+        "food": [
+            "Cut back on salty snacks and instant foods, because less sodium lowers blood pressure.",
+            "Eat potassium-rich foods like bananas, spinach and beans, because potassium helps balance the effect of salt."
+        ]
+    },
+    HYPERTENSION["name"]: {
+        "action": "Measure your blood pressure at home at the same time each day and keep a simple log to show your doctor.",
+        "sport": [
+            "Walk briskly or jog lightly for 30 minutes most days, because aerobic exercise can lower blood pressure by several points.",
+            "Try swimming or cycling twice a week, because rhythmic exercise makes the blood vessels more flexible."
+        ],
+        "food": [
+            "Keep salt under one teaspoon a day and check food labels, because sodium makes the body hold water and raises pressure.",
+            "Eat more vegetables, fruit and low-fat dairy, because a DASH-style diet is proven to lower blood pressure."
+        ]
+    },
+    HYPERLIPIDEMIA["name"]: {
+        "action": "Ask your doctor for a fasting lipid test so you know your LDL, HDL and triglyceride levels.",
+        "sport": [
+            "Do 150 minutes of moderate exercise such as brisk walking each week, because it raises HDL, the 'good' cholesterol.",
+            "Add two short strength sessions a week, because more muscle helps the body use fat and sugar better."
+        ],
+        "food": [
+            "Choose oats, beans and apples more often, because soluble fiber binds cholesterol in the gut.",
+            "Cook with olive oil instead of butter or lard, because unsaturated fat lowers LDL cholesterol."
+        ]
+    },
+    CAD["name"]: {
+        "action": "Tell your doctor about any chest tightness or breathlessness during activity, and seek help at once if chest pain lasts more than a few minutes.",
+        "sport": [
+            "Start with gentle walks and build up slowly, because gradual training improves blood flow to the heart muscle safely.",
+            "Try stationary cycling at an easy pace, because you can control the effort and stop whenever you need to."
+        ],
+        "food": [
+            "Eat fatty fish such as salmon or mackerel twice a week, because omega-3 fats help protect the heart's arteries.",
+            "Limit sugary drinks and desserts, because extra sugar raises triglycerides and promotes plaque."
+        ]
+    },
+    ARRHYTHMIA["name"]: {
+        "action": "Write down when palpitations happen and how long they last, and ask your doctor whether you need an ECG.",
+        "sport": [
+            "Choose moderate activities like walking or easy swimming, because steady exercise supports a regular heartbeat.",
+            "Practice slow breathing or yoga for 10 minutes a day, because calming the nervous system can reduce palpitations."
+        ],
+        "food": [
+            "Cut down on caffeine and energy drinks, because stimulants can trigger an irregular heartbeat.",
+            "Limit alcohol and drink enough water, because dehydration and alcohol both upset the heart's rhythm."
+        ]
+    }
+}
+
+DEFAULT_RECOMMENDATIONS = {
+    "action": "Schedule a routine check-up to review these results with your doctor.",
+    "sport": [
+        "Walk briskly for 30 minutes most days, because it strengthens the heart.",
+        "Try swimming or cycling twice a week, because they are gentle on the joints."
+    ],
+    "food": [
+        "Eat more vegetables and whole grains, because fiber helps control cholesterol.",
+        "Cut back on salty snacks, because less sodium lowers blood pressure."
+    ]
+}
+
+
+def _percent(probability):
+    return f"{probability}%"
+
+
+def _join(names):
+    return names[0] if len(names) == 1 else f"{', '.join(names[:-1])} and {names[-1]}"
+
+
+def template_summary(probabilities, low_risk_diseases):
+    ranked = sorted(
+        (d for d in probabilities if d["probability"] >= LOW_RISK_THRESHOLD),
+        key=lambda d: d["probability"], reverse=True
+    )
+    high = [f"{d['name']} ({_percent(d['probability'])})" for d in ranked if d["probability"] >= HIGH_RISK_THRESHOLD]
+    medium = [f"{d['name']} ({_percent(d['probability'])})" for d in ranked if d["probability"] < HIGH_RISK_THRESHOLD]
+
+    sentences = []
+    if high:
+        sentences.append(f"Based on the information you provided, your estimated risk is high for {_join(high)}.")
+    if medium:
+        lead = "There is also" if high else "Based on the information you provided, there is"
+        sentences.append(f"{lead} a medium risk of {_join(medium)}.")
+    if ranked:
+        sentences.append("These estimates are not a diagnosis, but they are a good reason to talk with your doctor "
+                         "and to start with the small, steady changes below.")
+    else:
+        sentences.append("Based on the information you provided, none of the calculated risks is high or medium, "
+                         "which is good news. Keeping up healthy habits is the best way to keep it that way.")
+    if low_risk_diseases:
+        sentences.append(f"Additionally, you may also keep an eye on: {', '.join(low_risk_diseases)}.")
+    return " ".join(sentences)
+
+
+def template_recommendations(probabilities):
+    # 依機率由高到低：風險最高的兩個疾病各一個可執行步驟，運動 / 飲食建議取風險最高的疾病
+    ranked = sorted(
+        (d for d in probabilities if d["probability"] >= LOW_RISK_THRESHOLD),
+        key=lambda d: d["probability"], reverse=True
+    )
+    sets = [RECOMMENDATIONS[d["name"]] for d in ranked if d["name"] in RECOMMENDATIONS] or [DEFAULT_RECOMMENDATIONS]
+
+    actions = [s["action"] for s in sets[:2]]
+    if DEFAULT_RECOMMENDATIONS["action"] not in actions:
+        actions.append(DEFAULT_RECOMMENDATIONS["action"])
+
+    return actions + sets[0]["sport"] + sets[0]["food"]
+
+
+def template_prediction_report(probabilities, low_risk_diseases):
+    """依 prompt 規定的 JSON 格式組出報告；probabilities 與 low_risk_diseases 與送給 Gemini 的相同"""
+    return {
+        "possible_diseases": [
+            {
+                "name": d["name"],
+                "probability": d["probability"] if d["probability"] >= LOW_RISK_THRESHOLD else "Low risk"
+            }
+            for d in probabilities
+        ],
+        "summary": template_summary(probabilities, low_risk_diseases),
+        "recommendations": template_recommendations(probabilities)
+    }
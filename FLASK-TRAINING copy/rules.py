@@ -0,0 +1,438 @@
+import itertools
+import sys
+
+import numpy as np
+
+# ==================================================
+# 規則引擎：用一張門檻 / 分數 / 機率區間的表描述 rule_* 規則
+# ==================================================
+# 條件寫成 (欄位, 運算子, 參數[, 預設值])；欄位不存在時用預設值（與原本 getattr 的預設相同）。
+# 欄位值為 None 時條件一律不成立（原本的 rule_cad / rule_arrhythmia 會因此丟出 TypeError）。
+#
+# 每條規則的機率 = bands（第一個成立的區間，否則 default）
+#               + score_bands（依 factors 加總的分數落在哪個區間）
+# 最後套用 cap 上限。
+#
+# evaluate_rule()    ：單筆（/predict）用的純 Python 路徑
+# evaluate_columns() ：整批用 NumPy 欄位陣列一次算完（/predict/batch、bulk scoring）
+
+CAD_SYMPTOMS = ("chest_discomfort", "shortness_of_breath", "chest_tightness")
+
+HYPERTENSION = {
+    "name": "Hypertension (high blood pressure)",
+    "bands": [
+        ([("systolic_bp", ">=", 140), ("diastolic_bp", ">=", 90)], 70.0),
+        ([("systolic_bp", "between", (120, 139)), ("diastolic_bp", "between", (80, 89))], 40.0),
+    ],
+    "default": 10.0,
+}
+# https://www.hpa.gov.tw/Pages/Detail.aspx?nodeid=127&pid=8159
+
+HYPERLIPIDEMIA = {
+    "name": "Hyperlipidemia (high cholesterol)",
+    "bands": [
+        ([("cholesterol", ">", 240)], 65.0),
+        ([("cholesterol", "between", (200, 239))], 35.0),
+    ],
+    "default": 10.0,
+    "factors": [
+        (("high_fat_diet", ">=", 2), 1),         # 高脂飲食
+        (("active", "==", 0, 1), 1),             # 身體活動
+        (("alcohol", "==", 1), 1),               # 酒精攝取
+        (("stress_level", "==", 2), 1),          # 壓力程度
+        (("family_heart_disease", "==", 1), 1),  # 家族心臟病
+    ],
+    "score_bands": [(0, 0.0), (2, 10.0)],  # (分數上限, 加上的機率)
+    "score_else": 15.0,
+    "cap": 70.0,
+}
+# https://wwwv.tsgh.ndmutsgh.edu.tw/unit/10012/12867
+
+ARRHYTHMIA = {
+    "name": "Arrhythmia / Palpitations",
+    "factors": [
+        (("arrhythmia_symptoms", "count", None, ()), 1),  # 勾選的心悸症狀數
+        (("hypertension", "==", 1), 1),
+        (("family_heart_disease", "==", 1), 1),
+        (("smoke", "==", 1), 1),
+        (("active", "==", 0, 0), 1),
+        (("cholesterol", ">", 240), 1),
+    ],
+    "score_bands": [(0, 10.0), (3, 35.0), (6, 55.0)],
+    "score_else": 70.0,
+}
+# https://www.ntuh.gov.tw/telehealth/Fpage.action?fid=1547
+# https://www.liver.org.tw/journalView.php?cat=73&sid=1067&page=1
+# https://helloyishi.com.tw/heart-health/arrhythmias/what-are-heart-palpitations/
+
+CAD = {
+    "name": "Coronary Artery Disease (heart artery block)",
+    "factors": [
+        (("age", ">=", 40), 1),
+        (("gender", "==", "Male"), 1),
+        (("hypertension", "==", 1), 2),
+        (("family_heart_disease", "==", 1), 2),
+        (("bmi", ">=", 30), 1),
+        (("cholesterol", ">=", 240), 2),
+        (("smoke", "==", 1), 2),
+        (("alcohol", "==", 1), 1),
+        (("active", "==", 0, 1), 1),
+        (("stress_level", "==", 2), 1),
+        (("high_fat_diet", "==", 2), 1),
+        (("symptoms", "intersects", CAD_SYMPTOMS, ()), 2),
+    ],
+    "score_bands": [(0, 5.0), (4, 25.0), (8, 45.0), (12, 60.0)],
+    "score_else": 70.0,
+}
+# https://www.tsmh.org.tw/sites/nursing_department/int_13.html
+# https://wd.vghtpe.gov.tw/cvs/Fpage.action?muid=11018&fid=10428
+
+RULES = [HYPERTENSION, HYPERLIPIDEMIA, CAD, ARRHYTHMIA]
+
+_NUMERIC_OPS = (">=", ">", "<=", "<", "between")
+_LIST_OPS = ("count", "intersects")
+
+
+def _conditions(rule):
+    for conds, _ in rule.get("bands", []):
+        yield from conds
+    for cond, _ in rule.get("factors", []):
+        yield cond
+
+
+RULE_FIELDS = sorted({cond[0] for rule in RULES for cond in _conditions(rule)})
+# 每條規則一定要有的輸入（條件沒有預設值的欄位）；bulk scoring 的來源檔缺少時不計算該規則
+RULE_INPUTS = {
+    rule["name"]: sorted({cond[0] for cond in _conditions(rule) if len(cond) <= 3}) for rule in RULES
+}
+
+
+# ---------- 單筆路徑 ----------
+
+def _test(value, op, arg):
+    if value is None:
+        return 0 if op == "count" else False
+    if op == ">=":
+        return value >= arg
+    if op == ">":
+        return value > arg
+    if op == "<=":
+        return value <= arg
+    if op == "<":
+        return value < arg
+    if op == "==":
+        return value == arg
+    if op == "between":
+        return arg[0] <= value <= arg[1]
+    if op == "count":
+        return len(value)
+    if op == "intersects":
+        return any(item in value for item in arg)
+    raise ValueError(f"Unknown rule operator: {op}")
+
+
+def _check(data, cond):
+    field, op, arg = cond[:3]
+    default = cond[3] if len(cond) > 3 else None
+    return _test(getattr(data, field, default), op, arg)
+
+
+def _score_band(rule, score):
+    for upper, value in rule["score_bands"]:
+        if score <= upper:
+            return value
+    return rule["score_else"]
+
+
+def evaluate_rule(rule, data):
+    """單筆：回傳規則算出的機率（float）"""
+    probability = 0.0
+    if "bands" in rule:
+        probability = rule["default"]
+        for conds, value in rule["bands"]:
+            if any(_check(data, cond) for cond in conds):
+                probability = value
+                break
+
+    if "factors" in rule:
+        score = 0
+        for cond, points in rule["factors"]:
+            score += points * _check(data, cond)
+        probability += _score_band(rule, score)
+
+    if "cap" in rule:
+        probability = min(probability, rule["cap"])
+    return probability
+
+
+def evaluate_record(data):
+    """單筆：{規則名稱: 機率}"""
+    return {rule["name"]: evaluate_rule(rule, data) for rule in RULES}
+
+
+# ---------- 整批（NumPy 欄位）路徑 ----------
+
+MISSING = object()  # 紀錄沒有這個欄位（與值為 None 不同：會套用條件的預設值）
+
+
+def columns_from_records(records, fields=RULE_FIELDS):
+    """
+    把物件 list 轉成 {欄位: list}。所有紀錄都沒有的欄位不放入；
+    部分紀錄缺少的欄位以 MISSING 標記。
+    """
+    columns = {}
+    for field in fields:
+        if any(hasattr(r, field) for r in records):
+            columns[field] = [getattr(r, field, MISSING) for r in records]
+    return columns
+
+
+class _Columns:
+    """每個 (欄位, 預設值) 只轉換一次（數值 → float 陣列，None → NaN）"""
+
+    def __init__(self, columns, n):
+        self.columns = columns
+        self.n = n
+        self._numeric = {}
+        self._objects = {}
+
+    def numeric(self, field, default):
+        key = (field, default)
+        arr = self._numeric.get(key)
+        if arr is None:
+            values = self.columns[field]
+            if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+                arr = values.astype(float, copy=False)
+            else:
+                arr = np.array([
+                    np.nan if v is None else v
+                    for v in (default if v is MISSING else v for v in values)
+                ], dtype=float)
+            self._numeric[key] = arr
+        return arr
+
+    def objects(self, field, default):
+        key = (field, default)
+        arr = self._objects.get(key)
+        if arr is None:
+            arr = np.empty(self.n, dtype=object)
+            arr[:] = [default if v is MISSING else v for v in self.columns[field]]
+            self._objects[key] = arr
+        return arr
+
+
+def _test_column(cols, cond):
+    field, op, arg = cond[:3]
+    default = cond[3] if len(cond) > 3 else None
+    if field not in cols.columns:
+        return np.full(cols.n, _test(default, op, arg), dtype=float if op == "count" else bool)
+
+    if op in _NUMERIC_OPS or (op == "==" and not isinstance(arg, str)):
+        values = cols.numeric(field, default)
+        with np.errstate(invalid="ignore"):  # NaN（None）比較結果為 False
+            if op == ">=":
+                return values >= arg
+            if op == ">":
+                return values > arg
+            if op == "<=":
+                return values <= arg
+            if op == "<":
+                return values < arg
+            if op == "==":
+                return values == arg
+            return (values >= arg[0]) & (values <= arg[1])
+
+    if op == "==":
+        return cols.objects(field, default) == arg
+
+    if op in _LIST_OPS:
+        values = cols.objects(field, default)
+        return np.fromiter((_test(v, op, arg) for v in values), dtype=float if op == "count" else bool, count=cols.n)
+    raise ValueError(f"Unknown rule operator: {op}")
+
+
+def evaluate_columns(columns, n=None):
+    """
+    整批：columns 為 {欄位: list 或 NumPy 陣列}，回傳 {規則名稱: float64 陣列}。
+    結果與逐筆呼叫 evaluate_rule 相同。
+    """
+    if n is None:
+        n = len(next(iter(columns.values()))) if columns else 0
+    cols = _Columns(columns, n)
+    results = {}
+    for rule in RULES:
+        probability = np.zeros(n)
+        if "bands" in rule:
+            matches = [
+                np.logical_or.reduce([_test_column(cols, cond) for cond in conds])
+                for conds, _ in rule["bands"]
+            ]
+            probability = np.select(matches, [value for _, value in rule["bands"]], default=rule["default"])
+
+        if "factors" in rule:
+            score = np.zeros(n)
+            for cond, points in rule["factors"]:
+                score += points * _test_column(cols, cond)
+            probability = probability + np.select(
+                [score <= upper for upper, _ in rule["score_bands"]],
+                [value for _, value in rule["score_bands"]],
+                default=rule["score_else"]
+            )
+
+        if "cap" in rule:
+            probability = np.minimum(probability, rule["cap"])
+        results[rule["name"]] = probability
+    return results
+
+
+# ==================================================
+# Parity check：python rules.py --check
+# ==================================================
+# 下面的 _reference_* 是改寫前 main.py 裡 rule_* 的原始邏輯，用來逐一比對。
+# 原始程式在 cholesterol / bmi 為 None 時會丟出 TypeError；
+# 這些組合改以「None 不滿足門檻」（等同代入不會觸發的值）作為預期結果。
+
+def _reference_hypertension(data):
+    sbp = data.systolic_bp
+    dbp = data.diastolic_bp
+    if sbp >= 140 or dbp >= 90:
+        return 70.0
+    elif 120 <= sbp <= 139 or 80 <= dbp <= 89:
+        return 40.0
+    return 10.0
+
+
+def _reference_hyperlipidemia(data):
+    chol = data.cholesterol
+    conditions = 0
+    if chol is None:
+        probability = 10.0
+    elif chol > 240:
+        probability = 65.0
+    elif 200 <= chol <= 239:
+        probability = 35.0
+    else:
+        probability = 10.0
+    if getattr(data, "high_fat_diet", 0) >= 2:
+        conditions += 1
+    if getattr(data, "active", 1) == 0:
+        conditions += 1
+    if getattr(data, "alcohol", 0) == 1:
+        conditions += 1
+    if getattr(data, "stress_level", 0) == 2:
+        conditions += 1
+    if getattr(data, "family_heart_disease", 0) == 1:
+        conditions += 1
+    if conditions >= 3:
+        probability += 15
+    elif conditions >= 1:
+        probability += 10
+    return min(probability, 70.0)
+
+
+def _reference_arrhythmia(data):
+    total_score = len(getattr(data, "arrhythmia_symptoms", []))
+    if getattr(data, "hypertension", 0) == 1:
+        total_score += 1
+    if getattr(data, "family_heart_disease", 0) == 1:
+        total_score += 1
+    if getattr(data, "smoke", 0) == 1:
+        total_score += 1
+    if getattr(data, "active", 0) == 0:
+        total_score += 1
+    if getattr(data, "cholesterol", 0) > 240:
+        total_score += 1
+    if total_score == 0:
+        return 10.0
+    elif total_score <= 3:
+        return 35.0
+    elif total_score <= 6:
+        return 55.0
+    return 70.0
+
+
+def _reference_cad(data):
+    score = 0
+    score += 1 if getattr(data, "age", 0) >= 40 else 0
+    score += 1 if getattr(data, "gender", "Female") == "Male" else 0
+    score += 2 if getattr(data, "hypertension", 0) == 1 else 0
+    score += 2 if getattr(data, "family_heart_disease", 0) == 1 else 0
+    score += 1 if getattr(data, "bmi", 0) >= 30 else 0
+    score += 2 if getattr(data, "cholesterol", 0) >= 240 else 0
+    score += 2 if getattr(data, "smoke", 0) == 1 else 0
+    score += 1 if getattr(data, "alcohol", 0) == 1 else 0
+    score += 1 if getattr(data, "active", 1) == 0 else 0
+    score += 1 if getattr(data, "stress_level", 0) == 2 else 0
+    score += 1 if getattr(data, "high_fat_diet", 0) == 2 else 0
+    symptoms = getattr(data, "symptoms", [])
+    if any(sym in symptoms for sym in CAD_SYMPTOMS):
+        score += 2
+    if score == 0:
+        return 5.0
+    elif score <= 4:
+        return 25.0
+    elif score <= 8:
+        return 45.0
+    elif score <= 12:
+        return 60.0
+    return 70.0
+
+
+def _reference(fn, data):
+    try:
+        return fn(data)
+    except TypeError:
+        # None 不滿足任何門檻
+        fields = {k: (0 if v is None else v) for k, v in vars(data).items()}
+        return fn(type(data)(**fields))
+
+
+def _grid(**values):
+    from types import SimpleNamespace
+    keys = list(values)
+    for combo in itertools.product(*values.values()):
+        yield SimpleNamespace(**{k: v for k, v in zip(keys, combo) if v is not _ABSENT})
+
+
+_ABSENT = object()
+
+
+def check_parity():
+    chol = [None, 0, 150, 199, 200, 239, 240, 241, 300]
+    cases = [
+        (HYPERTENSION, _reference_hypertension, _grid(
+            systolic_bp=[90, 119, 120, 121, 139, 140, 141, 180],
+            diastolic_bp=[60, 79, 80, 81, 89, 90, 91, 120])),
+        (HYPERLIPIDEMIA, _reference_hyperlipidemia, _grid(
+            cholesterol=chol, high_fat_diet=[0, 1, 2, 3, _ABSENT], active=[0, 1, _ABSENT],
+            alcohol=[0, 1], stress_level=[0, 1, 2], family_heart_disease=[0, 1])),
+        (ARRHYTHMIA, _reference_arrhythmia, _grid(
+            arrhythmia_symptoms=[_ABSENT] + [["s"] * k for k in range(9)],
+            hypertension=[0, 1], family_heart_disease=[0, 1], smoke=[0, 1],
+            active=[0, 1, _ABSENT], cholesterol=chol)),
+        (CAD, _reference_cad, _grid(
+            age=[39, 40], gender=["Female", "Male", "Other"], hypertension=[0, 1],
+            family_heart_disease=[0, 1], bmi=[None, 29.9, 30.0], cholesterol=[None, 239, 240],
+            smoke=[0, 1], alcohol=[0, 1], active=[0, 1, _ABSENT], stress_level=[1, 2],
+            high_fat_diet=[1, 2], symptoms=[[], ["dizziness"], ["chest_tightness"], list(CAD_SYMPTOMS)])),
+    ]
+
+    ok = True
+    for rule, reference, grid in cases:
+        records = list(grid)
+        expected = [_reference(reference, r) for r in records]
+        scalar = [evaluate_rule(rule, r) for r in records]
+        vector = evaluate_columns(columns_from_records(records), len(records))[rule["name"]]
+        scalar_mismatch = sum(a != b or type(a) is not type(b) for a, b in zip(scalar, expected))
+        vector_mismatch = int((vector != np.array(expected)).sum())
+        passed = scalar_mismatch == 0 and vector_mismatch == 0
+        ok = ok and passed
+        print(f"{'✅' if passed else '❌'} {rule['name']}: {len(records)} cases, "
+              f"mismatches scalar={scalar_mismatch} vectorized={vector_mismatch}")
+    return ok
+
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        sys.exit(0 if check_parity() else 1)
+    print("Usage: python rules.py --check")
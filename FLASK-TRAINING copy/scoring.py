@@ -0,0 +1,165 @@
+from types import SimpleNamespace
+
+from models import (
+    predict_cardio_probability, predict_stroke_probability,
+    predict_cardio_probabilities, predict_stroke_probabilities
+)
+from rules import (
+    HYPERTENSION, HYPERLIPIDEMIA, ARRHYTHMIA, CAD,
+    evaluate_rule, evaluate_record, evaluate_columns, columns_from_records
+)
+
+# ==================================================
+# 機率計算邏輯（使用 dataset / 規則 / ML）
+# ==================================================
+# 從 main.py 獨立出來：process pool 的 worker 只需要 import 這個模組，
+# 不會觸發 main.py 的 Supabase / HTTP client 初始化。
+
+# 規則本身（門檻、分數、機率區間）定義在 rules.py 的規則表；
+# 這裡保留原本的函式名稱給其他地方呼叫。
+
+# ML 模型對應的疾病名稱（規則的名稱在 rules.py）；
+# 會出現在報告裡的疾病就是 DISEASE_NAMES，/overall-insight 的解說庫（disease_library.py）以它為 key
+CARDIO_DISEASE = "Cardiovascular Disease (heart/vessel issues)"
+STROKE_DISEASE = "Stroke (brain blood loss)"
+DISEASE_NAMES = (
+    CARDIO_DISEASE, STROKE_DISEASE,
+    HYPERTENSION["name"], HYPERLIPIDEMIA["name"], CAD["name"], ARRHYTHMIA["name"]
+)
+
+def rule_hypertension(data):
+    return {"name": HYPERTENSION["name"], "probability": evaluate_rule(HYPERTENSION, data)}
+
+def rule_hyperlipidemia(data):
+    return {"name": HYPERLIPIDEMIA["name"], "probability": evaluate_rule(HYPERLIPIDEMIA, data)}
+
+# def rule_atherosclerosis(data):
+#     age = data.age
+#     smoker = data.smoke
+#     sbp = data.systolic_bp
+#     dbp = data.diastolic_bp
+#     chol = data.cholesterol  
+#     family_hd = getattr(data, "family_heart_disease", False)  
+
+#     high_bp = (sbp >= 140 or dbp >= 90)
+#     high_chol = (chol is not None and chol > 240)
+
+#     conditions = 0
+#     conditions += 1 if age > 50 else 0
+#     conditions += 1 if smoker == 1 else 0
+#     conditions += 1 if high_bp else 0
+#     conditions += 1 if high_chol else 0
+#     conditions += 1 if family_hd else 0 
+
+#     if conditions >= 4:
+#         probability = 70.0
+#     elif conditions == 3:
+#         probability = 60.0
+#     elif conditions == 2:
+#         probability = 35.0
+#     else:
+#         probability = 15.0
+
+#     return {"name": "Atherosclerosis (artery hardening)", "probability": probability}
+
+def rule_arrhythmia_by_symptoms(data):
+    """
+    根據勾選的心悸症狀 + 高風險因素計算機率
+    """
+    return {"name": ARRHYTHMIA["name"], "probability": evaluate_rule(ARRHYTHMIA, data)}
+
+def rule_cad(data):
+    """
+    根據高風險因子計算 CAD 機率
+    """
+    return {"name": CAD["name"], "probability": evaluate_rule(CAD, data)}
+
+def calculate_disease_probabilities(data):
+    cardio_prob = predict_cardio_probability(data)
+    stroke_prob = predict_stroke_probability(data)
+    return _combine_probabilities(data, cardio_prob, stroke_prob)
+
+def calculate_disease_probabilities_batch(records):
+    """
+    批次版本：兩個 ML 模型各自整批算一次（一個 feature matrix / 一次 predict_proba），
+    規則也以欄位陣列整批計算。回傳每筆的 (probabilities, frontend_probabilities, rule_report)。
+    """
+    if not records:
+        return []
+    cardio_probs = predict_cardio_probabilities(records)
+    stroke_probs = predict_stroke_probabilities(records)
+    rule_columns = evaluate_columns(columns_from_records(records), len(records))
+    return [
+        _combine_probabilities(
+            data, cardio_prob, stroke_prob,
+            {name: float(values[i]) for name, values in rule_columns.items()}
+        )
+        for i, (data, cardio_prob, stroke_prob) in enumerate(zip(records, cardio_probs, stroke_probs))
+    ]
+
+def _combine_probabilities(data, cardio_prob, stroke_prob, rule_probs=None):
+    # Rule-based probabilities（rule_probs 為批次路徑已算好的 {規則名稱: 機率}）
+    if rule_probs is None:
+        rule_probs = evaluate_record(data)
+    htn = {"name": HYPERTENSION["name"], "probability": rule_probs[HYPERTENSION["name"]]}
+    hpl = {"name": HYPERLIPIDEMIA["name"], "probability": rule_probs[HYPERLIPIDEMIA["name"]]}
+    # ath = rule_atherosclerosis(data)
+    cad = {"name": CAD["name"], "probability": rule_probs[CAD["name"]]}
+    arr = {"name": ARRHYTHMIA["name"], "probability": rule_probs[ARRHYTHMIA["name"]]}
+
+    # 1) 用給 LLM 的 probabilities（可以包含全部）
+    probabilities = [
+        {"name": CARDIO_DISEASE, "probability": cardio_prob},
+        {"name": STROKE_DISEASE, "probability": stroke_prob},
+        htn,
+        hpl,
+        # ath,
+        cad,
+        arr
+    ]
+
+    # 2) rule_report 只放 rule 的部分（你也可以放全部）
+    rule_report = {
+        "possible_diseases": [htn, hpl, arr, cad]
+    }
+    frontend_probabilities = [d for d in probabilities if d["probability"] >= 30]
+
+    
+
+    return probabilities, frontend_probabilities, rule_report
+
+
+# ==================================================
+# Executor 進入點：參數只用 dict，方便 pickle 傳給 process pool
+# ==================================================
+def score_record(fields):
+    return calculate_disease_probabilities(SimpleNamespace(**fields))
+
+def score_records(rows):
+    return calculate_disease_probabilities_batch([SimpleNamespace(**fields) for fields in rows])
+
+# ==================================================
+# 暖機：載入模型並實際算一筆（CPU worker 啟動時與 main.py 的 lifespan 呼叫）
+# ==================================================
+# 第一次計算會 import 規則 / 模型的程式碼並建立各種快取；在回報 ready 之前先做掉，
+# 算出來的機率不合理時直接丟出例外，讓 worker 啟動失敗，不要帶著壞掉的模型上線。
+
+WARMUP_FIELDS = {
+    "age": 55, "gender": "Male", "systolic_bp": 138, "diastolic_bp": 88,
+    "cholesterol": 2, "glucose": 1, "smoke": 1, "alcohol": 0, "active": 1,
+    "height": 170.0, "weight": 78.0, "stress_level": 2, "high_fat_diet": 1,
+    "symptoms": ["chest_tightness"], "hypertension": 1, "family_heart_disease": 0,
+    "avg_glucose_level": 105.0, "bmi": None, "smoking_status": "formerly smoked",
+    "medical_history": "warmup"
+}
+
+def check_scores(result):
+    probabilities, _, _ = result
+    if not probabilities or not all(0 <= d["probability"] <= 100 for d in probabilities):
+        raise RuntimeError(f"Warmup scoring returned invalid probabilities: {probabilities}")
+    return result
+
+def warmup():
+    from models import registry
+    registry.load_all()
+    return check_scores(score_record(WARMUP_FIELDS))
@@ -0,0 +1,115 @@
+import os
+from dotenv import load_dotenv
+
+# ==================================================
+# 可調整的服務參數（皆可由環境變數 / .env 覆寫）
+# ==================================================
+load_dotenv()
+
+# "compiled"：只用匯出的係數計算（serving 不需要 pandas / sklearn）
+# "sklearn" ：載入 pickle，走 scaler.transform + predict_proba
+SCORING_MODE = os.getenv("SCORING_MODE", "compiled")
+
+# "batch" ：python models.py 訓練的 LogisticRegression
+# "online"：online_learning.py 以 partial_fit 持續更新的 SGD 模型（需先執行 bootstrap）
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "batch")
+
+# Executor：blocking I/O（Supabase SDK）走 thread pool，CPU 計算走 process pool
+IO_POOL_SIZE = int(os.getenv("IO_POOL_SIZE", "16"))
+# 每個 uvicorn worker 各有一個 CPU pool，一次計算只要幾十 µs：預設最多 2 個，
+# 並依 WEB_CONCURRENCY（uvicorn --workers 的環境變數）平分核心數，避免 workers × 核心數個 process
+_WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+CPU_POOL_SIZE = int(os.getenv("CPU_POOL_SIZE", str(min(2, max(1, (os.cpu_count() or 1) // _WEB_CONCURRENCY)))))
+CPU_POOL_KIND = os.getenv("CPU_POOL_KIND", "process")  # "process" | "thread"
+
+# Write-behind 報告佇列（risk_reports / overall_reports）
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "50"))
+REPORT_FLUSH_INTERVAL = float(os.getenv("REPORT_FLUSH_INTERVAL", "0.5"))  # 秒
+REPORT_QUEUE_MAX = int(os.getenv("REPORT_QUEUE_MAX", "10000"))
+REPORT_MAX_RETRIES = int(os.getenv("REPORT_MAX_RETRIES", "5"))
+REPORT_RETRY_BASE_DELAY = float(os.getenv("REPORT_RETRY_BASE_DELAY", "0.5"))  # 秒
+REPORT_SPILL_PATH = os.getenv("REPORT_SPILL_PATH", "pending_reports.jsonl")
+REPORT_DEAD_LETTER_PATH = os.getenv("REPORT_DEAD_LETTER_PATH", "rejected_reports.jsonl")  # 資料庫拒絕的列，不會重播
+
+# Gemini 回應快取：記憶體 LRU + 選用的 SQLite 磁碟層（路徑留空即停用）
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(6 * 3600)))  # 秒
+LLM_CACHE_SQLITE_PATH = os.getenv("LLM_CACHE_SQLITE_PATH", "")
+
+# /predict/stream 最後等待 report id 的上限（秒）；逾時回傳 null，資料仍在背景寫入
+STREAM_REPORT_ID_TIMEOUT = float(os.getenv("STREAM_REPORT_ID_TIMEOUT", "5"))
+
+# Gemini client：並行上限、connection pool、timeout、重試與 circuit breaker
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "64"))
+GEMINI_MAX_KEEPALIVE = int(os.getenv("GEMINI_MAX_KEEPALIVE", "32"))
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "5"))  # 秒
+GEMINI_READ_TIMEOUT = float(os.getenv("GEMINI_READ_TIMEOUT", "60"))  # 秒（串流時為兩個 chunk 之間的上限）
+GEMINI_WRITE_TIMEOUT = float(os.getenv("GEMINI_WRITE_TIMEOUT", "10"))  # 秒
+GEMINI_POOL_TIMEOUT = float(os.getenv("GEMINI_POOL_TIMEOUT", "10"))  # 秒，等待可用連線
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))  # 秒
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "8"))  # 秒
+GEMINI_RETRY_AFTER_MAX = float(os.getenv("GEMINI_RETRY_AFTER_MAX", "30"))  # 秒，Retry-After 最多等這麼久
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))  # 秒
+GEMINI_PREWARM = os.getenv("GEMINI_PREWARM", "1") == "1"  # 啟動時先建立到 Gemini 的連線（main.py lifespan）
+
+# 訓練（python models.py）：k-fold 數、平行度（-1 = 全部核心）、選最佳參數用的指標
+# 預設用 log loss 選參數：分數會直接顯示給使用者，機率需要校準，不只是排序正確（AUC）
+TRAIN_CV_FOLDS = int(os.getenv("TRAIN_CV_FOLDS", "5"))
+TRAIN_N_JOBS = int(os.getenv("TRAIN_N_JOBS", "-1"))
+TRAIN_REFIT_METRIC = os.getenv("TRAIN_REFIT_METRIC", "neg_log_loss")  # "roc_auc" | "neg_brier_score" | "neg_log_loss"
+
+# 訓練資料的欄位式快取（dataset_cache.py）
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", ".dataset_cache")
+
+# 增量學習（online_learning.py）
+ONLINE_CHECKPOINT_DIR = os.getenv("ONLINE_CHECKPOINT_DIR", "online_checkpoints")
+ONLINE_BATCH_SIZE = int(os.getenv("ONLINE_BATCH_SIZE", "256"))
+ONLINE_ALPHA = float(os.getenv("ONLINE_ALPHA", "0.0001"))  # SGD L2 正則化強度
+ONLINE_LEARNING_RATE = float(os.getenv("ONLINE_LEARNING_RATE", "0.01"))
+ONLINE_BOOTSTRAP_EPOCHS = int(os.getenv("ONLINE_BOOTSTRAP_EPOCHS", "5"))
+
+# 請求追蹤（tracing.py）："off" | "header"（只追蹤管理員帶 X-Trace: 1 的請求，見 ADMIN_USER_IDS）| "all"
+TRACING = os.getenv("TRACING", "off")
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "traces.jsonl")
+TRACE_EXPORT_FORMAT = os.getenv("TRACE_EXPORT_FORMAT", "jsonl")  # "jsonl" | "otlp"（OTLP/JSON，每行一個 ExportTraceServiceRequest）
+
+# 取樣 profiler（profiler.py）：PROFILING=1 時才掛上；每 PROFILE_SAMPLE_EVERY 個請求 profile 一個（0 = 暫停），
+# 管理員可用 PUT /admin/profiling 即時調整
+PROFILING = os.getenv("PROFILING", "0") == "1"
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "100"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))  # 秒，取樣間隔
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+ADMIN_USER_IDS = {u.strip() for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip()}  # JWT sub
+
+# 已驗證 JWT 的快取（token_cache.py）：最多幾筆、最多信任幾秒（且不超過 token 的 exp）
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))  # 秒
+
+# 結構化 log（logs.py）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # DEBUG | INFO | WARNING | ERROR
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" | "text"
+
+# /overall-insight 伺服器端彙總（report_history.py）
+OVERALL_AGGREGATE_SOURCE = os.getenv("OVERALL_AGGREGATE_SOURCE", "reports")  # "reports" | "daily"（需先執行 migrations/001）
+OVERALL_MIN_PROBABILITY = float(os.getenv("OVERALL_MIN_PROBABILITY", "30"))  # 與前端相同：只分析中高風險
+REPORT_QUERY_PAGE_SIZE = int(os.getenv("REPORT_QUERY_PAGE_SIZE", "1000"))  # Supabase 預設單次最多回傳 1000 列
+REPORTS_PAGE_DEFAULT = int(os.getenv("REPORTS_PAGE_DEFAULT", "20"))  # GET /reports 每頁筆數
+REPORTS_PAGE_MAX = int(os.getenv("REPORTS_PAGE_MAX", "100"))
+
+# /overall-insight 的疾病解說庫（disease_library.py）與 general_note
+DISEASE_LIBRARY_PATH = os.getenv("DISEASE_LIBRARY_PATH", "disease_explanations.json")
+# 執行中由 Gemini 補上的解說寫在這裡（不進 git）；版本控制的庫只由 python disease_library.py --generate 修改
+DISEASE_LIBRARY_OVERLAY_PATH = os.getenv("DISEASE_LIBRARY_OVERLAY_PATH", "disease_explanations.local.json")
+OVERALL_NOTE_MODE = os.getenv("OVERALL_NOTE_MODE", "llm")  # "llm"（失敗時改用範本）| "template"（不呼叫 LLM）
+
+# /predict 的 LLM latency budget（秒）：超過就回傳範本報告（report_templates.py），0 = 一直等 Gemini
+# 請求可用 X-LLM-Budget header 指定自己的 budget（PREDICT_LLM_BUDGET_MIN ~ PREDICT_LLM_BUDGET_MAX）；
+# 只有伺服器設定能關掉 deadline，header 給 0 或負數時沿用 PREDICT_LLM_BUDGET
+PREDICT_LLM_BUDGET = float(os.getenv("PREDICT_LLM_BUDGET", "0"))
+PREDICT_LLM_BUDGET_MIN = float(os.getenv("PREDICT_LLM_BUDGET_MIN", "0.5"))
+PREDICT_LLM_BUDGET_MAX = float(os.getenv("PREDICT_LLM_BUDGET_MAX", "30"))
+PREDICT_LLM_BACKFILL = os.getenv("PREDICT_LLM_BACKFILL", "1") == "1"  # Gemini 之後才回來時，更新已存的報告
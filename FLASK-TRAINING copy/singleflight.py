@@ -0,0 +1,37 @@
+import asyncio
+
+# ==================================================
+# Single-flight：相同 key 的並行請求只打一次上游
+# ==================================================
+# 第一個呼叫者建立 task，之後相同 key 的呼叫者都 await 同一個 task。
+# 每個等待者都透過 asyncio.shield 等待，所以某個使用者取消（斷線）
+# 只會取消他自己的等待，不會取消共用的上游呼叫。
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}  # key -> asyncio.Task
+        self.leaders = 0  # 實際打到上游的次數
+        self.shared = 0   # 搭便車（共用結果）的次數
+
+    def in_flight(self, key):
+        return key in self._calls
+
+    async def do(self, key, fn):
+        """fn：無參數、回傳 coroutine 的函式；只有 key 沒有進行中的呼叫時才會執行"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.leaders += 1
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有等待者都已取消時，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
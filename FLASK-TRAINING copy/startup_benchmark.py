@@ -0,0 +1,180 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+
+import httpx
+
+from loadtest import Stack, SAMPLE_INPUT, mint_token
+
+# ==================================================
+# 冷啟動量測：python startup_benchmark.py --runs 5
+# ==================================================
+# 每一輪都是全新的 process：
+#   import：新的 interpreter 只 import main（不啟動 server），記錄 import 時間與載入了哪些重量級套件
+#   serve ：啟動 `uvicorn main:app`（Gemini / Supabase 用 loadtest.py 的 stub），量
+#           spawn → /healthz 可回應、spawn → 第一個 /predict 完成，以及第一個與第二個 /predict 的延遲差
+#           （第一個請求多付的冷啟動成本）。server log 裡的 worker_ready 事件提供 lifespan 各階段時間。
+# 每個 /predict 的 medical_history 都不同，不會命中 LLM 快取（包含 SQLite）；Gemini stub 為固定延遲。
+# 回報各項的 median / min / max；--json 輸出每一輪的原始數字。
+
+HEAVY_MODULES = ("pandas", "sklearn", "joblib", "numpy", "supabase", "postgrest", "httpx")
+
+IMPORT_PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({{"import_s": elapsed, "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import():
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], capture_output=True, text=True, check=True,
+        env={**os.environ, "LOG_LEVEL": "ERROR"}
+    ).stdout
+    process_s = time.perf_counter() - start
+    result = json.loads(out.strip().splitlines()[-1])
+    result["process_s"] = process_s
+    return result
+
+
+def _predict_body():
+    return {**SAMPLE_INPUT, "medical_history": f"startup benchmark {uuid.uuid4()}"}
+
+
+async def _timed_predict(client, headers):
+    start = time.perf_counter()
+    response = await client.post("/predict", json=_predict_body(), headers=headers)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def _worker_ready_events(path):
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.startswith("{"):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("event") == "worker_ready":
+                events.append(record)
+    return events
+
+
+async def measure_serve(stack, log_dir, headers):
+    start = time.perf_counter()
+    await stack.start_app(poll_interval=0.01)
+    ready_s = time.perf_counter() - start
+    try:
+        async with httpx.AsyncClient(base_url=stack.app_url, timeout=60) as client:
+            first_s = await _timed_predict(client, headers)
+            first_response_s = time.perf_counter() - start
+            warm_s = await _timed_predict(client, headers)
+    finally:
+        stack.stop("app")
+    result = {
+        "ready_s": ready_s,
+        "first_response_s": first_response_s,
+        "first_predict_ms": first_s * 1000,
+        "warm_predict_ms": warm_s * 1000,
+    }
+    events = _worker_ready_events(os.path.join(log_dir, f"app-w{stack.workers}.log"))
+    if events:
+        result["lifespan_s"] = max(e["startup_seconds"] for e in events)
+        result["phases"] = events[-1].get("phases")
+    return result
+
+
+ROWS = (
+    ("import_s", "import main (s)"),
+    ("process_s", "interpreter + import (s)"),
+    ("ready_s", "spawn → /healthz ready (s)"),
+    ("lifespan_s", "lifespan startup (s, server log)"),
+    ("first_response_s", "spawn → first /predict done (s)"),
+    ("first_predict_ms", "first /predict (ms)"),
+    ("warm_predict_ms", "second /predict (ms)"),
+)
+
+
+def summarize(runs):
+    summary = {}
+    for key, _ in ROWS:
+        values = [r[key] for r in runs if r.get(key) is not None]
+        if values:
+            summary[key] = {
+                "median": round(statistics.median(values), 4),
+                "min": round(min(values), 4),
+                "max": round(max(values), 4),
+            }
+    return summary
+
+
+def print_summary(summary, runs):
+    print(f"\n{'metric':36} {'median':>10} {'min':>10} {'max':>10}")
+    for key, label in ROWS:
+        r = summary.get(key)
+        if r:
+            print(f"{label:36} {r['median']:>10} {r['min']:>10} {r['max']:>10}")
+    print(f"heavy modules loaded by `import main`: {', '.join(runs[-1]['heavy']) or '-'}")
+    phases = runs[-1].get("phases")
+    if phases:
+        print("lifespan phases (last run): " + ", ".join(f"{k}={v}s" for k, v in phases.items()))
+
+
+async def main_async(args):
+    stub_args = SimpleNamespace(
+        port=args.port, startup_timeout=args.startup_timeout,
+        gemini_latency=args.gemini_latency, gemini_dist="fixed", gemini_jitter=0.0, gemini_sigma=0.0,
+        gemini_error_rate=0.0, supabase_latency=0.01, supabase_error_rate=0.0
+    )
+    log_dir = tempfile.mkdtemp(prefix="startup-")
+    print(f"INFO: Server logs in {log_dir}")
+    headers = {"Authorization": f"Bearer {mint_token()}"}
+    stack = Stack(args.workers, stub_args, log_dir)
+    runs = []
+    try:
+        await stack.start_stubs()
+        for i in range(args.runs):
+            run = measure_import()
+            run.update(await measure_serve(stack, log_dir, headers))
+            runs.append(run)
+            print(f"run {i + 1}/{args.runs}: import {run['import_s']:.3f}s, ready {run['ready_s']:.3f}s, "
+                  f"first /predict {run['first_predict_ms']:.1f} ms (warm {run['warm_predict_ms']:.1f} ms)")
+    finally:
+        stack.stop_all()
+
+    summary = summarize(runs)
+    print_summary(summary, runs)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "summary": summary, "runs": runs}, f, indent=2)
+        print(f"✅ Results written to {args.json}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import time and time-to-first-response of main:app.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes to start")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn --workers")
+    parser.add_argument("--port", type=int, default=8200, help="app port; stubs use port+1 (Gemini) and port+2 (Supabase)")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--gemini-latency", type=float, default=0.05, help="fixed stub Gemini latency in seconds")
+    parser.add_argument("--json", help="write all results to this file")
+    args = parser.parse_args(argv)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
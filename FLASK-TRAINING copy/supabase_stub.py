@@ -0,0 +1,235 @@
+import asyncio
+import itertools
+import os
+import random
+import re
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+# ==================================================
+# 本機 Supabase / PostgREST stub（離線測試 / 壓測用）
+# ==================================================
+# 只實作 main.py 透過 supabase-py 用到的 REST 介面，資料存在記憶體：
+#   POST /rest/v1/<table>   insert（單筆或多筆；Prefer: return=representation 時回傳寫入的列）
+#   PATCH /rest/v1/<table>  update（條件與 select 相同；/predict 回填晚到的 LLM 報告會用到）
+#   GET  /rest/v1/<table>   select（select=欄位、col=eq.值 / gt / gte / lt / lte / neq、order=、limit=）
+#                           select 支援 JSON 路徑與別名，例如 llm:llm_report->possible_diseases；
+#                           or=(...) / and=(...) 邏輯條件（可巢狀，值可加雙引號），keyset 分頁會用到
+# 每列自動補上 id 與 created_at。
+# 寫入 risk_reports 時模擬 migrations/001_risk_report_daily_max.sql 的 trigger，
+# 更新 risk_report_daily_max（每位使用者、每天、每個疾病的最高機率）。
+#
+#   uvicorn supabase_stub:app --port 8002
+#   SUPABASE_URL=http://127.0.0.1:8002 uvicorn main:app
+#
+# 可用環境變數調整：
+#   SUPABASE_STUB_LATENCY     每個請求的延遲（秒）
+#   SUPABASE_STUB_ERROR_RATE  回傳 503 的機率（0~1）
+
+LATENCY = float(os.getenv("SUPABASE_STUB_LATENCY", "0.01"))
+ERROR_RATE = float(os.getenv("SUPABASE_STUB_ERROR_RATE", "0"))
+
+app = FastAPI()
+tables = {}
+stats = {"requests": 0, "errors": 0, "rows_inserted": 0, "rows_updated": 0}
+_ids = itertools.count(1)
+
+_OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+}
+_RESERVED_PARAMS = {"select", "order", "limit", "offset", "columns"}
+_LOGIC_PARAMS = {"and", "or"}
+
+
+def _coerce(raw, sample):
+    # query string 都是字串 → 依欄位現有值的型別轉換後再比較
+    if isinstance(sample, bool):
+        return raw == "true"
+    if isinstance(sample, int):
+        return int(raw)
+    if isinstance(sample, float):
+        return float(raw)
+    return raw
+
+
+def _matches(row, filters):
+    for col, op, raw in filters:
+        value = row.get(col)
+        if value is None:
+            return False
+        if not _OPERATORS[op](value, _coerce(raw, value)):
+            return False
+    return True
+
+
+def _split_top(text):
+    # 以最外層的逗號切開（略過括號與雙引號內的逗號）
+    parts, current, depth, quoted = [], "", 0, False
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and ch == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        current += ch
+    parts.append(current)
+    return parts
+
+
+def _parse_condition(text):
+    # "and(...)" / "or(...)" / "col.op.value"
+    for logic in _LOGIC_PARAMS:
+        if text.startswith(logic + "("):
+            return logic, [_parse_condition(part) for part in _split_top(text[len(logic) + 1:-1])]
+    col, op, raw = text.split(".", 2)
+    if op not in _OPERATORS:
+        raise ValueError(f"unsupported operator {op}")
+    return "filter", (col, op, raw.strip('"'))
+
+
+def _evaluate(row, node):
+    kind, value = node
+    if kind == "filter":
+        return _matches(row, [value])
+    results = (_evaluate(row, child) for child in value)
+    return all(results) if kind == "and" else any(results)
+
+
+def _select_item(row, item):
+    # "alias:col->key->>key"：PostgREST 的欄位名稱預設為路徑最後一段
+    alias, _, expr = item.rpartition(":")
+    parts = re.split(r"->>?", expr)
+    value = row.get(parts[0])
+    for key in parts[1:]:
+        value = value.get(key) if isinstance(value, dict) else None
+    return alias or parts[-1], value
+
+
+def _project(row, select):
+    if not select or select == "*":
+        return row
+    return dict(_select_item(row, item) for item in (c.strip() for c in select.split(",")) if item)
+
+
+def _risk_report_daily_max(rows):
+    daily = tables.setdefault("risk_report_daily_max", [])
+    index = {(r["user_id"], r["day"], r["name"]): r for r in daily}
+    for row in rows:
+        day = row["created_at"][:10]
+        for field in ("llm_report", "rule_report"):
+            for d in (row.get(field) or {}).get("possible_diseases") or []:
+                key = (row.get("user_id"), day, d["name"])
+                if key in index:
+                    index[key]["probability"] = max(index[key]["probability"], d["probability"])
+                else:
+                    index[key] = {"user_id": key[0], "day": day, "name": key[2], "probability": d["probability"]}
+                    daily.append(index[key])
+
+
+_TRIGGERS = {"risk_reports": _risk_report_daily_max}
+
+
+async def _preamble():
+    stats["requests"] += 1
+    if LATENCY > 0:
+        await asyncio.sleep(LATENCY)
+    if ERROR_RATE > 0 and random.random() < ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse({"message": "stub injected error", "code": "503"}, status_code=503)
+    return None
+
+
+@app.post("/rest/v1/{table}")
+async def insert_rows(table: str, request: Request):
+    error = await _preamble()
+    if error is not None:
+        return error
+    body = await request.json()
+    rows = body if isinstance(body, list) else [body]
+    now = datetime.now(timezone.utc).isoformat()
+    inserted = [{"id": next(_ids), "created_at": now, **row} for row in rows]
+    tables.setdefault(table, []).extend(inserted)
+    if table in _TRIGGERS:
+        _TRIGGERS[table](inserted)
+    stats["rows_inserted"] += len(inserted)
+
+    if "return=representation" in request.headers.get("prefer", ""):
+        return JSONResponse(inserted, status_code=201)
+    return Response(status_code=201)
+
+
+def _filtered_rows(table, params):
+    """query string 的條件 → 符合的列；不支援的條件丟出 ValueError"""
+    filters = []
+    logic = []
+    for col, value in params.multi_items():
+        if col in _RESERVED_PARAMS:
+            continue
+        if col in _LOGIC_PARAMS:
+            logic.append(_parse_condition(col + value))
+            continue
+        op, _, raw = value.partition(".")
+        if op not in _OPERATORS:
+            raise ValueError(f"unsupported operator {op}")
+        filters.append((col, op, raw.strip('"')))
+    return [
+        row for row in tables.get(table, [])
+        if _matches(row, filters) and all(_evaluate(row, node) for node in logic)
+    ]
+
+
+@app.patch("/rest/v1/{table}")
+async def update_rows(table: str, request: Request):
+    error = await _preamble()
+    if error is not None:
+        return error
+    try:
+        rows = _filtered_rows(table, request.query_params)
+    except ValueError as e:
+        return JSONResponse({"message": str(e)}, status_code=400)
+    values = await request.json()
+    for row in rows:
+        row.update(values)
+    stats["rows_updated"] += len(rows)
+
+    if "return=representation" in request.headers.get("prefer", ""):
+        return JSONResponse(rows)
+    return Response(status_code=204)
+
+
+@app.get("/rest/v1/{table}")
+async def select_rows(table: str, request: Request):
+    error = await _preamble()
+    if error is not None:
+        return error
+    params = request.query_params
+    try:
+        rows = _filtered_rows(table, params)
+    except ValueError as e:
+        return JSONResponse({"message": str(e)}, status_code=400)
+    for part in reversed(params.get("order", "").split(",")):
+        if not part:
+            continue
+        col, _, direction = part.partition(".")
+        rows.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=direction.startswith("desc"))
+    offset = int(params.get("offset", 0))
+    limit = params.get("limit")
+    rows = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+    return [_project(row, params.get("select")) for row in rows]
+
+
+@app.get("/stats")
+async def get_stats():
+    return {**stats, "tables": {name: len(rows) for name, rows in tables.items()}}
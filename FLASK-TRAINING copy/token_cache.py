@@ -0,0 +1,54 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+from settings import AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL
+
+# ==================================================
+# 已驗證 JWT 的快取（給 get_current_user 用）
+# ==================================================
+# 同一個 access token 在到期前會被重複使用很多次；驗證過一次之後，
+# 以 sha256(token) 為 key 記住解碼結果，不必每個請求都重算 HS256 簽章。
+# - 只快取驗證成功的 token（失敗的每次都重新驗證）
+# - 有效期限 = min(token 的 exp, 現在 + AUTH_CACHE_TTL)，過期一定重新驗證
+# - LRU，最多 AUTH_CACHE_MAX_ENTRIES 筆
+# 只在 event loop thread 上使用，不需要鎖。
+
+
+class VerifiedTokenCache:
+    def __init__(self, max_entries=AUTH_CACHE_MAX_ENTRIES, ttl=AUTH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # digest -> (expires_at, payload)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, payload):
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        self._entries[key] = (expires_at, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,204 @@
+import contextvars
+import json
+import os
+import threading
+import time
+
+from executors import run_io
+from settings import TRACING, TRACE_EXPORT_PATH, TRACE_EXPORT_FORMAT
+
+# ==================================================
+# 單一請求的追蹤（opt-in）
+# ==================================================
+# TRACING="header"：只追蹤帶 `X-Trace: 1` 且 allow(scope) 為 True 的請求（main.py 只允許管理員的 token，
+# 避免任何人都能讓伺服器寫 span 檔）；"all"：全部追蹤；"off"：不掛 middleware。
+# 被追蹤的請求回應會帶 X-Trace-Id，各階段的 span（metrics.stage 與 span()）寫到
+# TRACE_EXPORT_PATH：jsonl 為每行一個 trace；otlp 為 OTLP/JSON（OpenTelemetry file exporter 格式）。
+#
+#   with span("gemini.generate") as s:
+#       ...
+#       s.set("prompt_tokens", 123)
+#
+# 目前請求沒有被追蹤時 span() 只讀一次 ContextVar，回傳共用的 no-op 物件。
+
+SERVICE_NAME = "cardio-risk-api"
+
+_trace = contextvars.ContextVar("trace", default=None)
+_parent = contextvars.ContextVar("trace_parent_span", default=None)
+_write_lock = threading.Lock()
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+
+
+class Span:
+    __slots__ = ("trace", "name", "attributes", "span_id", "parent_id", "start_ns", "end_ns", "error", "_token")
+
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.error = None
+
+    def __enter__(self):
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = _parent.get()
+        self.start_ns = time.time_ns()
+        self._token = _parent.set(self.span_id)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        try:
+            _parent.reset(self._token)
+        except ValueError:
+            pass  # 在不同的 context 結束（例如跨 async generator 的 yield）
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.trace.spans.append(self)
+        return False
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name, **attributes):
+    trace = _trace.get()
+    if trace is None:
+        return _NOOP
+    return Span(trace, name, attributes)
+
+
+def current_trace_id():
+    trace = _trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+# ---------- 匯出 ----------
+
+def _jsonl_record(trace):
+    root = next(s for s in trace.spans if s.parent_id is None)
+    return {
+        "trace_id": trace.trace_id,
+        "name": root.name,
+        "start": root.start_ns / 1e9,
+        "duration_ms": round((root.end_ns - root.start_ns) / 1e6, 3),
+        "attributes": root.attributes,
+        "spans": [
+            {
+                "span_id": s.span_id,
+                "parent_id": s.parent_id,
+                "name": s.name,
+                "offset_ms": round((s.start_ns - root.start_ns) / 1e6, 3),
+                "duration_ms": round((s.end_ns - s.start_ns) / 1e6, 3),
+                "attributes": s.attributes,
+                **({"error": s.error} if s.error else {})
+            }
+            for s in sorted(trace.spans, key=lambda s: s.start_ns)
+        ]
+    }
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_record(trace):
+    spans = []
+    for s in trace.spans:
+        item = {
+            "traceId": trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1 if s.parent_id else 2,  # INTERNAL / SERVER
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {}
+        }
+        if s.parent_id:
+            item["parentSpanId"] = s.parent_id
+        spans.append(item)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}]
+        }]
+    }
+
+
+def _append_line(path, line):
+    with _write_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class TracingMiddleware:
+    """純 ASGI middleware：建立 trace 與 root span，回應加上 X-Trace-Id，結束後在 IO pool 匯出"""
+
+    def __init__(self, app, mode=TRACING, path=TRACE_EXPORT_PATH, fmt=TRACE_EXPORT_FORMAT, allow=None):
+        self.app = app
+        self.mode = mode
+        self.allow = allow  # header 模式下判斷請求能否要求追蹤（None = 都不行）
+        self.path = path
+        self.to_record = _otlp_record if fmt == "otlp" else _jsonl_record
+
+    def _wanted(self, scope):
+        if self.mode == "all":
+            return True
+        if not any(name == b"x-trace" and value.strip() == b"1" for name, value in scope.get("headers", [])):
+            return False
+        return self.allow is not None and self.allow(scope)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wanted(scope):
+            return await self.app(scope, receive, send)
+
+        trace = Trace()
+        header = (b"x-trace-id", trace.trace_id.encode())
+        root = Span(trace, f"{scope['method']} {scope['path']}", {"http.method": scope["method"]})
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), header]
+                root.set("http.status_code", message["status"])
+            await send(message)
+
+        token = _trace.set(trace)
+        try:
+            with root:
+                await self.app(scope, receive, send_with_trace_id)
+        finally:
+            _trace.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+            line = json.dumps(self.to_record(trace), ensure_ascii=False, default=str)
+            await run_io(_append_line, self.path, line)